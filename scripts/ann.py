@@ -0,0 +1,446 @@
+"""
+Approximate-nearest-neighbor index types for Index, and a benchmark to choose between them.
+
+Supported index types:
+    flat      exact brute-force search (faiss.IndexFlatL2), the default
+    ivf_flat  inverted file over nlist k-means cells, full vectors. Tuned per query with nprobe
+    hnsw      hierarchical navigable small world graph. Tuned per query with ef_search
+    ivf_pq    inverted file with product-quantized vectors (pq_m bytes per vector at 8 bits). Tuned with nprobe
+    sq_fp16   exact search over vectors stored as float16, half the memory of flat
+    sq8       exact search over vectors stored as one byte per value, a quarter of the memory of flat
+    pq        exhaustive search over product-quantized vectors, pq_m bytes per vector at 8 bits
+
+The compressed types (COMPRESSED_TYPES) lose some precision. Index keeps the full-precision vectors
+in a memory-mapped file next to them and re-ranks the best candidates of the compressed search exactly,
+see rerank().
+
+Usage (benchmark recall@k against flat, latency and memory saved, on an existing database):
+    python ann.py database/bp_db -k 10 --types flat ivf_flat hnsw ivf_pq --nprobe 4 16 64 --ef-search 32 128
+    python ann.py database/bp_db -k 10 --types flat sq8 pq --rerank 0 4 --dimensions 256 512
+"""
+
+import argparse
+import json
+import math
+import os
+import time
+
+import faiss
+import numpy as np
+
+
+INDEX_TYPES = ('flat', 'ivf_flat', 'hnsw', 'ivf_pq', 'sq_fp16', 'sq8', 'pq')
+
+# Index types storing lossy codes instead of the vectors, whose results are worth re-ranking
+COMPRESSED_TYPES = ('ivf_pq', 'sq_fp16', 'sq8', 'pq')
+
+# Parameters used when an index type is built without them
+DEFAULT_PARAMS = {'nlist': None,          # None picks about 4 * sqrt(number of vectors)
+                  'hnsw_m': 32,
+                  'ef_construction': 40,
+                  'pq_m': 96,
+                  'pq_nbits': 8}
+
+
+def default_nlist(count):
+    """Number of IVF cells for count vectors, keeping at least ~39 training points per cell"""
+    return max(1, min(int(4 * math.sqrt(max(count, 1))), count // 39))
+
+
+def index_spec(index_type, dimension, count=0, **params):
+    """
+    Return the faiss.index_factory() string for an index type.
+
+    Args:
+        index_type (str): One of INDEX_TYPES
+        dimension (int): Dimension of the vectors
+        count (int): Number of vectors the index will be trained on, used to pick nlist
+        params: Overrides of DEFAULT_PARAMS
+    """
+    params = {**DEFAULT_PARAMS, **{key: value for key, value in params.items() if value is not None}}
+    nlist = params['nlist'] or default_nlist(count)
+
+    if index_type == 'flat':
+        return 'Flat'
+    if index_type == 'ivf_flat':
+        return f'IVF{nlist},Flat'
+    if index_type == 'hnsw':
+        return f"HNSW{params['hnsw_m']}"
+    if index_type == 'ivf_pq':
+        if dimension % params['pq_m']:
+            raise ValueError(f"pq_m ({params['pq_m']}) must divide the dimension ({dimension})")
+        return f"IVF{nlist},PQ{params['pq_m']}x{params['pq_nbits']}"
+    if index_type == 'sq_fp16':
+        return 'SQfp16'
+    if index_type == 'sq8':
+        return 'SQ8'
+    if index_type == 'pq':
+        if dimension % params['pq_m']:
+            raise ValueError(f"pq_m ({params['pq_m']}) must divide the dimension ({dimension})")
+        return f"PQ{params['pq_m']}x{params['pq_nbits']}"
+    raise ValueError(f'index_type must be one of {INDEX_TYPES}, not {index_type}')
+
+
+def make_index(index_type, dimension, count=0, **params):
+    """Create an empty faiss index of the given type. IVF types must be trained before vectors are added"""
+    index = faiss.index_factory(dimension, index_spec(index_type, dimension, count, **params), faiss.METRIC_L2)
+    if index_type == 'hnsw':
+        index.hnsw.efConstruction = params.get('ef_construction') or DEFAULT_PARAMS['ef_construction']
+    return index
+
+
+def build_index(index_type, vectors, **params):
+    """Create an index of the given type, train it on vectors if needed, and add vectors to it"""
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    index = make_index(index_type, vectors.shape[1], len(vectors), **params)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def index_vectors(index):
+    """Return every vector stored in a faiss index as an np.array of float32 (lossy for ivf_pq)"""
+    if index.ntotal == 0:
+        return np.empty((0, index.d), dtype='float32')
+    try:
+        ivf = faiss.extract_index_ivf(index)
+        ivf.make_direct_map()
+    except RuntimeError:
+        pass
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def search_params(index, nprobe=None, ef_search=None, sel=None):
+    """
+    Return faiss search parameters for one query, or None to use the index's own settings.
+
+    nprobe only applies to IVF indexes and ef_search only to HNSW indexes; the other is ignored. sel is
+    a faiss.IDSelector restricting the ids that can be returned.
+    """
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        ivf = None
+
+    if ivf is not None and (nprobe is not None or sel is not None):
+        return faiss.SearchParametersIVF(sel=sel, nprobe=nprobe if nprobe is not None else ivf.nprobe)
+    if hasattr(index, 'hnsw') and (ef_search is not None or sel is not None):
+        return faiss.SearchParametersHNSW(sel=sel, efSearch=ef_search if ef_search is not None else index.hnsw.efSearch)
+    if sel is not None:
+        return faiss.SearchParameters(sel=sel)
+    return None
+
+
+def set_default_search_params(index, nprobe=None, ef_search=None):
+    """Set the nprobe / efSearch an index uses when no per-query parameters are given"""
+    if nprobe is not None:
+        try:
+            faiss.extract_index_ivf(index).nprobe = nprobe
+        except RuntimeError:
+            pass
+    if ef_search is not None and hasattr(index, 'hnsw'):
+        index.hnsw.efSearch = ef_search
+
+
+def index_size(index):
+    """Size of the serialized index in bytes"""
+    return len(faiss.serialize_index(index))
+
+
+def flat_vectors(index):
+    """View of the vectors stored in a flat index as an np.array, without copying them"""
+    return faiss.rev_swig_ptr(index.get_xb(), index.ntotal * index.d).reshape(index.ntotal, index.d)
+
+
+def reconstruct(index, ids):
+    """Return the vectors stored under ids as an np.array of float32 (lossy for ivf_pq)"""
+    try:
+        ivf = faiss.extract_index_ivf(index)
+        if ivf.direct_map.no():
+            ivf.make_direct_map()
+    except RuntimeError:
+        pass
+    return index.reconstruct_batch(np.asarray(ids, dtype='int64'))
+
+
+def rerank(vectors, query, ids, k):
+    """
+    Re-rank candidate ids by their exact distance to query and return the k nearest.
+
+    Args:
+        vectors (np.array): Full-precision vectors of every id, typically an np.memmap, so only the rows
+    of the candidates are read from disk
+        query (np.array): Query vector
+        ids (np.array): Candidate ids, e.g. the top results of a search over compressed codes
+        k (int): Number of results
+
+    Returns:
+        (distances, ids) of the k nearest candidates, nearest first
+    """
+    ids = np.asarray(ids, dtype='int64')
+    if len(ids) == 0:
+        return np.empty(0, dtype='float32'), ids
+    # Read the rows in file order
+    ids = np.sort(ids)
+    candidates = np.asarray(vectors[ids], dtype='float32')
+    distances = ((candidates - query) ** 2).sum(axis=1)
+    order = np.argsort(distances, kind='stable')[:k]
+    return distances[order], ids[order]
+
+
+def reduce_dimension(vectors, dimension):
+    """
+    Keep the first dimension values of each vector and renormalize them.
+
+    This is what the OpenAI embeddings endpoint returns for text-embedding-3 models when asked for fewer
+    dimensions, so stored embeddings can be shortened without embedding them again.
+    """
+    reduced = np.ascontiguousarray(vectors[:, :dimension], dtype='float32')
+    norms = np.linalg.norm(reduced, axis=1, keepdims=True)
+    return reduced / np.maximum(norms, 1e-12)
+
+
+def exclude_selector(ranges):
+    """Return a faiss.IDSelector matching every id outside the (start, stop) ranges"""
+    ids = np.concatenate([np.arange(start, stop, dtype='int64') for start, stop in ranges])
+    batch = faiss.IDSelectorBatch(ids)
+    selector = faiss.IDSelectorNot(batch)
+    # IDSelectorNot does not own the selector it wraps, so keep it alive alongside
+    selector.referenced_objects = [batch]
+    return selector
+
+
+def merge_results(distances, indices, k):
+    """Merge per-row candidate lists into the k nearest, padding with -1 like faiss does"""
+    distances = np.hstack(distances)
+    indices = np.hstack(indices)
+    if distances.shape[1] < k:
+        padding = k - distances.shape[1]
+        distances = np.hstack([distances, np.full((len(distances), padding), np.inf, dtype='float32')])
+        indices = np.hstack([indices, np.full((len(indices), padding), -1, dtype='int64')])
+    order = np.argsort(distances, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(distances, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+
+def filtered_search(index, queries, k, ranges, nprobe=None, ef_search=None, exact_threshold=50000):
+    """
+    Search only the vectors whose ids fall in ranges.
+
+    Flat indexes search each range of the vector array directly, so the cost is proportional to the size
+    of the filter rather than of the index. Other index types search small filters exactly on their
+    reconstructed vectors, and large filters through an ID selector inside the ANN search.
+
+    Args:
+        index (faiss.Index): Index to search
+        queries (np.array): Query vectors, one per row
+        k (int): Number of results per query
+        ranges (list): (start, stop) ranges of ids that may be returned
+        nprobe (int): IVF cells to visit, for large filters on IVF indexes
+        ef_search (int): HNSW search breadth, for large filters on HNSW indexes
+        exact_threshold (int): Filters up to this many vectors are searched exactly
+
+    Returns:
+        (distances, indices) like faiss.Index.search, with -1 ids where fewer than k vectors match
+    """
+    queries = np.ascontiguousarray(queries, dtype='float32')
+    count = sum(stop - start for start, stop in ranges)
+    empty = (np.full((len(queries), k), np.inf, dtype='float32'), np.full((len(queries), k), -1, dtype='int64'))
+    if count == 0:
+        return empty
+
+    if isinstance(index, faiss.IndexFlat):
+        vectors = flat_vectors(index)
+        distances, indices = [empty[0]], [empty[1]]
+        for start, stop in ranges:
+            range_distances, range_indices = faiss.knn(queries, vectors[start:stop], min(k, stop - start))
+            distances.append(range_distances)
+            indices.append(range_indices + start)
+        return merge_results(distances, indices, k)
+
+    ids = np.concatenate([np.arange(start, stop, dtype='int64') for start, stop in ranges])
+    if count <= exact_threshold:
+        try:
+            faiss.extract_index_ivf(index).make_direct_map()
+        except RuntimeError:
+            pass
+        range_distances, positions = faiss.knn(queries, index.reconstruct_batch(ids), min(k, count))
+        return merge_results([empty[0], range_distances], [empty[1], ids[positions]], k)
+
+    if len(ranges) == 1:
+        selector = faiss.IDSelectorRange(*ranges[0])
+    else:
+        selector = faiss.IDSelectorBatch(ids)
+    params = search_params(index, nprobe, ef_search, sel=selector)
+    return index.search(queries, k, params=params)
+
+
+def recall_at_k(truth, found):
+    """Fraction of the true k nearest neighbors found, averaged over queries"""
+    hits = [len(set(t) & set(f)) for t, f in zip(truth, found)]
+    return sum(hits) / truth.size
+
+
+def time_queries(index, queries, k, params=None, full_vectors=None, rerank_factor=0):
+    """
+    Search queries one at a time (like the server does). Returns (ids, latencies in seconds)
+
+    With full_vectors and a rerank_factor, rerank_factor * k candidates are fetched and re-ranked exactly.
+    """
+    ids = np.full((len(queries), k), -1, dtype='int64')
+    latencies = []
+    depth = k * rerank_factor if full_vectors is not None and rerank_factor else k
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, found = index.search(query.reshape(1, -1), depth, params=params)
+        if depth != k:
+            _, found = rerank(full_vectors, query, found[found >= 0], k)
+            found = found.reshape(1, -1)
+        latencies.append(time.perf_counter() - start)
+        ids[i, :found.shape[1]] = found[0]
+    return ids, np.array(latencies)
+
+
+def benchmark(vectors, queries, k=10, types=INDEX_TYPES, nprobes=(1, 4, 16, 64), ef_searches=(16, 64, 256),
+              rerank_factors=(0,), **params):
+    """
+    Build each index type over vectors and measure recall@k against exact search, latency and size.
+
+    Compressed types are also measured with each of rerank_factors: the best rerank_factor * k results of
+    the compressed search re-ranked against the full-precision vectors (0 means no re-ranking).
+
+    Returns:
+        list of result dictionaries, one per (index type, search setting, rerank factor)
+    """
+    exact = build_index('flat', vectors)
+    truth, _ = time_queries(exact, queries, k)
+    flat_size = index_size(exact)
+
+    results = []
+    for index_type in types:
+        start = time.perf_counter()
+        index = build_index(index_type, vectors, **params)
+        build_s = time.perf_counter() - start
+        size = index_size(index)
+
+        if index_type in ('ivf_flat', 'ivf_pq'):
+            settings = [('nprobe', nprobe) for nprobe in nprobes]
+        elif index_type == 'hnsw':
+            settings = [('ef_search', ef_search) for ef_search in ef_searches]
+        else:
+            settings = [(None, None)]
+        factors = rerank_factors if index_type in COMPRESSED_TYPES else (0,)
+
+        for name, value in settings:
+            for factor in factors:
+                query_params = search_params(index, **{name: value}) if name else None
+                found, latencies = time_queries(index, queries, k, query_params, vectors, factor)
+                results.append({'index_type': index_type,
+                                'setting': f'{name}={value}' if name else '',
+                                'rerank': factor,
+                                f'recall@{k}': recall_at_k(truth, found),
+                                'p50_ms': float(np.percentile(latencies, 50) * 1000),
+                                'p99_ms': float(np.percentile(latencies, 99) * 1000),
+                                'build_s': build_s,
+                                'size_mb': size / 2 ** 20,
+                                'saved': 1 - size / flat_size})
+    return results
+
+
+def dimension_benchmark(vectors, queries, k=10, dimensions=(256, 512)):
+    """
+    Measure recall@k and size of exact search over vectors shortened to each of dimensions, see
+    reduce_dimension(), against exact search at full dimension.
+    """
+    exact = build_index('flat', vectors)
+    truth, _ = time_queries(exact, queries, k)
+    flat_size = index_size(exact)
+
+    results = []
+    for dimension in dimensions:
+        index = build_index('flat', reduce_dimension(vectors, dimension))
+        found, latencies = time_queries(index, reduce_dimension(queries, dimension), k)
+        size = index_size(index)
+        results.append({'index_type': 'flat',
+                        'setting': f'dimensions={dimension}',
+                        'rerank': 0,
+                        f'recall@{k}': recall_at_k(truth, found),
+                        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+                        'p99_ms': float(np.percentile(latencies, 99) * 1000),
+                        'build_s': 0.0,
+                        'size_mb': size / 2 ** 20,
+                        'saved': 1 - size / flat_size})
+    return results
+
+
+def database_vectors(filename):
+    """
+    Return the full-precision vectors of a saved database, the ground truth of benchmark().
+
+    A compressed index only holds lossy codes, so its vectors are read from the <filename>.vectors file
+    saved beside it. Without that file, recall would be measured against the index's own quantization
+    error, so a ValueError is raised.
+    """
+    index = faiss.read_index(f'{filename}.index')
+    if os.path.exists(f'{filename}.vectors'):
+        return np.fromfile(f'{filename}.vectors', dtype='float32').reshape(index.ntotal, index.d)
+
+    index_type = 'flat'
+    if os.path.exists(f'{filename}.params.json'):
+        with open(f'{filename}.params.json', 'r') as f:
+            index_type = json.load(f)['index_type']
+    if index_type in COMPRESSED_TYPES:
+        raise ValueError(f'{filename} is a {index_type} index without its full-precision vectors '
+                         f'({filename}.vectors), so it cannot give exact ground truth')
+    return index_vectors(index)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('filename', type=str, help='Path prefix of the database, e.g. database/bp_db')
+    parser.add_argument('-k', type=int, default=10, help='Number of neighbors to retrieve')
+    parser.add_argument('--types', nargs='+', default=list(INDEX_TYPES), choices=INDEX_TYPES, help='Index types to compare')
+    parser.add_argument('--queries', type=int, default=200, help='Number of queries')
+    parser.add_argument('--noise', type=float, default=0.01,
+                        help='Queries are stored vectors plus Gaussian noise of this standard deviation')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 16, 64], help='nprobe values for IVF types')
+    parser.add_argument('--ef-search', type=int, nargs='+', default=[16, 64, 256], help='efSearch values for hnsw')
+    parser.add_argument('--nlist', type=int, default=None, help='Number of IVF cells')
+    parser.add_argument('--hnsw-m', type=int, default=None, help='Neighbors per HNSW node')
+    parser.add_argument('--pq-m', type=int, default=None, help='Bytes per vector for ivf_pq and pq')
+    parser.add_argument('--rerank', type=int, nargs='+', default=[0, 4],
+                        help='Re-rank factors for compressed types (0 for none)')
+    parser.add_argument('--dimensions', type=int, nargs='*', default=[],
+                        help='Also measure flat search over embeddings shortened to these dimensions')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args()
+
+    try:
+        vectors = database_vectors(args.filename)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # Queries are drawn from the database itself so the benchmark needs no embedding calls
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)
+    queries = (vectors[sample] + rng.normal(0, args.noise, (len(sample), vectors.shape[1]))).astype('float32')
+
+    results = benchmark(vectors, queries, args.k, args.types, args.nprobe, args.ef_search, args.rerank,
+                        nlist=args.nlist, hnsw_m=args.hnsw_m, pq_m=args.pq_m)
+    if args.dimensions:
+        results += dimension_benchmark(vectors, queries, args.k, args.dimensions)
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return
+
+    print(f'{len(vectors)} vectors, {len(queries)} queries, k={args.k}')
+    print(f"{'index_type':<12}{'setting':<16}{'rerank':>7}{'recall':>8}{'p50_ms':>9}{'p99_ms':>9}{'build_s':>9}"
+          f"{'size_mb':>9}{'saved':>7}")
+    for r in results:
+        print(f"{r['index_type']:<12}{r['setting']:<16}{r['rerank']:>7}{r[f'recall@{args.k}']:>8.3f}{r['p50_ms']:>9.3f}"
+              f"{r['p99_ms']:>9.3f}{r['build_s']:>9.2f}{r['size_mb']:>9.1f}{r['saved']:>7.0%}")
+
+
+if __name__ == '__main__':
+    main()
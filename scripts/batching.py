@@ -0,0 +1,146 @@
+"""
+Micro-batching of concurrent searches.
+
+Under load, a server thread per request means one embedding request and one single-row faiss search per
+query. MicroBatcher gathers the searches that arrive within a few milliseconds of each other and runs them
+as one Index.search_batch() call: one embeddings request with every query missing from the query cache,
+and one multi-row vector search, which saves a round trip to the API and a pass over the index per
+query. Each caller gets back the results of its own query.
+
+There is no background thread. The first request of a batch becomes its leader: it waits up to max_wait
+for others to join (or until the batch is full), then runs the batch while the followers wait for their
+results. This keeps the batcher fork-safe, so it can be created before gunicorn forks its workers. The
+leader only waits when other searches are in progress, so a lone request is not delayed. If a batch
+fails, each of its queries is searched again on its own, so one bad query does not fail the others.
+
+The stages the leader times while running a batch (embed_query, vector_search, ...) are recorded for every
+request in the batch, in the stage_seconds histograms of /metrics and in each request's trace, so
+stage counts keep matching request counts. Waiting for a batch shows up as the batch_wait stage.
+
+Usage:
+    batcher = MicroBatcher(index.search_batch, max_batch_size=16, max_wait=0.005)
+    results = batcher.search('The way through the desert', k=5, mode='hybrid')
+"""
+
+import threading
+
+from metrics import collect, record, timer
+
+
+class Batch:
+    """Queries waiting to be searched together with the same options"""
+
+    def __init__(self):
+        self.queries = []
+        self.results = None
+        self.error = None
+        # (stage, seconds) timed while the batch ran, see metrics.collect()
+        self.stages = []
+        # Set when the batch is full, so the leader can stop waiting early
+        self.full = threading.Event()
+        # Set once results (or error) are ready
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+
+    def __init__(self, search_batch, max_batch_size=16, max_wait=0.005):
+        """
+        Initialize a MicroBatcher instance
+
+        Args:
+            search_batch (callable): Called as search_batch(queries, **options) and returning one result
+        list per query, e.g. Index.search_batch
+            max_batch_size (int): Most queries searched together. 1 searches every query on its own.
+            max_wait (float): Seconds the first query of a batch waits for others to join
+        """
+        self.search_batch = search_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+        # The batch still open to new queries, by search options
+        self.open = {}
+        # Searches between entering and leaving search()
+        self.active = 0
+
+        # Counters reported by stats()
+        self.batches = 0
+        self.queries = 0
+        self.largest = 0
+
+    def search(self, query, **options):
+        """
+        Search query together with the concurrent searches that have the same options.
+
+        Args:
+            query (str): Text to search for
+            options: Keyword arguments of search_batch(), e.g. k, series, episode or mode
+
+        Returns:
+            results of query, as search_batch() returns them for one query
+        """
+        if self.max_batch_size <= 1:
+            return self.search_batch([query], **options)[0]
+
+        key = tuple(sorted(options.items()))
+        with self.lock:
+            self.active += 1
+        try:
+            return self._search(key, query, options)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    def _search(self, key, query, options):
+        with self.lock:
+            batch = self.open.get(key)
+            leader = batch is None
+            if leader:
+                batch = self.open[key] = Batch()
+            position = len(batch.queries)
+            batch.queries.append(query)
+            if len(batch.queries) >= self.max_batch_size:
+                # Close the batch, so the next query starts a new one
+                del self.open[key]
+                batch.full.set()
+            # Nobody to wait for when no other search is in progress
+            busy = self.active > 1
+
+        if leader:
+            if busy:
+                with timer('batch_wait'):
+                    batch.full.wait(self.max_wait)
+            with self.lock:
+                if self.open.get(key) is batch:
+                    del self.open[key]
+                self.batches += 1
+                self.queries += len(batch.queries)
+                self.largest = max(self.largest, len(batch.queries))
+            try:
+                with collect() as batch.stages:
+                    batch.results = self.search_batch(batch.queries, **options)
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+        else:
+            with timer('batch_wait'):
+                batch.done.wait()
+            # The leader's stage timings are the time this request spent in them too
+            record(batch.stages)
+
+        if batch.error is not None:
+            if len(batch.queries) == 1:
+                raise batch.error
+            # One bad query (e.g. too long to embed) fails its whole batch. Every caller retries its own query
+            # alone, so only the bad one gets the error
+            return self.search_batch([query], **options)[0]
+        return batch.results[position]
+
+    def stats(self):
+        """Return the number of batches run, the queries they held and the largest batch"""
+        with self.lock:
+            return {'batches': self.batches,
+                    'queries': self.queries,
+                    'mean_batch_size': self.queries / self.batches if self.batches else 0.0,
+                    'largest_batch': self.largest}
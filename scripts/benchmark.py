@@ -0,0 +1,311 @@
+"""
+Offline benchmark suite for scribe.Index, using stub services instead of AssemblyAI and OpenAI.
+
+Each phase runs in a fresh Python process, so its peak RSS is its own:
+    ingest     add_series() of synthetic episodes through a FakeTranscriber and the stub embeddings server
+    save_load  save_database() and load_database() (json, columnar, mmap) of a synthetic database
+    search     Index.search() latency p50/p99 at several k, with and without a query cache hit, and lexical
+    http       requests per second and latency of /search on app.py under gunicorn
+
+Results are written as JSON, together with the parameters and versions they were measured with. Passing
+an earlier results file as --baseline lists every number that got worse by more than --tolerance, and
+exits with status 1 if any did.
+
+Usage:
+    python benchmark.py --scale small --output bench.json
+    python benchmark.py --scale small --output new.json --baseline bench.json
+    python benchmark.py --scale large --phases save_load search
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+PHASES = ('ingest', 'save_load', 'search', 'http')
+
+# utterances and dimension size the synthetic database. The ingest phase embeds every utterance through
+# the stub server, so it is kept smaller
+SCALES = {'small': dict(series=1, episodes=5, episode_utterances=200, utterances=10000, dimension=1536,
+                        queries=200, ks=[1, 5, 10, 50], http_seconds=5),
+          'medium': dict(series=5, episodes=20, episode_utterances=500, utterances=100000, dimension=1536,
+                         queries=500, ks=[1, 5, 10, 50], http_seconds=10),
+          'large': dict(series=10, episodes=50, episode_utterances=500, utterances=1000000, dimension=256,
+                        queries=500, ks=[1, 5, 10, 50], http_seconds=20)}
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def percentiles(seconds):
+    """Return p50, p99 and mean of a list of durations, in milliseconds"""
+    import numpy as np
+    ms = np.array(seconds) * 1000
+    return {'p50_ms': float(np.percentile(ms, 50)),
+            'p99_ms': float(np.percentile(ms, 99)),
+            'mean_ms': float(ms.mean())}
+
+
+def start_stubs(params):
+    """Start the stub embeddings server and point the OpenAI client at it"""
+    from stub_services import start_stub_server
+    server, base_url = start_stub_server(dimension=params['dimension'], latency=params['embedding_latency'])
+    os.environ['OPENAI_BASE_URL'] = base_url
+    os.environ['OPENAI_API_KEY'] = 'stub'
+    return server
+
+
+def run_ingest(params, workdir):
+    start_stubs(params)
+    from scribe import Index
+    from stub_services import FakeTranscriber
+    from synthetic import synthetic_jobs
+
+    transcriber = FakeTranscriber(params['episode_utterances'],
+                                  latency=params['transcription_latency'],
+                                  vocabulary_size=20000)
+    index = Index(dimension=params['dimension'])
+    jobs = synthetic_jobs(os.path.join(workdir, 'jobs'), params['series'], params['episodes'])
+
+    start = time.perf_counter()
+    for path in jobs:
+        index.add_series(path, temp_episodes=set(), transcriber=transcriber, max_concurrent=4,
+                         checkpoint=os.path.join(workdir, 'ingest_checkpoint'))
+    seconds = time.perf_counter() - start
+    return {'episodes': params['series'] * params['episodes'],
+            'utterances': len(index.utterances),
+            'seconds': seconds,
+            'utterances_per_s': len(index.utterances) / seconds}
+
+
+def run_save_load(params, workdir):
+    from scribe import Index
+    from synthetic import synthetic_database
+
+    filename = os.path.join(workdir, 'db', 'synthetic')
+    start = time.perf_counter()
+    index = synthetic_database(filename, params['utterances'], params['dimension'], columnar=True)
+    results = {'utterances': params['utterances'], 'generate_s': time.perf_counter() - start}
+
+    start = time.perf_counter()
+    index.save_database(filename, columnar=True)
+    results['save_s'] = time.perf_counter() - start
+
+    for mode, kwargs in (('json', dict(columnar=False)), ('columnar', dict(columnar=True)), ('mmap', dict(mmap=True))):
+        start = time.perf_counter()
+        Index(dimension=params['dimension']).load_database(filename, **kwargs)
+        results[f'load_{mode}_s'] = time.perf_counter() - start
+    return results
+
+
+def run_search(params, workdir):
+    start_stubs(params)
+    from scribe import Index
+    from stub_services import make_vocabulary
+
+    index = Index(dimension=params['dimension'])
+    index.load_database(os.path.join(workdir, 'db', 'synthetic'))
+    queries = [f'synthetic query number {i}' for i in range(params['queries'])]
+    # Lexical queries are pairs of words of the synthetic vocabulary, from common to rare
+    vocabulary = make_vocabulary(20000)
+    keywords = [f'{vocabulary[i % 100]} {vocabulary[(37 * i) % 5000]}' for i in range(params['queries'])]
+
+    results = {}
+    for k in params['ks']:
+        for label in ('uncached', 'cached'):
+            if label == 'uncached':
+                index.query_cache.memory.clear()
+            durations = []
+            for query in queries:
+                start = time.perf_counter()
+                index.search(query, k=k)
+                durations.append(time.perf_counter() - start)
+            results[f'semantic_{label}_k{k}'] = percentiles(durations)
+
+        durations = []
+        for query in keywords:
+            start = time.perf_counter()
+            index.search(query, k=k, mode='lexical')
+            durations.append(time.perf_counter() - start)
+        results[f'lexical_k{k}'] = percentiles(durations)
+    return results
+
+
+def run_http(params, workdir):
+    server = start_stubs(params)
+    from worker_report import launch
+
+    server_process = launch(os.path.join(workdir, 'db', 'synthetic'), params['http_workers'], params['http_port'],
+                            requests=0, mode='semantic', query='warm up')
+    base_url = f"http://127.0.0.1:{params['http_port']}"
+    try:
+        deadline = time.perf_counter() + params['http_seconds']
+
+        def worker(offset):
+            durations = []
+            i = offset
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                # A fixed set of queries, so after the first round the query embeddings come from the cache
+                urllib.request.urlopen(f'{base_url}/search?q=synthetic+query+{i % 50}&k=5', timeout=60).read()
+                durations.append(time.perf_counter() - start)
+                i += params['http_concurrency']
+            return durations
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=params['http_concurrency']) as executor:
+            durations = [d for result in executor.map(worker, range(params['http_concurrency'])) for d in result]
+        seconds = time.perf_counter() - start
+    finally:
+        server_process.terminate()
+        server_process.wait()
+        server.shutdown()
+    return dict(percentiles(durations), requests=len(durations), requests_per_s=len(durations) / seconds)
+
+
+def measure(phase, params, workdir):
+    """Run in the child process: run one phase and return its results with the peak RSS"""
+    # The phases print progress from scribe, which would mix with the JSON on stdout
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        results = globals()[f'run_{phase}'](params, workdir)
+    finally:
+        sys.stdout = stdout
+    results['peak_rss_mb'] = peak_rss_mb()
+    return results
+
+
+def metadata():
+    """Versions and machine the results were measured on"""
+    import faiss
+    import numpy as np
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    return {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit': commit,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'faiss': faiss.__version__,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count()}
+
+
+def flatten(results, prefix=''):
+    """Flatten nested result dictionaries into {'search.semantic_cached_k5.p50_ms': value, ...}"""
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)):
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+def regressions(results, baseline, tolerance):
+    """
+    Return (name, baseline, current) for every number worse than the baseline by more than tolerance.
+    Throughputs (per_s) are better when higher, everything else when lower.
+    """
+    current, previous = flatten(results), flatten(baseline)
+    worse = []
+    for name, value in current.items():
+        before = previous.get(name)
+        if not before or name.endswith(('utterances', 'episodes', 'requests')):
+            continue
+        change = (value - before) / before
+        if name.endswith('per_s'):
+            change = -change
+        if change > tolerance:
+            worse.append((name, before, value))
+    return worse
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', type=str, default='small', choices=list(SCALES), help='Corpus and query sizes')
+    parser.add_argument('--phases', nargs='+', default=list(PHASES), choices=PHASES, help='Phases to run')
+    parser.add_argument('--utterances', type=int, help='Override the size of the synthetic database')
+    parser.add_argument('--dimension', type=int, help='Override the embedding dimension')
+    parser.add_argument('--embedding-latency', type=float, default=0.0, help='Seconds the stub embeddings '
+                        'server waits per request')
+    parser.add_argument('--transcription-latency', type=float, default=0.0, help='Seconds the fake transcriber '
+                        'waits per episode')
+    parser.add_argument('--http-workers', type=int, default=2, help='gunicorn workers in the http phase')
+    parser.add_argument('--http-concurrency', type=int, default=8, help='Concurrent clients in the http phase')
+    parser.add_argument('--http-port', type=int, default=5056, help='Port of the server in the http phase')
+    parser.add_argument('-o', '--output', type=str, help='File to write the results to as JSON')
+    parser.add_argument('--baseline', type=str, help='Earlier results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Fraction a number may get worse by '
+                        'before it counts as a regression')
+    parser.add_argument('--workdir', type=str, help='Directory for the synthetic corpus. A temporary one '
+                        'by default')
+    parser.add_argument('--child', type=str, help=argparse.SUPPRESS)
+    parser.add_argument('--params', type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child, json.loads(args.params), args.workdir)))
+        return
+
+    params = dict(SCALES[args.scale],
+                  embedding_latency=args.embedding_latency,
+                  transcription_latency=args.transcription_latency,
+                  http_workers=args.http_workers,
+                  http_concurrency=args.http_concurrency,
+                  http_port=args.http_port)
+    if args.utterances:
+        params['utterances'] = args.utterances
+    if args.dimension:
+        params['dimension'] = args.dimension
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='scribe-benchmark-')
+    # search and http use the database written by save_load
+    phases = [phase for phase in PHASES if phase in args.phases]
+    if {'search', 'http'} & set(phases) and 'save_load' not in phases \
+            and not os.path.exists(os.path.join(workdir, 'db', 'synthetic.index')):
+        phases.insert(0, 'save_load')
+
+    results = {}
+    for phase in phases:
+        print(f'Running {phase}...')
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', phase,
+                                 '--params', json.dumps(params), '--workdir', workdir],
+                                stdout=subprocess.PIPE, text=True, check=True)
+        results[phase] = json.loads(output.stdout.strip().splitlines()[-1])
+        print(json.dumps(results[phase], indent=4))
+
+    report = {'meta': metadata(), 'scale': args.scale, 'params': params, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f'Results written to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        worse = regressions(results, baseline['results'], args.tolerance)
+        for name, before, value in worse:
+            print(f'REGRESSION {name}: {before:.4g} -> {value:.4g}')
+        if worse:
+            sys.exit(1)
+        print(f'No regressions beyond {args.tolerance:.0%} against {args.baseline}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_query(query: str):
+    """
+    Normalize a search query so that trivially different spellings share a cache entry.
+
+    Lowercases the query and collapses runs of whitespace.
+    """
+    return ' '.join(query.lower().split())
+
+
+class QueryCache:
+    """
+    Two-tier cache for query embeddings.
+
+    The first tier is an in-process LRU dictionary. The second tier is an sqlite file on disk which
+    survives restarts. Entries are keyed by (embedding_model, normalized query).
+    """
+
+    def __init__(self, path=None, max_size=10000, max_disk_size=100000, ttl=None):
+        """
+        Initialize a QueryCache instance
+
+        Args:
+            path (str): Path to the sqlite file for the disk tier. If None, only the memory tier is used.
+            max_size (int): Maximum number of embeddings kept in the memory tier
+            max_disk_size (int): Maximum number of embeddings kept in the disk tier
+            ttl (float): Seconds after which an entry is considered stale. None means entries never expire.
+        """
+        self.path = path
+        self.max_size = max_size
+        self.max_disk_size = max_disk_size
+        self.ttl = ttl
+
+        # OrderedDict keeps the least recently used entry at the front
+        self.memory = OrderedDict()
+
+        # Hit and miss counters, reported by stats()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        # Flask may serve requests from several threads, so guard both tiers with one lock
+        self.lock = threading.Lock()
+
+        self.db = None
+        if path:
+            directory, _ = os.path.split(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connect()
+
+    def _connect(self):
+        # Remember which process opened the connection, see _database()
+        self.pid = os.getpid()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS embeddings ('
+                        'model TEXT, query TEXT, vector BLOB, created REAL, '
+                        'PRIMARY KEY (model, query))')
+        self.db.commit()
+
+    def _database(self):
+        """
+        Return the sqlite connection of this process.
+
+        A cache created before a server forks its workers (e.g. gunicorn --preload) must not share the
+        parent's connection, so each forked process opens its own on first use. The inherited connection
+        is kept open rather than closed, since closing it would release the parent's file locks.
+        """
+        if self.db is not None and self.pid != os.getpid():
+            self.inherited = self.db
+            self._connect()
+        return self.db
+
+    def _expired(self, created):
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def get(self, model, query):
+        """
+        Return the cached embedding (np.array of float32) for query, or None on a miss.
+        """
+        key = (model, normalize_query(query))
+        with self.lock:
+            return self._get(key)
+
+    def _get(self, key):
+        entry = self.memory.get(key)
+        if entry is not None:
+            vector, created = entry
+            if not self._expired(created):
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                return vector
+            del self.memory[key]
+
+        db = self._database()
+        if db is not None:
+            row = db.execute('SELECT vector, created FROM embeddings WHERE model = ? AND query = ?',
+                             key).fetchone()
+            if row is not None:
+                blob, created = row
+                if not self._expired(created):
+                    vector = np.frombuffer(blob, dtype='float32')
+                    # Promote to the memory tier
+                    self._remember(key, vector, created)
+                    self.disk_hits += 1
+                    return vector
+                db.execute('DELETE FROM embeddings WHERE model = ? AND query = ?', key)
+                db.commit()
+
+        self.misses += 1
+        return None
+
+    def put(self, model, query, embedding):
+        """
+        Store an embedding for query in both tiers.
+        """
+        key = (model, normalize_query(query))
+        vector = np.asarray(embedding, dtype='float32')
+        created = time.time()
+        with self.lock:
+            self._put(key, vector, created)
+
+    def _put(self, key, vector, created):
+        self._remember(key, vector, created)
+
+        db = self._database()
+        if db is not None:
+            db.execute('INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)',
+                       (*key, vector.tobytes(), created))
+            # Evict the oldest rows once the disk tier grows past its limit
+            count = db.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+            if count > self.max_disk_size:
+                db.execute('DELETE FROM embeddings WHERE rowid IN '
+                           '(SELECT rowid FROM embeddings ORDER BY created LIMIT ?)',
+                           (count - self.max_disk_size,))
+            db.commit()
+
+    def _remember(self, key, vector, created):
+        self.memory[key] = (vector, created)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
+
+    def stats(self):
+        """Return a dictionary of hit/miss counters and the current memory tier size"""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                'memory_size': len(self.memory)}
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
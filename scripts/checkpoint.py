@@ -0,0 +1,163 @@
+"""
+Append-only checkpoints for long ingest runs.
+
+A checkpoint is a pair of files that only ever grow:
+    <filename>.wal.vectors  raw float32 embeddings, one row of `dimension` values per utterance
+    <filename>.wal.jsonl    one JSON line per episode with its utterance metadata
+
+Adding an episode appends its vectors, then its metadata line. The metadata line is what commits the
+episode, so if a run dies halfway through an append, the torn tail is ignored on load and cut off
+before the next append.
+
+Removing an episode (see Index.remove_episode()) appends a line with no utterances that names the
+episode, and is replayed in order on load, so a correction costs as much as the episode, not the whole
+checkpoint.
+
+Usage (compact a checkpoint into a regular database):
+    python checkpoint.py temp database/bp_db
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+
+class Checkpoint:
+
+    def __init__(self, filename, dimension=1536, fsync=True):
+        """
+        Initialize a Checkpoint instance
+
+        Args:
+            filename (str): Path prefix of the checkpoint files
+            dimension (int): Dimension of the embeddings stored in the checkpoint
+            fsync (bool): Whether to force each append to disk before returning
+        """
+        self.filename = filename
+        self.dimension = dimension
+        self.fsync = fsync
+        self.vectors_path = f'{filename}.wal.vectors'
+        self.metadata_path = f'{filename}.wal.jsonl'
+
+        # Set to True once a torn tail from an earlier run has been cut off
+        self.recovered = False
+
+    def exists(self):
+        return os.path.exists(self.metadata_path)
+
+    def _segments(self):
+        """
+        Return the list of committed episode segments and their length in bytes, ignoring a torn last line
+        """
+        segments, length = [], 0
+        if not self.exists():
+            return segments, length
+        with open(self.metadata_path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                segments.append(json.loads(line))
+                length += len(line)
+        return segments, length
+
+    def _recover(self):
+        """Cut both files back to the last committed episode"""
+        segments, length = self._segments()
+        committed_rows = sum(len(segment['utterances']) for segment in segments)
+
+        if os.path.exists(self.vectors_path):
+            with open(self.vectors_path, 'r+b') as f:
+                f.truncate(committed_rows * self.dimension * 4)
+        if self.exists():
+            with open(self.metadata_path, 'r+b') as f:
+                f.truncate(length)
+        self.recovered = True
+
+    def _write(self, path, data):
+        with open(path, 'ab') as f:
+            f.write(data)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def append(self, documents, embeddings, duplicates=None, removed=None):
+        """
+        Append one episode to the checkpoint.
+
+        Args:
+            documents (list(dict)): Utterance metadata of the episode, as stored in Index.utterances
+            embeddings (np.array): Embeddings of the documents, one row per document
+            duplicates (list): (utterance id, location) pairs of the episode's utterances that were not
+        stored because they repeat an earlier one, see Index.deduplicate()
+            removed (tuple): (series, episode) removed from the index before this segment's documents were
+        added, see Index.remove_episode()
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+        if embeddings.shape != (len(documents), self.dimension):
+            raise ValueError(f'Expected embeddings of shape {(len(documents), self.dimension)}, got {embeddings.shape}')
+
+        directory, _ = os.path.split(self.filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        if not self.recovered:
+            self._recover()
+
+        # Vectors first, so a committed metadata line always has its vectors on disk
+        self._write(self.vectors_path, embeddings.tobytes())
+        segment = {'dimension': self.dimension, 'utterances': documents}
+        if duplicates:
+            segment['duplicates'] = [[idx, duplicate] for idx, duplicate in duplicates]
+        if removed:
+            segment['removed'] = list(removed)
+        self._write(self.metadata_path, (json.dumps(segment) + '\n').encode('utf-8'))
+
+    def segments(self):
+        """
+        Yield every committed segment in order, as (documents, embeddings, duplicates, removed), so they can
+        be replayed one at a time. See append() for the fields.
+        """
+        segments, _ = self._segments()
+        rows = sum(len(segment['utterances']) for segment in segments)
+        if segments and segments[0]['dimension'] != self.dimension:
+            raise ValueError(f"Checkpoint has dimension {segments[0]['dimension']}, expected {self.dimension}")
+
+        vectors = np.empty((0, self.dimension), dtype='float32')
+        if rows:
+            vectors = np.fromfile(self.vectors_path, dtype='float32', count=rows * self.dimension)
+            vectors = vectors.reshape(rows, self.dimension)
+
+        first = 0
+        for segment in segments:
+            count = len(segment['utterances'])
+            yield (segment['utterances'],
+                   vectors[first:first + count],
+                   [(idx, duplicate) for idx, duplicate in segment.get('duplicates', [])],
+                   tuple(segment['removed']) if 'removed' in segment else None)
+            first += count
+
+    def remove(self):
+        for path in (self.vectors_path, self.metadata_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('checkpoint', type=str, help='Path prefix of the checkpoint, e.g. temp')
+    parser.add_argument('destination', type=str, help='Path prefix of the database to write, e.g. database/bp_db')
+    parser.add_argument('-d', '--dimension', type=int, default=1536, help='Dimension of the embeddings')
+    parser.add_argument('--remove', action='store_true', help='Delete the checkpoint after compacting it')
+    args = parser.parse_args()
+
+    # Imported here because scribe imports this module
+    from scribe import Index
+
+    index = Index(dimension=args.dimension)
+    index.compact_checkpoint(args.checkpoint, args.destination, remove=args.remove)
+
+
+if __name__ == '__main__':
+    main()
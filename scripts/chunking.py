@@ -0,0 +1,91 @@
+"""
+Coalescing of short utterances into larger windows before they are embedded.
+
+AssemblyAI splits a conversation into utterances at every change of speaker, so a transcript is full of
+one-liners like "Yeah." and "That's true." that each cost a vector and crowd out search results. A
+Chunker merges adjacent utterances into windows capped by token count. Every window keeps the start,
+end and position in the window text of each utterance it was built from, under 'parts', so a search
+result can still point at the exact timestamp.
+"""
+
+from embedding import count_tokens
+
+
+class Chunker:
+
+    def __init__(self, max_tokens=256, overlap=0, embedding_model='text-embedding-3-small'):
+        """
+        Initialize a Chunker instance
+
+        Args:
+            max_tokens (int): Maximum number of tokens in a window. An utterance longer than this becomes a
+        window on its own.
+            overlap (int): Number of utterances at the end of each window that are repeated at the start of
+        the next one, so ideas split across a window boundary are still found together
+            embedding_model (str): Model whose tokenizer is used to count tokens
+        """
+        if overlap < 0:
+            raise ValueError(f'overlap must be at least 0, not {overlap}')
+        self.max_tokens = max_tokens
+        self.overlap = overlap
+        self.embedding_model = embedding_model
+
+        # Running totals for report()
+        self.utterances_in = 0
+        self.windows_out = 0
+
+    def __call__(self, transcript):
+        """
+        Coalesce a transcript into windows.
+
+        Args:
+            transcript (list(dict)): Utterances with text, start and end, like Episode.transcript
+
+        Returns:
+            list of dictionaries with text, start, end and parts, where parts lists the start, end and
+        character offset in text of each utterance in the window
+        """
+        tokens = [count_tokens(utterance['text'], self.embedding_model) for utterance in transcript]
+
+        windows = []
+        first = 0
+        while first < len(transcript):
+            # Grow the window while the next utterance still fits
+            last = first + 1
+            window_tokens = tokens[first]
+            while last < len(transcript) and window_tokens + tokens[last] <= self.max_tokens:
+                window_tokens += tokens[last]
+                last += 1
+            windows.append(self.window(transcript[first:last]))
+
+            if last == len(transcript):
+                break
+            # Step back by the overlap, but always move forward by at least one utterance
+            first = max(last - self.overlap, first + 1)
+
+        self.utterances_in += len(transcript)
+        self.windows_out += len(windows)
+        return windows
+
+    @staticmethod
+    def window(utterances):
+        """Merge a run of utterances into one window"""
+        parts = []
+        texts = []
+        offset = 0
+        for utterance in utterances:
+            parts.append({'start': utterance['start'], 'end': utterance['end'], 'offset': offset})
+            texts.append(utterance['text'])
+            offset += len(utterance['text']) + 1
+        return {'text': ' '.join(texts),
+                'start': utterances[0]['start'],
+                'end': utterances[-1]['end'],
+                'parts': parts}
+
+    def report(self):
+        """Return a human readable summary of the reduction in vector count so far"""
+        if not self.utterances_in:
+            return 'No utterances chunked yet'
+        reduction = 1 - self.windows_out / self.utterances_in
+        return (f'Coalesced {self.utterances_in} utterances into {self.windows_out} windows '
+                f'({reduction:.0%} fewer vectors)')
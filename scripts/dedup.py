@@ -0,0 +1,162 @@
+"""
+Near-duplicate detection for utterances, so re-released episodes are stored once.
+
+Duplicates are found in two steps. An exact fingerprint (a hash of the normalized words) catches
+verbatim repeats without any embedding call. MinHash signatures with locality-sensitive hashing find
+candidates that differ by a few words (a transcription slip, a different intro), which are confirmed by
+the distance between their embeddings.
+
+Utterances shorter than min_words are never treated as duplicates: "Yeah." occurs in every episode but
+is not a repeated passage.
+"""
+
+import hashlib
+import zlib
+
+import numpy as np
+
+from lexical import tokenize
+
+
+# Mersenne prime used by the MinHash permutations
+PRIME = (1 << 31) - 1
+
+# Utterances with fewer words are never duplicates
+MIN_WORDS = 8
+
+# Fields of a search result that describe the hit rather than where the passage is
+RESULT_FIELDS = ('text', 'locations', 'similarity score', 'bm25 score', 'rrf score')
+
+
+def fingerprint(text):
+    """Hash of the normalized words of text, equal for texts that differ only in case and punctuation"""
+    return hashlib.blake2b(' '.join(tokenize(text)).encode('utf-8'), digest_size=8).hexdigest()
+
+
+def location(utterance):
+    """
+    Where an utterance occurs: every field of its dictionary but the text, i.e. its series, episode and
+    timestamps along with any others, such as the chunker's 'parts'
+    """
+    return {key: value for key, value in utterance.items() if key not in RESULT_FIELDS}
+
+
+def collapse_results(results, min_words=MIN_WORDS):
+    """
+    Merge search results that are the same passage, keeping the best ranked copy.
+
+    Each kept result gets a 'locations' list when it occurs in more than one place. Results shorter than
+    min_words are never merged, as DuplicateDetector never treats them as duplicates.
+    """
+    kept = {}
+    for position, result in enumerate(results):
+        words = tokenize(result['text'])
+        key = fingerprint(result['text']) if len(words) >= min_words else position
+        if key not in kept:
+            kept[key] = result
+            continue
+        first = kept[key]
+        first.setdefault('locations', [location(first)])
+        first['locations'].extend(result.get('locations', [location(result)]))
+    return list(kept.values())
+
+
+class DuplicateDetector:
+
+    def __init__(self, num_perm=64, bands=16, shingle_size=3, min_words=MIN_WORDS, threshold=0.8, max_distance=0.1):
+        """
+        Initialize a DuplicateDetector instance
+
+        Args:
+            num_perm (int): Number of MinHash permutations
+            bands (int): Number of LSH bands. Must divide num_perm. More bands find more (and looser) candidates
+            shingle_size (int): Number of words per shingle
+            min_words (int): Utterances with fewer words are never duplicates
+            threshold (float): Minimum estimated Jaccard similarity of a near-duplicate candidate
+            max_distance (float): Maximum squared L2 distance between the embeddings of confirmed near-duplicates
+        """
+        if num_perm % bands:
+            raise ValueError(f'bands ({bands}) must divide num_perm ({num_perm})')
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_size = shingle_size
+        self.min_words = min_words
+        self.threshold = threshold
+        self.max_distance = max_distance
+
+        rng = np.random.default_rng(0)
+        self.a = rng.integers(1, PRIME, num_perm, dtype='uint64')
+        self.b = rng.integers(0, PRIME, num_perm, dtype='uint64')
+
+        # fingerprint -> utterance id, and (band, band hash) -> utterance ids
+        self.fingerprints = {}
+        self.buckets = {}
+        self.signatures = {}
+
+    def signature(self, words):
+        """MinHash signature of a list of words, as an np.array of num_perm uint64"""
+        size = min(self.shingle_size, len(words))
+        shingles = {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+        hashes = np.array([zlib.crc32(shingle.encode('utf-8')) for shingle in shingles], dtype='uint64')
+        return ((np.outer(hashes, self.a) + self.b) % PRIME).min(axis=0)
+
+    def clear(self):
+        """Forget every registered utterance"""
+        self.fingerprints = {}
+        self.buckets = {}
+        self.signatures = {}
+
+    def _bands(self, signature):
+        rows = self.num_perm // self.bands
+        return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(self.bands)]
+
+    def eligible(self, text):
+        return len(tokenize(text)) >= self.min_words
+
+    def add(self, utterance_id, text):
+        """Register a stored utterance so later ones can be matched against it"""
+        words = tokenize(text)
+        if len(words) < self.min_words:
+            return
+        self.fingerprints.setdefault(fingerprint(text), utterance_id)
+        signature = self.signature(words)
+        self.signatures[utterance_id] = signature
+        for key in self._bands(signature):
+            self.buckets.setdefault(key, []).append(utterance_id)
+
+    def remove(self, utterance_id, text):
+        """Forget a registered utterance, e.g. one whose episode was removed from the index"""
+        if self.fingerprints.get(fingerprint(text)) == utterance_id:
+            del self.fingerprints[fingerprint(text)]
+        signature = self.signatures.pop(utterance_id, None)
+        if signature is None:
+            return
+        for key in self._bands(signature):
+            bucket = self.buckets.get(key, [])
+            if utterance_id in bucket:
+                bucket.remove(utterance_id)
+
+    def exact_match(self, text):
+        """Return the id of a stored utterance with the same normalized text, or None"""
+        if not self.eligible(text):
+            return None
+        return self.fingerprints.get(fingerprint(text))
+
+    def candidates(self, text):
+        """Return ids of stored utterances whose estimated Jaccard similarity to text reaches the threshold"""
+        words = tokenize(text)
+        if len(words) < self.min_words:
+            return []
+        signature = self.signature(words)
+        found = set()
+        for key in self._bands(signature):
+            found.update(self.buckets.get(key, ()))
+        similarities = [(np.mean(self.signatures[other] == signature), other) for other in found]
+        return [other for similarity, other in sorted(similarities, reverse=True) if similarity >= self.threshold]
+
+    def confirm(self, embedding, candidate_vectors):
+        """Return the position of the first candidate vector within max_distance of embedding, or None"""
+        for position, vector in enumerate(candidate_vectors):
+            if float(np.sum((vector - embedding) ** 2)) <= self.max_distance:
+                return position
+        return None
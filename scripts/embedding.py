@@ -0,0 +1,210 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+
+import numpy as np
+
+
+def retryable_errors():
+    """
+    Errors worth retrying: rate limits, server-side failures and dropped connections.
+
+    openai is imported here rather than at module import, since the pipeline is only used with a client
+    that has already imported it.
+    """
+    import openai
+    return (openai.RateLimitError,
+            openai.InternalServerError,
+            openai.APIConnectionError,
+            openai.APITimeoutError)
+
+
+def retry_after(headers):
+    """
+    Return the seconds a rate-limited response asks the client to wait, or None when it does not say.
+
+    Reads OpenAI's retry-after-ms header first, then the standard Retry-After header, either in seconds
+    or as an HTTP date.
+    """
+    if headers is None:
+        return None
+    try:
+        if headers.get('retry-after-ms') is not None:
+            return max(0.0, float(headers['retry-after-ms']) / 1000)
+    except ValueError:
+        pass
+    value = headers.get('retry-after')
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+@lru_cache(maxsize=None)
+def token_encoding(embedding_model):
+    """Return the tiktoken encoding of embedding_model, or None when tiktoken is not installed"""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(embedding_model)
+    except KeyError:
+        return tiktoken.get_encoding('cl100k_base')
+
+
+def count_tokens(text, embedding_model='text-embedding-3-small'):
+    """
+    Count (or estimate) the number of tokens in text.
+
+    Uses tiktoken when it is installed, and otherwise falls back to the rule of thumb of about four
+    characters per token.
+    """
+    encoding = token_encoding(embedding_model)
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return max(1, len(text) // 4)
+
+
+def make_batches(texts, max_batch_tokens=50000, max_batch_size=2048, embedding_model='text-embedding-3-small'):
+    """
+    Split texts into batches capped by total token count and by number of items.
+
+    Returns a list of (start, batch_texts, batch_tokens) tuples, where start is the position of the
+    first text of the batch in texts.
+    """
+    batches = []
+    start = 0
+    batch, batch_tokens = [], 0
+    for i, text in enumerate(texts):
+        tokens = count_tokens(text, embedding_model)
+        if batch and (batch_tokens + tokens > max_batch_tokens or len(batch) >= max_batch_size):
+            batches.append((start, batch, batch_tokens))
+            start, batch, batch_tokens = i, [], 0
+        batch.append(text)
+        batch_tokens += tokens
+    if batch:
+        batches.append((start, batch, batch_tokens))
+    return batches
+
+
+class EmbeddingPipeline:
+    """
+    Concurrent, rate-limit-aware client for the OpenAI embeddings endpoint.
+
+    Texts are split into token-capped batches which are sent from a thread pool with a bounded
+    number of requests in flight. Failed requests are retried after the delay a rate-limited response
+    asks for (Retry-After), or else with exponential backoff, and the embeddings are returned in the
+    original order of the texts.
+
+    The pipeline only needs an OpenAI() client, so it can be pointed at a local stub server by
+    creating the client with base_url (or setting OPENAI_BASE_URL).
+    """
+
+    def __init__(self,
+                 client,
+                 embedding_model='text-embedding-3-small',
+                 max_workers=4,
+                 max_batch_tokens=50000,
+                 max_batch_size=2048,
+                 max_retries=6,
+                 initial_backoff=1.0,
+                 max_backoff=60.0,
+                 dimensions=None):
+        """
+        Initialize an EmbeddingPipeline instance
+
+        Args:
+            client (OpenAI): Client used to call the embeddings endpoint
+            embedding_model (str): Name of the embedding model
+            max_workers (int): Maximum number of embedding requests in flight at once
+            max_batch_tokens (int): Maximum number of tokens sent in a single request
+            max_batch_size (int): Maximum number of texts sent in a single request
+            max_retries (int): How many times a failed request is retried before giving up
+            initial_backoff (float): Seconds to wait before the first retry. Doubles on each retry.
+            max_backoff (float): Upper bound on the wait between retries
+            dimensions (int): Size of the embeddings to ask for (text-embedding-3 models only). None
+        gives the model's full size.
+        """
+        # The pipeline does its own backoff, so turn off the client's built-in retries
+        self.client = client.with_options(max_retries=0)
+        self.embedding_model = embedding_model
+        self.max_workers = max_workers
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.dimensions = dimensions
+
+        # Filled in by embed(), see report()
+        self.last_report = None
+
+    def _embed_batch(self, batch):
+        """Embed one batch, retrying on retryable errors after Retry-After or exponential backoff with jitter"""
+        backoff = self.initial_backoff
+        for attempt in range(self.max_retries + 1):
+            try:
+                # Only sent when set, since older models reject the parameter
+                extra = {} if self.dimensions is None else {'dimensions': self.dimensions}
+                response = self.client.embeddings.create(input=batch, model=self.embedding_model, **extra)
+                return np.array([item.embedding for item in response.data]).astype('float32')
+            except retryable_errors() as e:
+                if attempt == self.max_retries:
+                    raise
+                # A rate-limited response may say how long to wait. Otherwise back off exponentially, with jitter
+                response = getattr(e, 'response', None)
+                wait = retry_after(getattr(response, 'headers', None))
+                if wait is None:
+                    wait = min(backoff, self.max_backoff) * (0.5 + random.random() / 2)
+                else:
+                    wait = min(wait, self.max_backoff)
+                print(f'Embedding request failed ({type(e).__name__}), retrying in {wait:.1f}s')
+                time.sleep(wait)
+                backoff *= 2
+
+    def embed(self, texts):
+        """
+        Embed a list of texts.
+
+        Args:
+            texts (list(str)): List of strings to be embedded
+
+        Returns:
+            np.array of float32 with one row per text, in the same order as texts
+        """
+        start_time = time.perf_counter()
+        batches = make_batches(texts, self.max_batch_tokens, self.max_batch_size, self.embedding_model)
+
+        # executor.map() yields results in submission order, which keeps the rows aligned with texts
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(self._embed_batch, [batch for _, batch, _ in batches]))
+
+        elapsed = time.perf_counter() - start_time
+        tokens = sum(batch_tokens for _, _, batch_tokens in batches)
+        self.last_report = {'texts': len(texts),
+                            'tokens': tokens,
+                            'requests': len(batches),
+                            'seconds': elapsed,
+                            'texts_per_second': len(texts) / elapsed if elapsed else 0.0,
+                            'tokens_per_second': tokens / elapsed if elapsed else 0.0}
+
+        if not results:
+            return np.empty((0, 0), dtype='float32')
+        return np.vstack(results)
+
+    def report(self):
+        """Return a human readable throughput summary of the last call to embed()"""
+        if self.last_report is None:
+            return 'No embeddings created yet'
+        r = self.last_report
+        return (f"Embedded {r['texts']} texts ({r['tokens']} tokens) in {r['requests']} requests over "
+                f"{r['seconds']:.2f}s: {r['texts_per_second']:.1f} texts/s, {r['tokens_per_second']:.0f} tokens/s")
@@ -0,0 +1,177 @@
+"""
+Persistent store of text embeddings, so rebuilding an index only calls OpenAI for texts it has never seen.
+
+Embeddings are keyed by (embedding_model, dimension, hash of the text). Each (model, dimension) pair has
+its own directory holding two append-only files:
+    vectors.f32   float32 rows of dimension values, back to back, read through np.memmap
+    keys.bin      the 16-byte blake2b digest of the text of each row, in the same order
+
+Opening a store reads only keys.bin (16 bytes per embedding) into a dictionary. Vectors are paged in
+from the memory-mapped file as they are looked up, so a rebuild of the whole corpus is bound by disk
+reads instead of embedding requests.
+
+Usage (fill a store from the texts and vectors of an existing database):
+    python embedding_store.py database/bp_db --store database/embeddings
+"""
+
+import argparse
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+import ann
+from scribe import Index
+
+
+def text_key(text):
+    """Return the 16-byte digest identifying text in the store"""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+class EmbeddingStore:
+
+    KEY_SIZE = 16
+
+    def __init__(self, directory='database/embeddings', embedding_model='text-embedding-3-small', dimension=1536):
+        """
+        Initialize an EmbeddingStore instance
+
+        Args:
+            directory (str): Root directory of the store. Each model and dimension gets a subdirectory
+            embedding_model (str): Name of the embedding model of the stored vectors
+            dimension (int): Dimension of the stored vectors
+        """
+        self.embedding_model = embedding_model
+        self.dimension = dimension
+        self.directory = os.path.join(directory, f'{embedding_model}-{dimension}')
+        os.makedirs(self.directory, exist_ok=True)
+        self.vectors_path = os.path.join(self.directory, 'vectors.f32')
+        self.keys_path = os.path.join(self.directory, 'keys.bin')
+
+        # Row of each stored text digest
+        self.rows = {}
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, 'rb') as f:
+                keys = f.read()
+            count = len(keys) // self.KEY_SIZE
+            for row in range(count):
+                self.rows[keys[row * self.KEY_SIZE:(row + 1) * self.KEY_SIZE]] = row
+        else:
+            count = 0
+
+        # Keys are written after their vectors, so rows past the last key are from an interrupted put()
+        row_size = 4 * dimension
+        if os.path.exists(self.vectors_path) and os.path.getsize(self.vectors_path) != count * row_size:
+            with open(self.vectors_path, 'r+b') as f:
+                f.truncate(count * row_size)
+        self.count = count
+
+        # Memory map of vectors.f32, reopened by _vectors() when rows have been added since
+        self.vectors = None
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return self.count
+
+    def _vectors(self):
+        if self.vectors is None or len(self.vectors) != self.count:
+            self.vectors = np.memmap(self.vectors_path, dtype='float32', mode='r', shape=(self.count, self.dimension))
+        return self.vectors
+
+    def get(self, texts):
+        """
+        Look texts up in the store.
+
+        Returns:
+            (embeddings, missing) where embeddings is an np.array of float32 with one row per text (rows
+        of missing texts are zero) and missing is the list of positions in texts that were not found
+        """
+        embeddings = np.zeros((len(texts), self.dimension), dtype='float32')
+        found, rows, missing = [], [], []
+        with self.lock:
+            for i, text in enumerate(texts):
+                row = self.rows.get(text_key(text))
+                if row is None:
+                    missing.append(i)
+                else:
+                    found.append(i)
+                    rows.append(row)
+            if rows:
+                # Read in file order, so a cold lookup of a whole corpus is one sequential pass over the file
+                order = np.argsort(rows)
+                rows = np.array(rows)[order]
+                embeddings[np.array(found)[order]] = self._vectors()[rows]
+        self.hits += len(found)
+        self.misses += len(missing)
+        return embeddings, missing
+
+    def put(self, texts, embeddings):
+        """
+        Store the embeddings of texts. Texts already in the store are skipped.
+        """
+        embeddings = np.asarray(embeddings, dtype='float32')
+        if len(texts) and embeddings.shape != (len(texts), self.dimension):
+            raise ValueError(f'Expected embeddings of shape {(len(texts), self.dimension)}, not {embeddings.shape}')
+
+        with self.lock:
+            keys, rows = [], []
+            for i, text in enumerate(texts):
+                key = text_key(text)
+                if key not in self.rows:
+                    self.rows[key] = self.count + len(keys)
+                    keys.append(key)
+                    rows.append(i)
+            if not keys:
+                return
+
+            with open(self.vectors_path, 'ab') as f:
+                f.write(np.ascontiguousarray(embeddings[rows]).tobytes())
+            with open(self.keys_path, 'ab') as f:
+                f.write(b''.join(keys))
+            self.count += len(keys)
+
+    def add_index(self, index, batch_size=100000):
+        """
+        Store the vectors of an Index alongside the texts of its utterances.
+
+        Compressed index types are read from the full-precision vectors saved beside them, never from their
+        lossy codes, which would otherwise be reused for those texts in every later ingest.
+        """
+        if index.index_type in ann.COMPRESSED_TYPES and index.full_vectors is None:
+            raise ValueError(f'This {index.index_type} database has no full-precision vectors (.vectors file), '
+                             'only lossy codes, so its embeddings cannot be stored')
+        total = index.index.ntotal
+        for start in range(0, total, batch_size):
+            stop = min(start + batch_size, total)
+            # Works for both a list of utterances and a columnar UtteranceStore
+            texts = [index.utterances[i]['text'] for i in range(start, stop)]
+            self.put(texts, index.vectors(np.arange(start, stop)))
+        return total
+
+    def stats(self):
+        """Return hit and miss counts and the number of stored embeddings"""
+        return {'hits': self.hits, 'misses': self.misses, 'entries': self.count}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('filename', type=str, help='Path prefix of the database, e.g. database/bp_db')
+    parser.add_argument('--store', type=str, default='database/embeddings', help='Root directory of the store')
+    parser.add_argument('--embedding-model', type=str, default='text-embedding-3-small', help='Model of the database embeddings')
+    args = parser.parse_args()
+
+    index = Index(embedding_model=args.embedding_model)
+    index.load_database(args.filename)
+    store = EmbeddingStore(args.store, args.embedding_model, index.index.d)
+    before = len(store)
+    index_size = store.add_index(index)
+    print(f'Added {len(store) - before} of {index_size} embeddings from {args.filename} to {store.directory}')
+
+
+if __name__ == '__main__':
+    main()
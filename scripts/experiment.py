@@ -3,6 +3,8 @@ import scribe
 
 importlib.reload(scribe)
 from scribe import Index
+from transcription_cache import TranscriptionCache
+from embedding_store import EmbeddingStore
 
 from dotenv import load_dotenv
 import os
@@ -25,7 +27,9 @@ if __name__ == "__main__":
     for char in "IJKLMNOPQRSTUVWXYZ":
         speaker_map[char] = char
         
-    bp = Index()
+    # Transcripts and embeddings are kept in database/, so a re-run never transcribes or embeds anything twice
+    bp = Index(transcription_cache=TranscriptionCache('database/transcription_cache'),
+               embedding_store=EmbeddingStore('database/embeddings'))
     bp.add_podcast('../Bible_Project/', speaker_map=speaker_map, transcription_dir="../Bible_Project_transcription")
 
 
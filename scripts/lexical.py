@@ -0,0 +1,238 @@
+"""
+BM25 keyword search over utterances, for exact phrases and rare words that embeddings rank poorly.
+
+A LexicalIndex is an inverted index stored as flat arrays in <filename>.bm25/:
+    vocabulary.json  list of terms
+    offsets.npy      start of each term's postings in doc_ids.npy / term_freqs.npy (one extra entry at the end)
+    doc_ids.npy      utterance ids, grouped by term and sorted within each term
+    term_freqs.npy   how often the term occurs in each of those utterances
+    doc_lengths.npy  number of terms in each utterance
+
+Searching needs no embedding call, so it runs entirely locally.
+
+Usage (build the index for an existing database):
+    python lexical.py database/bp_db
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+
+import numpy as np
+
+
+TOKEN_PATTERN = re.compile(r"\w+(?:'\w+)?")
+
+
+def tokenize(text):
+    """Lowercase text and split it into words, keeping contractions like "god's" together"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def parse_query(query):
+    """
+    Split a query into its terms and whether it is an exact phrase.
+
+    A query wrapped in double quotes is an exact phrase: every result must contain it word for word.
+    """
+    query = query.strip()
+    phrase = len(query) > 1 and query[0] == query[-1] == '"'
+    return tokenize(query), phrase
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuse several ranked lists of ids into one.
+
+    Args:
+        rankings (list(list)): Ranked lists of ids, best first
+        k (int): RRF constant. Larger values flatten the difference between high and low ranks
+
+    Returns:
+        list of (id, score) tuples, best first
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over a list of texts, where each text's position is its utterance id.
+    """
+
+    def __init__(self, vocabulary, offsets, doc_ids, term_freqs, doc_lengths, k1=1.2, b=0.75):
+        self.vocabulary = vocabulary
+        self.term_ids = {term: i for i, term in enumerate(vocabulary)}
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.average_length = float(np.mean(doc_lengths)) if len(doc_lengths) else 0.0
+
+    @classmethod
+    def build(cls, texts):
+        """Build a LexicalIndex over texts (e.g. [utterance['text'] for utterance in Index.utterances])"""
+        postings = {}
+        doc_lengths = []
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths.append(len(tokens))
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                postings.setdefault(token, []).append((doc_id, count))
+
+        vocabulary = sorted(postings)
+        offsets = [0]
+        doc_ids, term_freqs = [], []
+        for term in vocabulary:
+            for doc_id, count in postings[term]:
+                doc_ids.append(doc_id)
+                term_freqs.append(count)
+            offsets.append(len(doc_ids))
+
+        return cls(vocabulary,
+                   np.array(offsets, dtype='int64'),
+                   np.array(doc_ids, dtype='int32'),
+                   np.array(term_freqs, dtype='int32'),
+                   np.array(doc_lengths, dtype='int32'))
+
+    @classmethod
+    def load(cls, filename, mmap=True):
+        """Load an index saved with save(). mmap memory-maps the postings instead of reading them"""
+        directory = f'{filename}.bm25'
+        mmap_mode = 'r' if mmap else None
+        with open(os.path.join(directory, 'vocabulary.json'), 'r') as f:
+            vocabulary = json.load(f)
+
+        def column(name):
+            return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode)
+
+        return cls(vocabulary, column('offsets'), column('doc_ids'), column('term_freqs'), column('doc_lengths'))
+
+    def save(self, filename):
+        # Written aside and swapped in, since the postings may be memory-mapped from the files being replaced
+        directory = f'{filename}.bm25'
+        temporary = f'{directory}.tmp'
+        if os.path.isdir(temporary):
+            shutil.rmtree(temporary)
+        os.makedirs(temporary)
+        with open(os.path.join(temporary, 'vocabulary.json'), 'w') as f:
+            json.dump(self.vocabulary, f)
+        for name in ('offsets', 'doc_ids', 'term_freqs', 'doc_lengths'):
+            np.save(os.path.join(temporary, f'{name}.npy'), np.asarray(getattr(self, name)))
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+        os.replace(temporary, directory)
+
+    @staticmethod
+    def exists(filename):
+        return os.path.isdir(f'{filename}.bm25')
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def postings(self, term):
+        """Return (doc_ids, term_freqs) of a term, empty if the term never occurs"""
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            return np.empty(0, dtype='int32'), np.empty(0, dtype='int32')
+        start, stop = self.offsets[term_id], self.offsets[term_id + 1]
+        return self.doc_ids[start:stop], self.term_freqs[start:stop]
+
+    def search(self, query, k=5, ranges=None, text_of=None):
+        """
+        Rank utterances by BM25 score for query.
+
+        Args:
+            query (str): Keywords, or an exact phrase in double quotes
+            k (int): Number of results
+            ranges (list): Optional (start, stop) id ranges results must fall in, see Index.filter_ranges()
+            text_of (callable): Function returning the text of an utterance id. Required for exact phrase
+        queries, which check each candidate for the phrase word for word.
+
+        Returns:
+            (scores, ids): np.arrays of the k best BM25 scores and their utterance ids, best first
+        """
+        terms, phrase = parse_query(query)
+        terms = list(dict.fromkeys(terms))
+        if not terms:
+            return np.empty(0, dtype='float32'), np.empty(0, dtype='int64')
+
+        all_ids, all_scores = [], []
+        for term in terms:
+            doc_ids, term_freqs = self.postings(term)
+            if len(doc_ids) == 0:
+                if phrase:
+                    # A phrase with a word that never occurs cannot match anything
+                    return np.empty(0, dtype='float32'), np.empty(0, dtype='int64')
+                continue
+            idf = np.log(1 + (len(self) - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5))
+            lengths = self.doc_lengths[doc_ids]
+            tf = term_freqs.astype('float32')
+            norm = self.k1 * (1 - self.b + self.b * lengths / self.average_length)
+            all_ids.append(np.asarray(doc_ids))
+            all_scores.append(idf * tf * (self.k1 + 1) / (tf + norm))
+
+        if not all_ids:
+            return np.empty(0, dtype='float32'), np.empty(0, dtype='int64')
+
+        # Sum the scores of each utterance over the query terms
+        ids, inverse, counts = np.unique(np.concatenate(all_ids), return_inverse=True, return_counts=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores)).astype('float32')
+
+        keep = np.ones(len(ids), dtype=bool)
+        if phrase:
+            # Only utterances containing every word can contain the phrase
+            keep &= counts == len(terms)
+        if ranges is not None:
+            in_ranges = np.zeros(len(ids), dtype=bool)
+            for start, stop in ranges:
+                in_ranges |= (ids >= start) & (ids < stop)
+            keep &= in_ranges
+        ids, scores = ids[keep], scores[keep]
+
+        order = np.argsort(-scores, kind='stable')
+        if not phrase:
+            order = order[:k]
+            return scores[order], ids[order].astype('int64')
+
+        if text_of is None:
+            raise ValueError('text_of is required to search for an exact phrase')
+        pattern = f" {' '.join(tokenize(query))} "
+        found = []
+        for i in order:
+            if pattern in f" {' '.join(tokenize(text_of(ids[i])))} ":
+                found.append(i)
+                if len(found) == k:
+                    break
+        return scores[found], ids[found].astype('int64')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('filename', type=str, help='Path prefix of the database, e.g. database/bp_db')
+    args = parser.parse_args()
+
+    # Imported here since scribe imports this module. Loading through Index reads both .json and columnar
+    # databases
+    from scribe import Index
+    index = Index()
+    index.load_database(args.filename, mmap=True)
+    if index.lexical is not None and len(index.lexical) == len(index.utterances):
+        print(f'BM25 index in {args.filename}.bm25 is up to date')
+        return
+    index.lexical_index().save(args.filename)
+    print(f'Saved BM25 index over {len(index.utterances)} utterances in {args.filename}.bm25')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+"""
+Columnar, memory-mappable storage for utterance metadata.
+
+Instead of a JSON list of dictionaries that repeat the series and episode names on every utterance,
+an UtteranceStore keeps one column per field in a directory <filename>.columns/:
+    series.json     list of distinct series names
+    episodes.json   list of distinct episode names
+    series_ids.npy  index into series.json for each utterance
+    episode_ids.npy index into episodes.json for each utterance
+    start.npy       start time of each utterance, in seconds
+    end.npy         end time of each utterance, in seconds
+    offsets.npy     byte offset of each utterance's text in text.bin (one extra entry at the end)
+    text.bin        utf-8 text of every utterance, concatenated
+
+Databases built with a Chunker also store the utterances each window was merged from:
+    part_offsets.npy       start of each window's parts in the part_* columns (one extra entry at the end)
+    part_start.npy         start time of each part, in seconds
+    part_end.npy           end time of each part, in seconds
+    part_text_offsets.npy  character offset of each part in its window's text
+
+Loading maps the arrays into memory without parsing them, and rows are only assembled into
+dictionaries when they are asked for.
+
+Usage (convert an existing .json database):
+    python metadata.py database/bp_db
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+
+FIELDS = ('text', 'start', 'end', 'series', 'episode')
+
+PART_COLUMNS = ('part_offsets', 'part_start', 'part_end', 'part_text_offsets')
+
+
+def hms2seconds(hms):
+    """Convert an 'hh:mm:ss' timestamp (as produced by scribe.ms2hms) to a number of seconds"""
+    hours, minutes, seconds = (int(part) for part in hms.split(':'))
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def seconds2hms(seconds):
+    """Convert a number of seconds to an 'hh:mm:ss' timestamp"""
+    seconds = int(seconds)
+    return f"{seconds // 3600:02}:{(seconds % 3600) // 60:02}:{seconds % 60:02}"
+
+
+class UtteranceStore:
+    """
+    Read-mostly, list-like container of utterance dictionaries backed by columnar arrays.
+
+    Supports len(), indexing (which assembles a fresh dictionary), iteration and extend(). Utterances
+    added with extend() are kept as dictionaries until the store is saved again.
+    """
+
+    def __init__(self, series, episodes, series_ids, episode_ids, start, end, offsets, text, parts=None):
+        self.series = series
+        self.episodes = episodes
+        self.series_ids = series_ids
+        self.episode_ids = episode_ids
+        self.start = start
+        self.end = end
+        self.offsets = offsets
+        self.text = text
+
+        # (part_offsets, part_start, part_end, part_text_offsets) columns, or None without chunking
+        self.parts = parts
+
+        # Utterances appended since the columns were built
+        self.extra = []
+
+    @classmethod
+    def from_utterances(cls, utterances):
+        """Build a store from a list of utterance dictionaries (or another store)"""
+        series, episodes = {}, {}
+        series_ids, episode_ids, start, end, offsets = [], [], [], [], [0]
+        chunks = []
+        part_offsets, part_start, part_end, part_text_offsets = [0], [], [], []
+        for utterance in utterances:
+            for part in utterance.get('parts', []):
+                part_start.append(hms2seconds(part['start']))
+                part_end.append(hms2seconds(part['end']))
+                part_text_offsets.append(part['offset'])
+            part_offsets.append(len(part_start))
+            series_ids.append(series.setdefault(utterance['series'], len(series)))
+            episode_ids.append(episodes.setdefault(utterance['episode'], len(episodes)))
+            start.append(hms2seconds(utterance['start']))
+            end.append(hms2seconds(utterance['end']))
+            encoded = utterance['text'].encode('utf-8')
+            chunks.append(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+
+        parts = None
+        if part_start:
+            parts = (np.array(part_offsets, dtype='int64'),
+                     np.array(part_start, dtype='int32'),
+                     np.array(part_end, dtype='int32'),
+                     np.array(part_text_offsets, dtype='int32'))
+
+        return cls(list(series),
+                   list(episodes),
+                   np.array(series_ids, dtype='int32'),
+                   np.array(episode_ids, dtype='int32'),
+                   np.array(start, dtype='int32'),
+                   np.array(end, dtype='int32'),
+                   np.array(offsets, dtype='int64'),
+                   np.frombuffer(b''.join(chunks), dtype='uint8'),
+                   parts)
+
+    @classmethod
+    def load(cls, filename, mmap=True):
+        """
+        Load a store saved with save().
+
+        Args:
+            filename (str): Path prefix of the database, e.g. database/bp_db
+            mmap (bool): Whether to memory-map the arrays instead of reading them into RAM
+        """
+        directory = f'{filename}.columns'
+        mmap_mode = 'r' if mmap else None
+        with open(os.path.join(directory, 'series.json'), 'r') as f:
+            series = json.load(f)
+        with open(os.path.join(directory, 'episodes.json'), 'r') as f:
+            episodes = json.load(f)
+
+        def column(name):
+            return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode)
+
+        text_path = os.path.join(directory, 'text.bin')
+        if mmap and os.path.getsize(text_path) > 0:
+            text = np.memmap(text_path, dtype='uint8', mode='r')
+        else:
+            text = np.fromfile(text_path, dtype='uint8')
+
+        parts = None
+        if os.path.exists(os.path.join(directory, 'part_offsets.npy')):
+            parts = tuple(column(name) for name in PART_COLUMNS)
+
+        return cls(series,
+                   episodes,
+                   column('series_ids'),
+                   column('episode_ids'),
+                   column('start'),
+                   column('end'),
+                   column('offsets'),
+                   text,
+                   parts)
+
+    def save(self, filename):
+        """Write the store (including utterances added with extend()) to <filename>.columns/"""
+        store = UtteranceStore.from_utterances(self) if self.extra else self
+
+        directory = f'{filename}.columns'
+        os.makedirs(directory, exist_ok=True)
+
+        # Write each file beside its destination and swap it in, so that stores which still have the
+        # old files memory-mapped keep reading the old data
+        def write(name, writer):
+            path = os.path.join(directory, name)
+            with open(path + '.tmp', 'wb') as f:
+                writer(f)
+            os.replace(path + '.tmp', path)
+
+        write('series.json', lambda f: f.write(json.dumps(store.series).encode('utf-8')))
+        write('episodes.json', lambda f: f.write(json.dumps(store.episodes).encode('utf-8')))
+        for name in ('series_ids', 'episode_ids', 'start', 'end', 'offsets'):
+            write(f'{name}.npy', lambda f: np.save(f, np.asarray(getattr(store, name))))
+        write('text.bin', lambda f: f.write(np.asarray(store.text).tobytes()))
+        if store.parts is not None:
+            for name, values in zip(PART_COLUMNS, store.parts):
+                write(f'{name}.npy', lambda f: np.save(f, np.asarray(values)))
+        else:
+            for name in PART_COLUMNS:
+                if os.path.exists(os.path.join(directory, f'{name}.npy')):
+                    os.remove(os.path.join(directory, f'{name}.npy'))
+
+    @staticmethod
+    def exists(filename):
+        return os.path.isdir(f'{filename}.columns')
+
+    def __len__(self):
+        return len(self.series_ids) + len(self.extra)
+
+    def _text(self, i):
+        return bytes(self.text[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+
+    def _row(self, i):
+        row = {'text': self._text(i),
+               'start': seconds2hms(self.start[i]),
+               'end': seconds2hms(self.end[i]),
+               'series': self.series[self.series_ids[i]],
+               'episode': self.episodes[self.episode_ids[i]]}
+
+        if self.parts is not None:
+            part_offsets, part_start, part_end, part_text_offsets = self.parts
+            first, last = part_offsets[i], part_offsets[i + 1]
+            if last > first:
+                row['parts'] = [{'start': seconds2hms(part_start[j]),
+                                 'end': seconds2hms(part_end[j]),
+                                 'offset': int(part_text_offsets[j])}
+                                for j in range(first, last)]
+        return row
+
+    def __getitem__(self, i):
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('UtteranceStore index out of range')
+
+        stored = len(self.series_ids)
+        if i >= stored:
+            return dict(self.extra[i - stored])
+        return self._row(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def rows(self, indices):
+        """Assemble only the rows at indices (e.g. the ids returned by a faiss search)"""
+        return [self[i] for i in indices]
+
+    def extend(self, utterances):
+        self.extra.extend(utterances)
+
+    def field(self, name):
+        """
+        Return one field for every utterance, without assembling rows.
+
+        Series and episode come back as names; start and end as seconds.
+        """
+        if name == 'series':
+            values = [self.series[i] for i in self.series_ids]
+        elif name == 'episode':
+            values = [self.episodes[i] for i in self.episode_ids]
+        elif name in ('start', 'end'):
+            values = getattr(self, name).tolist()
+        elif name == 'text':
+            values = [self._text(i) for i in range(len(self.series_ids))]
+        else:
+            raise ValueError(f'Unknown field {name}, must be one of {FIELDS}')
+
+        if name in ('start', 'end'):
+            return values + [hms2seconds(utterance[name]) for utterance in self.extra]
+        return values + [utterance[name] for utterance in self.extra]
+
+
+def convert(filename):
+    """Convert <filename>.json into <filename>.columns/"""
+    with open(f'{filename}.json', 'r') as f:
+        utterances = json.load(f)
+    UtteranceStore.from_utterances(utterances).save(filename)
+    print(f'Converted {len(utterances)} utterances from {filename}.json to {filename}.columns')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('filename', type=str, help='Path prefix of the database to convert, e.g. database/bp_db')
+    args = parser.parse_args()
+    convert(args.filename)
+
+
+if __name__ == '__main__':
+    main()
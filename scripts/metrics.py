@@ -0,0 +1,145 @@
+"""
+Latency histograms for the stages of search and ingest, exported in the Prometheus text format.
+
+Code that does a stage wraps it in timer():
+
+    with timer('vector_search'):
+        distances, indices = self.index.search(...)
+
+which adds the duration to the stage_seconds histogram of that stage in REGISTRY. A web server exposes
+REGISTRY.render() as /metrics. Between start_trace() and end_trace(), the stages of the current request
+are also collected, so a slow request can be logged with where its time went. Work done once for several
+requests (see batching.py) is recorded for each of them with record().
+
+Histograms live in the process that recorded them, so under gunicorn each worker reports its own.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+# Bucket upper bounds in seconds, from sub-millisecond searches to multi-minute transcriptions
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Stages of the request being traced in this thread (or task), or None when not tracing
+_trace = ContextVar('trace', default=None)
+
+
+class Histogram:
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+
+class Registry:
+    """Histograms by (name, label value), each name with one label"""
+
+    def __init__(self):
+        self.histograms = {}
+        self.help = {}
+        self.labels = {}
+        self.lock = threading.Lock()
+
+    def describe(self, name, help, label):
+        self.help[name] = help
+        self.labels[name] = label
+
+    def observe(self, name, label_value, value):
+        with self.lock:
+            histogram = self.histograms.get((name, label_value))
+            if histogram is None:
+                histogram = self.histograms[(name, label_value)] = Histogram()
+            histogram.observe(value)
+
+    def render(self):
+        """Return every histogram in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            for name in sorted(self.help):
+                label = self.labels[name]
+                lines.append(f'# HELP {name} {self.help[name]}')
+                lines.append(f'# TYPE {name} histogram')
+                for (histogram_name, label_value), histogram in sorted(self.histograms.items()):
+                    if histogram_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{{label}="{label_value}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_bucket{{{label}="{label_value}",le="+Inf"}} {histogram.count}')
+                    lines.append(f'{name}_sum{{{label}="{label_value}"}} {histogram.sum}')
+                    lines.append(f'{name}_count{{{label}="{label_value}"}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+REGISTRY.describe('stage_seconds', 'Time spent in each stage of search and ingest', 'stage')
+REGISTRY.describe('request_seconds', 'Time to answer each HTTP endpoint', 'endpoint')
+
+
+@contextmanager
+def timer(stage, name='stage_seconds'):
+    """Time the body of a with statement as one observation of a stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        REGISTRY.observe(name, stage, elapsed)
+        trace = _trace.get()
+        if trace is not None:
+            trace.append((stage, elapsed))
+
+
+@contextmanager
+def collect():
+    """
+    Collect the stages timed in the body of a with statement into the yielded list, whether or not a trace
+    is being recorded. They still count towards the current trace.
+    """
+    outer = _trace.get()
+    stages = []
+    _trace.set(stages)
+    try:
+        yield stages
+    finally:
+        _trace.set(outer)
+        if outer is not None:
+            outer.extend(stages)
+
+
+def record(stages):
+    """
+    Count stages timed in another thread, e.g. by the leader of a search batch (see batching.py), as
+    stages of the current context too: once more in their histograms and in the current trace.
+    """
+    for stage, seconds in stages:
+        REGISTRY.observe('stage_seconds', stage, seconds)
+    trace = _trace.get()
+    if trace is not None:
+        trace.extend(stages)
+
+
+def start_trace():
+    """Start collecting the stages timed in the current context"""
+    _trace.set([])
+
+
+def end_trace():
+    """Stop collecting and return the stages timed since start_trace() as a list of (stage, seconds)"""
+    trace = _trace.get()
+    _trace.set(None)
+    return trace or []
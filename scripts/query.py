@@ -0,0 +1,116 @@
+"""
+Read-only search over a saved database, without the ingest-only dependencies.
+
+The server (site/app.py) and the search CLI (search.py) only load a database and search it. They have no
+use for AssemblyAI, reportlab or the openai package, which take most of a cold start to import. scribe
+imports those only when it transcribes, renders or embeds, and QueryIndex requests query embeddings over
+httpx, so a search process never loads them at all. `python startup_report.py --imports` measures the
+difference.
+
+Usage:
+    from query import QueryIndex
+
+    index = QueryIndex()
+    index.load_database('database/bp_db', mmap=True)
+    index.search('The way through the desert is the way to God', k=5)
+"""
+
+import os
+import random
+import time
+
+import httpx
+import numpy as np
+
+from embedding import retry_after
+from scribe import Index, load_env
+
+
+OPENAI_BASE_URL = 'https://api.openai.com/v1'
+
+# Responses worth retrying: rate limits and server-side failures
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class QueryEmbedder:
+    """Minimal client of the OpenAI embeddings endpoint, for embedding search queries"""
+
+    def __init__(self, api_key=None, base_url=None, timeout=30.0, max_retries=2):
+        """
+        Initialize a QueryEmbedder instance
+
+        Args:
+            api_key (str): OpenAI API key. Defaults to OPENAI_API_KEY, read from .env if needed
+            base_url (str): Base url of the API. Defaults to OPENAI_BASE_URL, or the OpenAI API
+            timeout (float): Seconds to wait for a response
+            max_retries (int): How many times a failed request is retried
+        """
+        load_env()
+        api_key = api_key or os.environ.get('OPENAI_API_KEY')
+        if not api_key:
+            raise ValueError('No OpenAI API key. Set OPENAI_API_KEY in the environment or in .env')
+        base_url = base_url or os.environ.get('OPENAI_BASE_URL') or OPENAI_BASE_URL
+        self.http = httpx.Client(base_url=base_url, timeout=timeout,
+                                 headers={'Authorization': f'Bearer {api_key}'})
+        self.max_retries = max_retries
+
+    def embed(self, texts, embedding_model, dimensions=None):
+        """
+        Embed texts with one request, retrying on rate limits, server errors and dropped connections
+        after the delay the response asks for (Retry-After), or else with backoff. Returns an np.array of float32 with one row per text.
+        """
+        payload = {'input': list(texts), 'model': embedding_model}
+        if dimensions is not None:
+            payload['dimensions'] = dimensions
+
+        for attempt in range(self.max_retries + 1):
+            wait = None
+            try:
+                response = self.http.post('/embeddings', json=payload)
+                if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                    break
+                wait = retry_after(response.headers)
+            except httpx.TransportError as e:
+                if attempt == self.max_retries:
+                    raise
+                print(f'Embedding request failed ({type(e).__name__}), retrying')
+            if wait is None:
+                wait = 0.5 * 2 ** attempt * (0.5 + random.random() / 2)
+            time.sleep(min(wait, 8.0))
+
+        response.raise_for_status()
+        data = sorted(response.json()['data'], key=lambda item: item['index'])
+        return np.array([item['embedding'] for item in data], dtype='float32')
+
+
+class QueryIndex(Index):
+    """
+    Index that only loads and searches databases. Methods that add to or rebuild the index raise.
+    """
+
+    def __init__(self, embedder=None, **index_args):
+        """
+        Initialize a QueryIndex instance
+
+        Args:
+            embedder (QueryEmbedder): Client used to embed queries. Created on the first query that is
+        not in the query cache if None, so lexical search needs no API key.
+            index_args: Passed to Index(), e.g. query_cache or embedding_model
+        """
+        super().__init__(**index_args)
+        self.embedder = embedder
+
+    def request_embeddings(self, texts):
+        if self.embedder is None:
+            self.embedder = QueryEmbedder()
+        return self.embedder.embed(texts, self.embedding_model, self.embedding_dimensions())
+
+    def _check_writable(self):
+        raise RuntimeError('QueryIndex is read-only. Load the database with scribe.Index to add to it.')
+
+    # Both replace the loaded faiss index, which Index allows even after load_database(mmap=True)
+    def build_ann_index(self, *args, **kwargs):
+        raise RuntimeError('QueryIndex is read-only. Load the database with scribe.Index to rebuild its index.')
+
+    def reduce_dimension(self, dimension):
+        raise RuntimeError('QueryIndex is read-only. Load the database with scribe.Index to shorten its embeddings.')
@@ -1,19 +1,47 @@
-import assemblyai as aai
 import json
 import os
+import shutil
+import threading
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph
 import faiss
-from openai import OpenAI
 import numpy as np
 
-from dotenv import load_dotenv
+from cache import QueryCache
+from checkpoint import Checkpoint
+from metadata import UtteranceStore
+import ann
+from lexical import LexicalIndex, reciprocal_rank_fusion
+from dedup import MIN_WORDS, collapse_results, fingerprint, location
+from metrics import timer
+from embedding import EmbeddingPipeline
+from transcription_cache import CachedTranscript
 
-load_dotenv()
+# AssemblyAI, reportlab, openai and dotenv are only imported when transcribing, rendering PDFs or
+# embedding, so that processes which only search (see query.py) never pay for importing them
 
 
+@lru_cache(maxsize=None)
+def load_env():
+    """Read API keys from the .env file into the environment, once"""
+    from dotenv import load_dotenv
+    load_dotenv()
+
+
+@lru_cache(maxsize=None)
+def assemblyai():
+    """Import AssemblyAI and set its API key, once"""
+    load_env()
+    import assemblyai as aai
+    aai.settings.api_key = os.getenv("ASSEMBLY_API_KEY")
+    return aai
+
+
+
+# Models that return shorter embeddings when asked for fewer dimensions, and their full dimension
+REDUCIBLE_MODELS = {'text-embedding-3-small': 1536, 'text-embedding-3-large': 3072}
 
 def ms2hms(ms):
     """
@@ -45,6 +73,102 @@ def make_path_name(filename: str):
     filename = filename.replace(' ', '_')
     return filename
 
+def clean_series_name(series_title: str):
+    """
+    Converts a stored series title to the name shown on the site.
+
+    Series titles were stored with the podcast name in them, which search results leave out.
+    """
+    return series_title.replace(' Bible Project ', '')
+
+def transcript_pdf(destination, episode_title, series_title, transcript):
+    """
+    Render a transcript as a .pdf file.
+
+    Args:
+        destination (str): Path of the .pdf file
+        episode_title (str): Title printed at the top
+        series_title (str): Heading printed under the title
+        transcript (list): {"text", "start", "end"} dictionaries, with a "speaker" when it is known
+    """
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.platypus import SimpleDocTemplate, Paragraph
+
+    # Set up the PDF file. exist_ok since PDFs may be rendered in parallel processes
+    directory, _ = os.path.split(destination)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    filename = destination
+    document = SimpleDocTemplate(filename, pagesize=letter)
+
+    # Create a custom style for text
+    styles = getSampleStyleSheet()
+
+    style_heading = ParagraphStyle(
+        'HeadingStyle',
+        parent=styles['Heading2'],
+        fontName='Times-Roman',
+        fontSize=16,
+        alignment=1
+    )
+
+    style_title = ParagraphStyle(
+        'TitleStyle',
+        parent=styles['Title'],
+        fontName='Times-Roman',
+        fontSize=24,
+        alignment=1
+    )
+
+    # Custom style for normal text with a serif font (Times New Roman)
+    style_normal = ParagraphStyle(
+        'NormalStyle', 
+        parent=styles['Normal'],
+        fontName='Times-Roman',  # Using Times New Roman
+        fontSize=12,
+        spaceBefore=5,
+        spaceAfter=5,
+        firstLineIndent=0,  # First line of the paragraph won't be indented
+        leftIndent=15  # Indentation for following lines
+    )
+
+    # Custom style for speaker names (no bold, same size)
+    style_speaker = ParagraphStyle(
+        'SpeakerStyle',
+        parent=styles['Normal'],
+        fontName='Times-Roman',
+        fontSize=12,
+        spaceBefore=5,
+        spaceAfter=5,
+        firstLineIndent=0  # Speaker name is on the same line as dialogue
+    )
+
+    # Create a list of paragraph objects to add to the PDF
+    content = []
+
+    # Title
+    content.append(Paragraph(episode_title, style_title))
+    content.append(Paragraph(series_title, style_heading))
+
+    # Loop through each item in the "interview" list
+    for entry in transcript:
+        speaker = entry.get("speaker")
+        text = entry["text"]
+        
+        # Add the speaker's name on the same line as the dialogue. Transcripts rebuilt from an index have none
+        dialog = f"<b>{speaker}:</b> {text}" if speaker else text
+        
+        # Add the combined speaker and text paragraph
+        content.append(Paragraph(dialog, style_normal))
+        content.append(Paragraph("", style_normal))
+
+    # Build the PDF
+    document.build(content)
+
+    print(f"PDF created: {filename}")
+
 class Episode:
 
     def __init__(self, 
@@ -56,11 +180,18 @@ class Episode:
                  speaker_map: dict={'A': 'A', 'B': 'B', 'C': 'C', 'D': 'D', 'E': 'E', 'F':'F', 'G': 'G'}, 
                  verbose: bool=False, 
                  aai_model: str='nano',
-                 http_timeout: int=240):
+                 http_timeout: int=240,
+                 transcriber=None,
+                 cache=None):
         """
         Instatiate an Episode object
         
         Params:
+            transcriber (callable): Optional function taking audio_file and returning a finished transcript
+        object with status, error and utterances attributes, like aai.Transcriber().transcribe() does. 
+        Used to swap in a fake transcriber. If None, AssemblyAI is used.
+            cache (TranscriptionCache): If given, a transcript of the same audio with the same settings is
+        read from the cache instead of being transcribed again, and new transcripts are stored in it.
         """
 
         
@@ -70,38 +201,107 @@ class Episode:
         self.episode_title = episode_title
         self.series_title = series_title
 
-        # Set speech_model from the parameter aai_model using a map
-        speech_model_map = {'best': aai.SpeechModel.best,
-                            'nano': aai.SpeechModel.nano}
-        speech_model = speech_model_map.get(aai_model, None)
-
         # Raise ValueError if an invalid speech model is passed in
-        if not speech_model:
-            raise ValueError('aai_model parameter for Episode() must be "nano" or "best", not {aai_model}')
-
-        # Set timeout time from parameter http_timeout
-        # This is how long the transcriber will wait for a response from a url
-        aai.settings.http_timeout = http_timeout
-
-        # Create aai.TranscriptionConfig() object using parameters, with speakers_expected if any are expected.
-        if speakers_expected > 0:
-            config = aai.TranscriptionConfig(speech_model=speech_model, 
-                                            speaker_labels=speaker_labels, 
-                                            speakers_expected=speakers_expected)
-        else:
-            config = aai.TranscriptionConfig(speech_model=speech_model, 
-                                speaker_labels=speaker_labels)
-
-        # Call aai.Transcriber.transcribe() to create transcription. audio_file may be an .mp3 file or a download url
-        transcriber = aai.Transcriber(config=config).transcribe(audio_file)
-
-        # Raise RuntimeError if transcription fails
-        if transcriber.status == "error":
-            raise RuntimeError(f"Transcription failed: {transcriber.error}")
+        if aai_model not in ('nano', 'best'):
+            raise ValueError(f'aai_model parameter for Episode() must be "nano" or "best", not {aai_model}')
+
+        # Look for a transcript of the same audio with the same settings before paying for a new one
+        settings = self.transcription_settings(aai_model, speaker_labels, speakers_expected)
+        raw_transcript = None
+        if cache is not None:
+            key = cache.key(audio_file, settings)
+            raw_transcript = cache.get(key)
+            if raw_transcript is not None and verbose:
+                print(f'Transcript of {episode_title} read from the transcription cache')
+
+        if raw_transcript is None and transcriber is None:
+            aai = assemblyai()
+
+            # Set speech_model from the parameter aai_model using a map
+            speech_model_map = {'best': aai.SpeechModel.best,
+                                'nano': aai.SpeechModel.nano}
+            speech_model = speech_model_map[aai_model]
+
+            # Set timeout time from parameter http_timeout
+            # This is how long the transcriber will wait for a response from a url
+            aai.settings.http_timeout = http_timeout
+
+            # Create aai.TranscriptionConfig() object using parameters, with speakers_expected if any are expected.
+            if speakers_expected > 0:
+                config = aai.TranscriptionConfig(speech_model=speech_model, 
+                                                speaker_labels=speaker_labels, 
+                                                speakers_expected=speakers_expected)
+            else:
+                config = aai.TranscriptionConfig(speech_model=speech_model, 
+                                    speaker_labels=speaker_labels)
+            transcriber = aai.Transcriber(config=config).transcribe
+
+        if raw_transcript is None:
+            # Call aai.Transcriber.transcribe() to create transcription. audio_file may be an .mp3 file or a download url
+            with timer('transcribe'):
+                transcriber = transcriber(audio_file)
+
+            # Raise RuntimeError if transcription fails
+            if transcriber.status == "error":
+                raise RuntimeError(f"Transcription failed: {transcriber.error}")
+
+            # Keep only the raw utterances, which is all a transcript is re-derived from
+            raw_transcript = CachedTranscript.from_transcript(transcriber)
+            if cache is not None and raw_transcript.utterances:
+                cache.put(key, raw_transcript, source=audio_file, settings=settings)
+
+        # Raw utterances with AssemblyAI's speaker labels, so the transcript can be re-derived locally
+        self.raw_transcript = raw_transcript
+        self.speaker_map = speaker_map
         
         # Store a list of dictionaries containing speaker, text, start time, and end time for each utterance as self.transcript
-        self.transcript = self.create_transcript(transcriber, speaker_map, verbose)
-        
+        self.transcript = self.create_transcript(raw_transcript, speaker_map, verbose)
+
+    @staticmethod
+    def transcription_settings(aai_model='nano', speaker_labels=True, speakers_expected=0):
+        """Return the settings that change what AssemblyAI returns, which key the transcription cache"""
+        return {'speech_model': aai_model,
+                'speaker_labels': bool(speaker_labels),
+                'speakers_expected': int(speakers_expected)}
+
+    @classmethod
+    def from_transcript(cls, 
+                        episode_title: str, 
+                        series_title: str, 
+                        transcript, 
+                        speaker_map: dict={'A': 'A', 'B': 'B', 'C': 'C', 'D': 'D', 'E': 'E', 'F':'F', 'G': 'G'}):
+        """
+        Build an Episode from a finished transcript (e.g. a CachedTranscript) without transcribing anything
+        """
+        episode = cls.__new__(cls)
+        episode.episode_title = episode_title
+        episode.series_title = series_title
+        episode.raw_transcript = CachedTranscript.from_transcript(transcript)
+        episode.speaker_map = speaker_map
+        episode.transcript = episode.create_transcript(episode.raw_transcript, speaker_map)
+        return episode
+
+    @classmethod
+    def from_cache(cls, 
+                   episode_title: str, 
+                   series_title: str, 
+                   audio_file: str, 
+                   cache, 
+                   speaker_map: dict={'A': 'A', 'B': 'B', 'C': 'C', 'D': 'D', 'E': 'E', 'F':'F', 'G': 'G'},
+                   speaker_labels: bool=True, 
+                   speakers_expected: int=0, 
+                   aai_model: str='nano'):
+        """
+        Build an Episode from the transcription cache without contacting AssemblyAI.
+
+        Raises:
+            KeyError: if audio_file has not been transcribed with these settings
+        """
+        settings = cls.transcription_settings(aai_model, speaker_labels, speakers_expected)
+        transcript = cache.get(cache.key(audio_file, settings))
+        if transcript is None:
+            raise KeyError(f'No cached transcript of {audio_file.strip()} with settings {settings}')
+        return cls.from_transcript(episode_title, series_title, transcript, speaker_map)
 
     def create_transcript(self, transcriber, speaker_map, verbose=False):
         # Initialize empty list
@@ -125,10 +325,15 @@ class Episode:
         # return list of dictionaries
         return transcript
 
-    # This is a work in progress, and fairly useless right now
     def add_speaker_labels(self, speaker_map={'A': 'A', 'B': 'B', 'C': 'C'}):
-        for utterance in self.transcript:
-            utterance['speaker'] = speaker_map[utterance['speaker']]
+        """
+        Relabel the speakers of the transcript with a new map from AssemblyAI's labels to speaker names.
+
+        The transcript is re-derived from the raw utterances, so this works however many times the
+        speakers have already been renamed, and needs no new transcription.
+        """
+        self.speaker_map = speaker_map
+        self.transcript = self.create_transcript(self.raw_transcript, speaker_map)
 
     # Save transcript as a .json file
     def save_as_json(self, destination):    
@@ -143,132 +348,270 @@ class Episode:
 
     # Save transcript as a .pdf file
     def save_as_pdf(self, destination):
-        # Set up the PDF file
-        directory, _ = os.path.split(destination)
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-
-        filename = destination
-        document = SimpleDocTemplate(filename, pagesize=letter)
-
-        # Create a custom style for text
-        styles = getSampleStyleSheet()
-
-        style_heading = ParagraphStyle(
-            'HeadingStyle',
-            parent=styles['Heading2'],
-            fontName='Times-Roman',
-            fontSize=16,
-            alignment=1
-        )
-
-        style_title = ParagraphStyle(
-            'TitleStyle',
-            parent=styles['Title'],
-            fontName='Times-Roman',
-            fontSize=24,
-            alignment=1
-        )
-
-        # Custom style for normal text with a serif font (Times New Roman)
-        style_normal = ParagraphStyle(
-            'NormalStyle', 
-            parent=styles['Normal'],
-            fontName='Times-Roman',  # Using Times New Roman
-            fontSize=12,
-            spaceBefore=5,
-            spaceAfter=5,
-            firstLineIndent=0,  # First line of the paragraph won't be indented
-            leftIndent=15  # Indentation for following lines
-        )
-
-        # Custom style for speaker names (no bold, same size)
-        style_speaker = ParagraphStyle(
-            'SpeakerStyle',
-            parent=styles['Normal'],
-            fontName='Times-Roman',
-            fontSize=12,
-            spaceBefore=5,
-            spaceAfter=5,
-            firstLineIndent=0  # Speaker name is on the same line as dialogue
-        )
-
-        # Create a list of paragraph objects to add to the PDF
-        content = []
-
-        # Title
-        content.append(Paragraph(self.episode_title, style_title))
-        content.append(Paragraph(self.series_title, style_heading))
-
-        # Loop through each item in the "interview" list
-        for entry in self.transcript:
-            speaker = entry["speaker"]
-            text = entry["text"]
-            
-            # Add the speaker's name on the same line as the dialogue
-            dialog = f"<b>{speaker}:</b> {text}"
-            
-            # Add the combined speaker and text paragraph
-            content.append(Paragraph(dialog, style_normal))
-            content.append(Paragraph("", style_normal))
-
-        # Build the PDF
-        document.build(content)
-
-        print(f"PDF created: {filename}")
+        transcript_pdf(destination, self.episode_title, self.series_title, self.transcript)
 
 # This is the main class for the vector database
 class Index:
-    # Set AssemblyAI API key
-    aai.settings.api_key = os.getenv("ASSEMBLY_API_KEY")
 
-    def __init__(self, dimension=1536, embedding_model='text-embedding-3-small'):
+    def __init__(self, 
+                 dimension=1536, 
+                 embedding_model='text-embedding-3-small', 
+                 query_cache=None, 
+                 index_type='flat', 
+                 index_params=None,
+                 chunker=None,
+                 deduplicator=None,
+                 transcription_cache=None,
+                 embedding_store=None,
+                 rerank_factor=4):
         """
         Initialize an Index instance
         
         Args:
             dimension (int): The dimension of the paragraph embedding used. Should match the size
-        of the embeddings produced by the selected embedding model.
+        of the embeddings produced by the selected embedding model. text-embedding-3 models are asked
+        for embeddings of this size, so a smaller dimension (e.g. 512) gives a smaller index.
 
             embedding_model (str): Name of the embedding model. Currently, only openai models are supported
+
+            query_cache (QueryCache): Cache for query embeddings, so that repeated searches skip the
+        OpenAI call. If None, an in-memory cache is used.
+
+            index_type (str): Type of faiss index, one of ann.INDEX_TYPES. IVF types must be trained, so
+        ingest with 'flat' and convert afterwards with build_ann_index().
+
+            index_params (dict): Parameters of the index type, see ann.DEFAULT_PARAMS
+
+            chunker (Chunker): If given, adjacent short utterances of each episode are merged into 
+        token-capped windows before they are embedded, so the index holds fewer vectors
+
+            deduplicator (DuplicateDetector): If given, utterances that repeat one already in the index
+        (e.g. from a re-released episode) are not stored again. Their locations are recorded in 
+        self.duplicates instead, and search results list every location of a passage.
+
+            transcription_cache (TranscriptionCache): If given, episodes already transcribed (by this or an
+        earlier run) are read from the cache instead of being sent to AssemblyAI again
+
+            embedding_store (EmbeddingStore): If given, texts embedded before (by this or an earlier run)
+        are read from the store, and only new texts are sent to OpenAI. Must match embedding_model and
+        dimension.
+            rerank_factor (int): For compressed index types (ann.COMPRESSED_TYPES), how many times k
+        candidates the compressed search returns, to be re-ranked exactly against the full-precision
+        vectors. 0 turns re-ranking off.
         """
         # Set dimension attribute
         self.dimension = dimension
-        # Initialize faiss.IndexFlatL2() object and set it as index attribute
-        self.index = faiss.IndexFlatL2(dimension)
+        # Initialize faiss index object (faiss.IndexFlatL2() by default) and set it as index attribute
+        self.index_type = index_type
+        self.index_params = dict(index_params or {})
+        self.index = ann.make_index(index_type, dimension, **self.index_params)
+
+        # Full-precision vectors of a compressed index, for re-ranking. In RAM while ingesting, and
+        # memory-mapped from <filename>.vectors once saved and loaded
+        self.rerank_factor = rerank_factor
+        self.full_vectors = np.empty((0, dimension), dtype='float32') if index_type in ann.COMPRESSED_TYPES else None
+
+        # Default nprobe / efSearch for search(), saved with the database
+        self.nprobe = None
+        self.ef_search = None
         # Initialize empty list of utterances
         self.utterances = []
 
-        # Create OpenAI() client and set embedding_model attribute
-        self.client = OpenAI()
+        # OpenAI() client, created by the client property on first use, and embedding_model attribute
+        self._client = None
         self.embedding_model = embedding_model
 
-    def add_batch_embeddings(self, texts, batch_size=100):
+        # Cache of query embeddings used by search()
+        self.query_cache = query_cache if query_cache is not None else QueryCache()
+
+        # Open append-only checkpoints, by filename. See add_episode()
+        self.checkpoints = {}
+
+        # Set by load_database(mmap=True). A memory-mapped faiss index cannot be added to
+        self.read_only = False
+
+        # Optional chunking stage between Episode.transcript and add_batch_embeddings()
+        self.chunker = chunker
+
+        # BM25 index over utterance texts, built lazily by lexical_index() or loaded with the database
+        self.lexical = None
+        # Server threads may ask for the BM25 index at the same time, and only one of them should build it
+        self.lexical_lock = threading.Lock()
+
+        # Contiguous id ranges of each (series, episode), built lazily by filter_ranges()
+        self.episode_ranges = None
+        self.episode_ranges_size = 0
+
+        # Optional near-duplicate detection at ingest, and the extra locations of stored utterances by id
+        self.deduplicator = deduplicator
+        self.deduplicator_size = 0
+        self.duplicates = {}
+
+        # Sorted (start, stop) id ranges of removed episodes, left out of every search. See remove_episode()
+        self.removed = []
+        self.removed_selector = None
+
+        # Raw transcripts by audio and settings, passed to every Episode() created by ingest_episodes()
+        self.transcription_cache = transcription_cache
+
+        # Embeddings of every text embedded so far, consulted by embed_texts() before calling OpenAI
+        if embedding_store is not None and (embedding_store.embedding_model, embedding_store.dimension) != (embedding_model, dimension):
+            raise ValueError(f'embedding_store holds {embedding_store.embedding_model} embeddings of dimension '
+                             f'{embedding_store.dimension}, not {embedding_model} of dimension {dimension}')
+        self.embedding_store = embedding_store
+
+    def embed_query(self, query):
+        """
+        Return the embedding of a search query as an np.array of float32, using the query cache
+        when possible.
+        """
+        return self.embed_queries([query])[0]
+
+    def embed_queries(self, queries):
+        """
+        Return the embeddings of search queries as an np.array of float32 with one row per query.
+
+        Queries found in the query cache are not embedded again, and the rest (each distinct query once)
+        are embedded with a single request.
+        """
+        # Shortened embeddings are cached apart from full ones
+        dimensions = self.embedding_dimensions()
+        cache_model = self.embedding_model if dimensions is None else f'{self.embedding_model}:{dimensions}'
+        with timer('query_cache'):
+            embeddings = [self.query_cache.get(cache_model, query) for query in queries]
+
+        missing = list(dict.fromkeys(query for query, embedding in zip(queries, embeddings) if embedding is None))
+        if missing:
+            with timer('embed_query'):
+                new = dict(zip(missing, self.request_embeddings(missing)))
+            for query, embedding in new.items():
+                self.query_cache.put(cache_model, query, embedding)
+            embeddings = [new[query] if embedding is None else embedding for query, embedding in zip(queries, embeddings)]
+            print('Query embedding obtained' if len(queries) == 1 else f'Embedded {len(missing)} of {len(queries)} queries')
+        else:
+            print('Query embedding loaded from cache')
+        return np.array(embeddings, dtype='float32').reshape(len(queries), -1)
+
+    @property
+    def client(self):
+        """OpenAI() client, created (and openai imported) the first time something is embedded"""
+        if self._client is None:
+            load_env()
+            from openai import OpenAI
+            self._client = OpenAI()
+        return self._client
+
+    def request_embeddings(self, texts):
+        """Embed texts with a single request to the embeddings endpoint. Returns an np.array of float32"""
+        response = self.client.embeddings.create(input=texts, model=self.embedding_model, **self._dimensions_args())
+        return np.array([item.embedding for item in response.data]).astype('float32')
+
+    def embedding_dimensions(self):
+        """The number of dimensions to ask OpenAI for, or None for the model's full size"""
+        if self.dimension != REDUCIBLE_MODELS.get(self.embedding_model, self.dimension):
+            return self.dimension
+        return None
+
+    def _dimensions_args(self):
+        dimensions = self.embedding_dimensions()
+        return {} if dimensions is None else {'dimensions': dimensions}
+
+    def _add_vectors(self, embeddings):
+        """Add embeddings to the faiss index, and to the full-precision vectors of a compressed index"""
+        self.index.add(embeddings)
+        if self.full_vectors is not None:
+            # A loaded memory map becomes an in-memory copy here, until the database is saved again
+            self.full_vectors = np.vstack([self.full_vectors, embeddings])
+
+    def vectors(self, ids):
+        """Return the stored vectors of utterance ids, at full precision when the index is compressed"""
+        if self.full_vectors is not None:
+            return np.asarray(self.full_vectors[np.asarray(ids, dtype='int64')], dtype='float32')
+        return ann.reconstruct(self.index, ids)
+
+    def all_vectors(self):
+        """Return every stored vector, at full precision when the index is compressed"""
+        if self.full_vectors is not None:
+            return np.asarray(self.full_vectors, dtype='float32')
+        return ann.index_vectors(self.index)
+
+    def _check_writable(self):
+        """Raise if vectors cannot be added to the index"""
+        if self.read_only:
+            raise RuntimeError('Index was loaded with load_database(mmap=True) and is read-only. '
+                               'Load it with mmap=False to add to it.')
+        if not self.index.is_trained:
+            raise RuntimeError(f'A {self.index_type} index must be trained before adding to it. '
+                               'Ingest with index_type="flat" and convert with build_ann_index().')
+
+    def add_batch_embeddings(self, texts, batch_size=100, max_workers=4, max_batch_tokens=50000):
         """
         Create embeddings for a list of texts (utterances, in this case) and add them to the faiss 
         index. 
 
         Args:
             texts (list(str)): List of strings to be embedded and stored
-            batch_size (int): How many to send to OpenAI at a time
-        """
-        # Iterate through batches of the list of texts
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i: i+batch_size]
+            batch_size (int): Maximum number of texts sent to OpenAI in a single request
+            max_workers (int): Maximum number of requests to OpenAI in flight at once
+            max_batch_tokens (int): Maximum number of tokens sent to OpenAI in a single request
 
-            # Get embeddings for the current batch, convert to np.array() of float32
-            response = self.client.embeddings.create(input=batch, model=self.embedding_model)
-            batch_embeddings = np.array([item.embedding for item in response.data]).astype('float32')
+        Returns:
+            np.array of float32 embeddings that were added, one row per text
+        """
+        self._check_writable()
+        embeddings = self.embed_texts(texts, batch_size, max_workers, max_batch_tokens)
+        if not len(embeddings):
+            return embeddings
 
-            # Use add method of faiss.IndexFlatL2 object to add batch_embeddings
-            self.index.add(batch_embeddings)
+        # Use add method of faiss index object to add embeddings
+        with timer('index_add'):
+            self._add_vectors(embeddings)
 
         # Print a statement to show status to user
         print('Created and added embeddings to index')
 
+        return embeddings
+
+    def embed_texts(self, texts, batch_size=100, max_workers=4, max_batch_tokens=50000):
+        """
+        Create embeddings for a list of texts without adding them to the index. See add_batch_embeddings()
+        """
+        if not texts:
+            return np.empty((0, self.dimension), dtype='float32')
+
+        # Only texts missing from the embedding store are sent to OpenAI
+        if self.embedding_store is not None:
+            with timer('embedding_store'):
+                stored, missing = self.embedding_store.get(texts)
+            if not missing:
+                return stored
+            print(f'{len(texts) - len(missing)} of {len(texts)} embeddings read from the embedding store')
+            new_texts = [texts[i] for i in missing]
+        else:
+            new_texts = texts
+
+        # Embed batches concurrently, with retries on rate limits. Rows come back in the order of texts
+        pipeline = EmbeddingPipeline(self.client, 
+                                     embedding_model=self.embedding_model, 
+                                     max_workers=max_workers, 
+                                     max_batch_tokens=max_batch_tokens, 
+                                     max_batch_size=batch_size,
+                                     dimensions=self.embedding_dimensions())
+        with timer('embed'):
+            embeddings = pipeline.embed(new_texts)
+        print(pipeline.report())
+
+        if self.embedding_store is not None:
+            self.embedding_store.put(new_texts, embeddings)
+            stored[missing] = embeddings
+            embeddings = stored
+
+        return embeddings
+
     ####### The folowing methods are hierarchical, each performing the former iteratively. ######
 
-    def add_episode(self, episode: Episode, batch_size=100):
+    @timer('add_episode')
+    def add_episode(self, episode: Episode, batch_size=100, checkpoint='temp'):
         """
         Add an episode's transcript (or list of utterances) to the index.
 
@@ -277,101 +620,271 @@ class Index:
         it to the index will allow it to be searchable.
             batch_size (int): Size of batch of utterances sent to OpenAI in the add_batch_embeddings()
         call in this function.
+            checkpoint (str): Path prefix of the append-only checkpoint the episode is written to. Only
+        this episode's vectors and metadata are appended. If None, no checkpoint is written.
         """
+        # Merge short utterances into windows if a chunker is set. Each window lists its utterances in 'parts'
+        transcript = episode.transcript
+        if self.chunker is not None:
+            transcript = self.chunker(transcript)
+            print(self.chunker.report())
+
         # Turn episode utterances into list of dictionaries containing desired data
-        documents = [{'text': utterance['text'],
-                            'start': utterance['start'],
-                            'end': utterance['end'],
-                            'series': episode.series_title,
-                            'episode': episode.episode_title}
-                            for utterance in episode.transcript]
-        
-        # Add this list of dictionaries to the utterances attribute
-        self.utterances.extend(documents)
+        documents = []
+        for utterance in transcript:
+            document = {'text': utterance['text'],
+                        'start': utterance['start'],
+                        'end': utterance['end'],
+                        'series': episode.series_title,
+                        'episode': episode.episode_title}
+            if 'parts' in utterance:
+                document['parts'] = utterance['parts']
+            documents.append(document)
+
+        if self.deduplicator is not None:
+            self._check_writable()
+            documents, embeddings, duplicates = self.deduplicate(documents, batch_size)
+            with timer('index_add'):
+                self._add_vectors(embeddings)
+            print(f'Added {len(documents)} new utterances to index, skipped {len(duplicates)} duplicates')
+            for idx, duplicate in duplicates:
+                self.duplicates.setdefault(idx, []).append(duplicate)
+        else:
+            # Create list of texts (what the speakers actually say) and pass into add_batch_embeddings()
+            texts = [doc['text'] for doc in documents]
+            embeddings = self.add_batch_embeddings(texts, batch_size)
+            duplicates = None
 
-        # Create list of texts (what the speakers actually say) and pass into add_batch_embeddings()
-        texts = [doc['text'] for doc in documents]
-        self.add_batch_embeddings(texts, batch_size)
+        # Add this list of dictionaries to the utterances attribute, once their embeddings are in the index
+        self.utterances.extend(documents)
 
         # Descriptive print statement
         print("Index and utterances initialized.")
 
-        # Save checkpoint to allow for easy loading. Hardcoded checkpoint name, for now
-        self.save_database('temp')
+        # Append this episode to the checkpoint to allow for easy resuming
+        if checkpoint:
+            if checkpoint not in self.checkpoints:
+                self.checkpoints[checkpoint] = Checkpoint(checkpoint, self.dimension)
+            self.checkpoints[checkpoint].append(documents, embeddings, duplicates)
 
-        # Descriptive print statement
-        print("Checkpoint saved")
+            # Descriptive print statement
+            print("Checkpoint saved")
 
-    def add_series(self, 
-                   download_path, 
-                   temp_episodes,
-                   batch_size=100, 
-                   speaker_map={'A': 'A', 'B': 'B', 'C': 'C', 'D': 'D', 'E': 'E', 'F':'F', 'G': 'G'}, 
-                   transcribe=False, 
-                   transcription_dir=None):
+    def deduplicate(self, documents, batch_size=100):
+        """
+        Split an episode's documents into new ones and duplicates of utterances already in the index.
+
+        A document whose normalized text matches a stored utterance (or an earlier document of the
+        episode) is a duplicate without being embedded. The others are embedded, and those whose MinHash
+        signature is close to a stored utterance's are duplicates if their embeddings are close too.
+
+        Args:
+            documents (list(dict)): Documents of one episode, as built in add_episode()
+            batch_size (int): Size of batch of utterances sent to OpenAI
+
+        Returns:
+            (documents, embeddings, duplicates): the new documents and their embeddings, and a list of
+        (utterance id, location) pairs, one for each duplicate
+        """
+        detector = self.duplicate_detector()
+
+        # Exact repeats first, so they are never sent to OpenAI
+        duplicates = []
+        remaining = []
+        # Repeats within the episode, as (row in remaining of the first occurrence, location)
+        repeats = []
+        seen = {}
+        for document in documents:
+            idx = detector.exact_match(document['text'])
+            if idx is not None:
+                duplicates.append((idx, location(document)))
+                continue
+            if detector.eligible(document['text']):
+                key = fingerprint(document['text'])
+                if key in seen:
+                    repeats.append((seen[key], location(document)))
+                    continue
+                seen[key] = len(remaining)
+            remaining.append(document)
+
+        embeddings = self.embed_texts([document['text'] for document in remaining], batch_size)
+
+        # Near repeats need both a similar MinHash signature and a close embedding
+        kept, kept_rows, ids = [], [], {}
+        for row, document in enumerate(remaining):
+            candidates = detector.candidates(document['text'])
+            if candidates:
+                vectors = self.vectors([int(idx) for idx in candidates])
+                position = detector.confirm(embeddings[row], vectors)
+                if position is not None:
+                    ids[row] = int(candidates[position])
+                    # Unlike an exact repeat, a near repeat keeps its own wording
+                    duplicates.append((ids[row], dict(location(document), text=document['text'])))
+                    continue
+            ids[row] = len(self.utterances) + len(kept)
+            kept.append(document)
+            kept_rows.append(row)
+
+        # Repeats within the episode point at wherever their first occurrence ended up
+        duplicates.extend((ids[row], duplicate) for row, duplicate in repeats)
+        return kept, embeddings[kept_rows], duplicates
+
+    def duplicate_detector(self):
+        """Return the DuplicateDetector, registering any utterances added since it was last used"""
+        if self.deduplicator_size > len(self.utterances):
+            self.deduplicator.clear()
+            self.deduplicator_size = 0
+        for idx in range(self.deduplicator_size, len(self.utterances)):
+            if not self.is_removed(idx):
+                self.deduplicator.add(idx, self.utterances[idx]['text'])
+        self.deduplicator_size = len(self.utterances)
+        return self.deduplicator
+
+    def series_jobs(self, download_path, transcription_dir='transcripts'):
+        """
+        List the episodes of a series without transcribing them.
+
+        Args:
+            download_path (str): Directory of .mp3 files, or .txt file of "title,url" lines
+            transcription_dir (str): Directory PDF transcripts are written to
+
+        Returns:
+            list of (episode_title, series_title, audio_source, pdf_path) tuples
+        """
+        jobs = []
         if os.path.isdir(download_path):
             series_title = clean_path_name(download_path)
             for root, dirs, files in os.walk(download_path):
                 # Do not enter subdirectories
                 if dirs:
                     raise ValueError(f"Subdirectories found: {dirs}")
-                
+
                 for audio_file in files:
-                    print(f'Processing: {audio_file}')
                     if not audio_file.lower().endswith('.mp3'):
                         raise ValueError(f"Non-MP3 file found: {audio_file}")
-                    
+
                     episode_title = clean_path_name(audio_file)
-                    if episode_title in temp_episodes:
-                        print(f"Episode: {episode_title} already loaded")
-                        continue
-                    print(f'Series: {series_title}, Episode: {episode_title}')
                     audio_file_path = os.path.join(download_path, audio_file)
-                    print(f"Path: {audio_file_path}")
-                    new_episode = Episode(episode_title, series_title, audio_file_path, speaker_map=speaker_map)
-
-                    if transcribe:
-                        if not transcription_dir:
-                            transcription_dir = f'transcripts'
-                        transcript_file_path = audio_file_path.replace('mp3', 'pdf')
-                        transcript_output_path = os.path.join(transcription_dir, transcript_file_path)
-                        new_episode.save_as_pdf(transcript_output_path)
-
-                    self.add_episode(new_episode, batch_size=batch_size)
+                    transcript_file_path = audio_file_path.replace('mp3', 'pdf')
+                    transcript_output_path = os.path.join(transcription_dir, transcript_file_path)
+                    jobs.append((episode_title, series_title, audio_file_path, transcript_output_path))
                 break
-            
+
         elif download_path.split('.')[-1] == 'txt':
             series_title = clean_path_name(download_path.split('.')[-2])
             with open(download_path, 'r') as file:
                 lines = file.readlines()
-            
+
             for line in lines:
                 episode_info = line.split(',')
                 if len(episode_info) != 2:
                     raise ValueError(f'lines in the download_info .txt file must have two items each \n Your line is {line}')
                 episode_title, download_url = episode_info[0],  episode_info[1]
+                transcript_file_path = make_path_name(episode_title) + '.pdf'
+                transcript_output_path = os.path.join(transcription_dir, transcript_file_path)
+                jobs.append((episode_title, series_title, download_url, transcript_output_path))
+        else:
+            raise ValueError(f'download_path must be directory or .txt file instead of : {download_path}')
 
-                if episode_title in temp_episodes:
-                    continue
+        return jobs
+
+    def ingest_episodes(self,
+                        jobs,
+                        batch_size=100,
+                        speaker_map={'A': 'A', 'B': 'B', 'C': 'C', 'D': 'D', 'E': 'E', 'F':'F', 'G': 'G'},
+                        transcribe=False,
+                        max_concurrent=1,
+                        skip_failed=True,
+                        transcriber=None,
+                        checkpoint='temp'):
+        """
+        Transcribe a list of episodes and add them to the index, pipelining transcription with embedding.
 
+        Up to max_concurrent transcription jobs run at once on a thread pool. Each transcript is embedded
+        and added to the index as soon as it finishes, while the other jobs keep running.
+
+        Args:
+            jobs (list): (episode_title, series_title, audio_source, pdf_path) tuples, see series_jobs()
+            batch_size (int): Size of batch of utterances sent to OpenAI
+            speaker_map (dict): Map from AssemblyAI speaker labels to speaker names
+            transcribe (bool): Whether to also save each transcript as a PDF at its pdf_path
+            max_concurrent (int): Maximum number of transcription jobs in flight at once
+            skip_failed (bool): If True, an episode whose transcription fails is reported and skipped.
+        If False, the pending jobs are cancelled and the error is raised.
+            transcriber (callable): Passed through to Episode(), to swap in a fake transcriber
+            checkpoint (str): Passed through to add_episode()
+
+        Returns:
+            dict mapping episode_title to the exception of every episode that failed
+        """
+        failures = {}
+        with ThreadPoolExecutor(max_workers=max_concurrent) as executor:
+            futures = {}
+            for episode_title, series_title, audio_source, pdf_path in jobs:
+                print(f'Series: {series_title}, Episode: {episode_title}')
+                future = executor.submit(Episode, episode_title, series_title, audio_source,
+                                         speaker_map=speaker_map, transcriber=transcriber,
+                                         cache=self.transcription_cache)
+                futures[future] = (episode_title, pdf_path)
+
+            # Embed and index transcripts in the order they finish
+            for future in as_completed(futures):
+                episode_title, pdf_path = futures[future]
                 try:
-                    print(f'Series: {series_title}, Episode: {episode_title}')
-                    new_episode = Episode(episode_title, series_title, download_url, speaker_map=speaker_map)
-                except RuntimeError as e:
-                    print(f"{episode_title} failed to load due to Runtime Error")
+                    new_episode = future.result()
+                except Exception as e:
+                    if not skip_failed:
+                        for pending in futures:
+                            pending.cancel()
+                        raise
+                    print(f"{episode_title} failed to load due to {type(e).__name__}")
                     print(e)
+                    failures[episode_title] = e
                     continue
-                
+
                 if transcribe:
-                    if not transcription_dir:
-                        transcription_dir = f'transcripts'
-                    transcript_file_path = make_path_name(episode_title) + '.pdf'
-                    transcript_output_path = os.path.join(transcription_dir, transcript_file_path)
-                    new_episode.save_as_pdf(transcript_output_path)
+                    new_episode.save_as_pdf(pdf_path)
 
-                self.add_episode(new_episode, batch_size=batch_size)
-        else:
-            raise ValueError(f'download_path must be directory or .txt file instead of : {download_path}')
+                self.add_episode(new_episode, batch_size=batch_size, checkpoint=checkpoint)
+
+        return failures
+
+    def add_series(self,
+                   download_path,
+                   temp_episodes,
+                   batch_size=100,
+                   speaker_map={'A': 'A', 'B': 'B', 'C': 'C', 'D': 'D', 'E': 'E', 'F':'F', 'G': 'G'},
+                   transcribe=False,
+                   transcription_dir=None,
+                   max_concurrent=1,
+                   skip_failed=True,
+                   transcriber=None,
+                   checkpoint='temp'):
+        """
+        Add every episode of a series to the index, skipping those in temp_episodes.
+
+        See series_jobs() for the accepted layouts of download_path, and ingest_episodes() for
+        max_concurrent, skip_failed, transcriber and checkpoint.
+        """
+        if not transcription_dir:
+            transcription_dir = f'transcripts'
+
+        jobs = []
+        for job in self.series_jobs(download_path, transcription_dir):
+            episode_title = job[0]
+            if episode_title in temp_episodes:
+                print(f"Episode: {episode_title} already loaded")
+                continue
+            jobs.append(job)
+
+        return self.ingest_episodes(jobs,
+                                    batch_size=batch_size,
+                                    speaker_map=speaker_map,
+                                    transcribe=transcribe,
+                                    max_concurrent=max_concurrent,
+                                    skip_failed=skip_failed,
+                                    transcriber=transcriber,
+                                    checkpoint=checkpoint)
 
     def add_podcast(self, 
                     source_path, 
@@ -379,12 +892,24 @@ class Index:
                     speaker_map={'A': 'A', 'B': 'B', 'C': 'C', 'D': 'D', 'E': 'E', 'F':'F', 'G': 'G'}, 
                     transcribe=False, 
                     transcription_dir=None,
-                    temp_filename='temp'):
+                    temp_filename='temp',
+                    max_concurrent=1,
+                    skip_failed=True,
+                    transcriber=None):
         
-        if os.path.exists(temp_filename + ".json"):
-            self.load_database(temp_filename)
+        checkpoint_exists = Checkpoint(temp_filename, self.dimension).exists()
+        if checkpoint_exists or os.path.exists(temp_filename + ".json"):
+            if checkpoint_exists:
+                self.load_checkpoint(temp_filename)
+            else:
+                # Checkpoint written by save_database() before checkpoints were append-only
+                self.load_database(temp_filename)
             print(f"Initialized database from {temp_filename}")
-            temp_episodes = {snippet['episode'] for snippet in self.utterances}
+            temp_episodes = {self.utterances[idx]['episode'] for start, stop in self.live_ranges() 
+                             for idx in range(start, stop)}
+            # Episodes whose every utterance was a duplicate only appear in the duplicate locations
+            temp_episodes.update(duplicate['episode'] for duplicates in self.duplicates.values() 
+                                 for duplicate in duplicates)
             print("Loaded episodes are: ")
             for episode in temp_episodes:
                 print(episode)
@@ -404,7 +929,11 @@ class Index:
                                 speaker_map=speaker_map, 
                                 transcribe=transcribe, 
                                 transcription_dir=sub_transcription_dir,
-                                temp_episodes=temp_episodes)
+                                temp_episodes=temp_episodes,
+                                max_concurrent=max_concurrent,
+                                skip_failed=skip_failed,
+                                transcriber=transcriber,
+                                checkpoint=temp_filename)
             for filename in filenames:
                 name, extension = filename.split('.')
                 if extension == 'txt':
@@ -415,48 +944,642 @@ class Index:
                                     batch_size=batch_size, 
                                     speaker_map=speaker_map,
                                     transcribe=transcribe, 
-                                    transcription_dir=sub_transcription_dir)
+                                    transcription_dir=sub_transcription_dir,
+                                    max_concurrent=max_concurrent,
+                                    skip_failed=skip_failed,
+                                    transcriber=transcriber,
+                                    checkpoint=temp_filename)
                 else:
                     raise ValueError(f'download_path must be directory or .txt file instead of : {source_path}')
         
-    def search(self, query, k=5, verbose=False):
-        query_embedding = self.client.embeddings.create(input=query, model=self.embedding_model).data[0].embedding
-        print('Query embedding obtained')
-        query_vector = np.array([query_embedding]).astype('float32')
-        distances, indices = self.index.search(query_vector, k)
-        
-        print('Search completed')
+    def build_ann_index(self, index_type, nprobe=None, ef_search=None, **index_params):
+        """
+        Replace the faiss index with one of another type, trained on the vectors already in the index.
 
-        results = []
-        for distance, idx in zip(distances[0], indices[0]):
-            result = self.utterances[idx].copy()
-            result['similarity score'] = 1 / (1 + distance)
-            result['series'] = result['series'].replace(' Bible Project ', '')
-            results.append(result)
+        Args:
+            index_type (str): One of ann.INDEX_TYPES
+            nprobe (int): Default number of IVF cells visited per query
+            ef_search (int): Default HNSW search breadth
+            index_params: Parameters of the index type, see ann.DEFAULT_PARAMS
+        """
+        vectors = self.all_vectors()
+        self.index = ann.build_index(index_type, vectors, **index_params)
+        # Compressed types keep the full vectors aside, to re-rank their candidates exactly
+        self.full_vectors = vectors if index_type in ann.COMPRESSED_TYPES else None
+        self.index_type = index_type
+        self.index_params = index_params
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        ann.set_default_search_params(self.index, nprobe, ef_search)
+        self.read_only = False
+
+        print(f'Built {index_type} index over {len(vectors)} vectors')
+
+    def reduce_dimension(self, dimension):
+        """
+        Shorten every stored embedding to its first dimension values and rebuild the index, without
+        embedding anything again.
 
+        Only for text-embedding-3 models, whose shortened embeddings (see ann.reduce_dimension()) are what
+        the embeddings endpoint returns when asked for fewer dimensions. Queries are then embedded at the
+        new size. Save the database afterwards, since checkpoints hold the old dimension.
+        """
+        if self.embedding_model not in REDUCIBLE_MODELS:
+            raise ValueError(f'{self.embedding_model} embeddings cannot be shortened')
+        if dimension >= self.dimension:
+            raise ValueError(f'dimension must be less than the current {self.dimension}, not {dimension}')
+        if self.embedding_store is not None:
+            raise ValueError(f'embedding_store holds embeddings of dimension {self.dimension}, use a new one')
+
+        vectors = ann.reduce_dimension(self.all_vectors(), dimension)
+        self.dimension = dimension
+        self.index = ann.build_index(self.index_type, vectors, **self.index_params)
+        ann.set_default_search_params(self.index, self.nprobe, self.ef_search)
+        self.full_vectors = vectors if self.index_type in ann.COMPRESSED_TYPES else None
+        self.read_only = False
+        self.removed_selector = None
+        self.checkpoints = {}
+
+        print(f'Shortened {len(vectors)} embeddings to {dimension} dimensions')
+
+    def filter_ranges(self, series=None, episode=None):
+        """
+        Return the sorted (start, stop) id ranges of the utterances in a series and/or episode.
+
+        Utterances are added an episode at a time, so each episode is one contiguous range of ids. The
+        table of ranges is built on first use and rebuilt when utterances are added.
+
+        Args:
+            series (str): Series name, as returned in search results
+            episode (str): Episode name
+        """
+        if self.episode_ranges is None or self.episode_ranges_size != len(self.utterances):
+            if isinstance(self.utterances, UtteranceStore):
+                series_names = self.utterances.field('series')
+                episode_names = self.utterances.field('episode')
+            else:
+                series_names = [utterance['series'] for utterance in self.utterances]
+                episode_names = [utterance['episode'] for utterance in self.utterances]
+
+            self.episode_ranges = {}
+            start = 0
+            for i in range(1, len(series_names) + 1):
+                if i == len(series_names) or (series_names[i], episode_names[i]) != (series_names[start], episode_names[start]):
+                    key = (clean_series_name(series_names[start]), episode_names[start])
+                    self.episode_ranges.setdefault(key, []).append((start, i))
+                    start = i
+            self.episode_ranges_size = len(series_names)
+
+        ranges = []
+        for (series_name, episode_name), episode_ranges in self.episode_ranges.items():
+            if series is not None and series_name != clean_series_name(series):
+                continue
+            if episode is not None and episode_name != episode:
+                continue
+            ranges.extend(episode_ranges)
+
+        # Merge ranges that touch, so a series stored in one block is searched as one range
+        merged = []
+        for start, stop in sorted(ranges):
+            if merged and merged[-1][1] == start:
+                merged[-1] = (merged[-1][0], stop)
+            else:
+                merged.append((start, stop))
+        return self.live_ranges(merged) if self.removed else merged
+
+    def live_ranges(self, ranges=None):
+        """
+        Return the parts of (start, stop) id ranges (by default, every id) that were not removed
+        """
+        if ranges is None:
+            ranges = [(0, len(self.utterances))]
+        live = []
+        for start, stop in ranges:
+            for removed_start, removed_stop in self.removed:
+                if removed_stop <= start or removed_start >= stop:
+                    continue
+                if removed_start > start:
+                    live.append((start, removed_start))
+                start = max(start, removed_stop)
+                if start >= stop:
+                    break
+            if start < stop:
+                live.append((start, stop))
+        return live
+
+    def is_removed(self, idx):
+        """Whether utterance id idx belongs to a removed episode"""
+        position = bisect_right(self.removed, (idx, float('inf'))) - 1
+        return position >= 0 and self.removed[position][0] <= idx < self.removed[position][1]
+
+    def remove_episode(self, series, episode, checkpoint='temp'):
+        """
+        Remove an episode from the index, e.g. to correct a bad transcript (see replace_episode()).
+
+        Utterance ids are never reused. The episode's ids are marked removed and left out of every 
+        search, so the other utterances keep their ids and nothing is rebuilt or re-embedded. A passage 
+        the deduplicator stored once for several episodes lives on: its first location in another 
+        episode takes the removed utterance's place. compact() drops removed utterances for good.
+
+        Args:
+            series (str): Series name, as stored or as returned in search results
+            episode (str): Episode name
+            checkpoint (str): Path prefix of the append-only checkpoint the removal is recorded in, see
+        add_episode(). If None, no checkpoint is written.
+
+        Returns:
+            Number of stored utterances removed
+        """
+        self._check_writable()
+        ranges = self.filter_ranges(series, episode)
+
+        def in_episode(utterance):
+            return clean_series_name(utterance['series']) == clean_series_name(series) and utterance['episode'] == episode
+
+        # Forget the episode's own repeats of passages stored for other episodes
+        dropped = 0
+        for idx in list(self.duplicates):
+            kept = [duplicate for duplicate in self.duplicates[idx] if not in_episode(duplicate)]
+            dropped += len(self.duplicates[idx]) - len(kept)
+            if kept:
+                self.duplicates[idx] = kept
+            else:
+                del self.duplicates[idx]
+
+        if not ranges and not dropped:
+            raise ValueError(f'No episode {episode} in series {series} to remove')
+
+        ids = [idx for start, stop in ranges for idx in range(start, stop)]
+
+        # Passages that also occur in other episodes are stored again under their next location
+        promoted, promoted_ids, others = [], [], []
+        for idx in ids:
+            if idx in self.duplicates:
+                locations = self.duplicates.pop(idx)
+                # A near repeat brings its own text, overriding the stored one
+                promoted.append({'text': self.utterances[idx]['text'], **locations[0]})
+                promoted_ids.append(idx)
+                others.append(locations[1:])
+
+        self.removed = sorted(self.removed + ranges)
+        self.removed_selector = None
+        if self.deduplicator is not None:
+            for idx in ids:
+                if idx < self.deduplicator_size:
+                    self.deduplicator.remove(idx, self.utterances[idx]['text'])
+
+        if promoted:
+            first = len(self.utterances)
+            self._add_vectors(self.vectors(promoted_ids))
+            self.utterances.extend(promoted)
+            for offset, locations in enumerate(others):
+                if locations:
+                    self.duplicates[first + offset] = locations
+
+        # Only the removal is recorded. Replaying it in order on load promotes the same passages again
+        if checkpoint:
+            if checkpoint not in self.checkpoints:
+                self.checkpoints[checkpoint] = Checkpoint(checkpoint, self.dimension)
+            self.checkpoints[checkpoint].append([], np.empty((0, self.dimension), dtype='float32'), 
+                                                removed=(series, episode))
+
+        print(f'Removed {len(ids)} utterances of {series}: {episode}, {len(promoted)} kept for their other locations')
+        return len(ids)
+
+    def replace_episode(self, episode: Episode, batch_size=100, checkpoint='temp'):
+        """
+        Replace the stored utterances of an episode with a new transcript of it, e.g. a corrected one.
+
+        Only this episode is embedded and written to the checkpoint. See remove_episode() and add_episode().
+        """
+        try:
+            self.remove_episode(episode.series_title, episode.episode_title, checkpoint)
+        except ValueError:
+            print(f'{episode.series_title}: {episode.episode_title} was not in the index, adding it')
+        self.add_episode(episode, batch_size=batch_size, checkpoint=checkpoint)
+
+    def compact(self):
+        """
+        Drop the utterances of removed episodes for good, renumbering the others, and rebuild the index.
+
+        Costs as much as building the index, so it is only worth it after many removals. Ids change, so
+        an existing checkpoint no longer matches the index: save_database() afterwards, and use a new
+        checkpoint for further episodes.
+        """
+        self._check_writable()
+        if not self.removed:
+            return
+        keep = [idx for start, stop in self.live_ranges() for idx in range(start, stop)]
+        new_ids = {idx: new_idx for new_idx, idx in enumerate(keep)}
+        vectors = self.all_vectors()[keep]
+        dropped = len(self.utterances) - len(keep)
+
+        if self.index_type == 'flat':
+            self.index = ann.make_index('flat', self.dimension)
+            self.index.add(vectors)
+        else:
+            self.index = ann.build_index(self.index_type, vectors, **self.index_params)
+            ann.set_default_search_params(self.index, self.nprobe, self.ef_search)
+        self.full_vectors = vectors if self.index_type in ann.COMPRESSED_TYPES else None
+        self.utterances = [self.utterances[idx] for idx in keep]
+        self.duplicates = {new_ids[idx]: locations for idx, locations in self.duplicates.items() if idx in new_ids}
+        self.removed = []
+        self.removed_selector = None
+        self.lexical = None
+        self.episode_ranges = None
+        if self.deduplicator is not None:
+            self.deduplicator.clear()
+        self.deduplicator_size = 0
+
+        print(f'Compacted index, dropped {dropped} removed utterances')
+
+    def lexical_index(self):
+        """Return the BM25 index of the utterances, (re)building it if utterances were added since"""
+        lexical = self.lexical
+        if lexical is not None and len(lexical) == len(self.utterances):
+            return lexical
+        with self.lexical_lock:
+            # Another thread may have built it while this one waited for the lock
+            if self.lexical is None or len(self.lexical) != len(self.utterances):
+                if isinstance(self.utterances, UtteranceStore):
+                    texts = self.utterances.field('text')
+                else:
+                    texts = [utterance['text'] for utterance in self.utterances]
+                self.lexical = LexicalIndex.build(texts)
+                print(f'Built BM25 index over {len(texts)} utterances')
+            return self.lexical
+
+    def semantic_search(self, query, k=5, nprobe=None, ef_search=None, ranges=None):
+        """
+        Return (distances, ids) of the k utterances whose embeddings are closest to query's.
+
+        ranges restricts the search to (start, stop) id ranges, see filter_ranges().
+        """
+        return self.semantic_search_batch([query], k, nprobe, ef_search, ranges)[0]
+
+    def semantic_search_batch(self, queries, k=5, nprobe=None, ef_search=None, ranges=None):
+        """
+        Return a (distances, ids) pair per query, as semantic_search() does, with one embedding request
+        and one multi-row vector search for all of them.
+        """
+        query_vectors = self.embed_queries(queries)
+
+        # A compressed index returns extra candidates, re-ranked exactly against the full-precision vectors
+        rerank = self.full_vectors is not None and self.rerank_factor > 0
+        depth = k * self.rerank_factor if rerank else k
+        with timer('vector_search'):
+            if ranges is None:
+                # Leave out removed episodes with a selector built once per removal
+                if self.removed and self.removed_selector is None:
+                    self.removed_selector = ann.exclude_selector(self.removed)
+                sel = self.removed_selector if self.removed else None
+                params = ann.search_params(self.index, nprobe, ef_search, sel=sel)
+                distances, indices = self.index.search(query_vectors, depth, params=params)
+            else:
+                # Filter inside the vector search instead of over-fetching and filtering the results
+                distances, indices = ann.filtered_search(self.index, query_vectors, depth, ranges, nprobe, ef_search)
+
+        hits = []
+        for query_vector, row_distances, row_indices in zip(query_vectors, distances, indices):
+            # faiss pads with -1 when fewer than k utterances match
+            keep = row_indices >= 0
+            row_distances, row_indices = row_distances[keep], row_indices[keep]
+            if rerank:
+                with timer('rerank'):
+                    row_distances, row_indices = ann.rerank(self.full_vectors, query_vector, row_indices, k)
+            hits.append((row_distances, row_indices))
+        return hits
+
+    def search(self, 
+               query, 
+               k=5, 
+               verbose=False, 
+               nprobe=None, 
+               ef_search=None, 
+               series=None, 
+               episode=None, 
+               mode='semantic', 
+               hybrid_depth=50,
+               collapse=True):
+        """
+        Search the index for the k utterances closest to query.
+
+        Args:
+            query (str): Text to search for. In lexical and hybrid mode, a query in double quotes only
+        matches utterances containing it word for word.
+            k (int): Number of results
+            verbose (bool): Whether to print the results
+            nprobe (int): IVF cells to visit for this query, overriding self.nprobe
+            ef_search (int): HNSW search breadth for this query, overriding self.ef_search
+            series (str): Only return utterances from this series
+            episode (str): Only return utterances from this episode
+            mode (str): 'semantic' ranks by embedding similarity. 'lexical' ranks by BM25 keyword score,
+        locally and without an embedding call. 'hybrid' fuses both rankings with reciprocal rank fusion.
+            hybrid_depth (int): In hybrid mode, how many candidates each ranking contributes
+            collapse (bool): Whether to return each passage once. Passages that occur in several places
+        (stored once by the deduplicator, or stored repeatedly in older databases) get a 'locations' list
+        with the series, episode, start and end of every occurrence.
+        """
+        results = self.search_batch([query], k, nprobe, ef_search, series, episode, mode, hybrid_depth, collapse)[0]
+
+        for result in results:
             if verbose:
                 print(f'{result['series']}: {result['episode']} at {result['start']}')
                 print(f'{result['text']}')
-                print(f'Similarity: {result['similarity score']}')
+                for name in ('similarity score', 'bm25 score', 'rrf score'):
+                    if name in result:
+                        print(f'{name.capitalize()}: {result[name]}')
+                if 'locations' in result:
+                    for other in result['locations'][1:]:
+                        print(f"Also at: {other['series']}: {other['episode']} at {other['start']}")
                 print('-------------------------------------------------------------------------------')
 
         return results
     
-    def save_database(self, filename):
-        """Save FAISS index and documents to disk"""
-        faiss.write_index(self.index, f"{filename}.index")
+    def search_batch(self, 
+                     queries, 
+                     k=5, 
+                     nprobe=None, 
+                     ef_search=None, 
+                     series=None, 
+                     episode=None, 
+                     mode='semantic', 
+                     hybrid_depth=50,
+                     collapse=True):
+        """
+        Search the index for each of queries, with the same options.
+
+        The queries missing from the query cache are embedded with a single request, and all of them are
+        searched with one multi-row vector search, rather than a request and a search per query.
+
+        Args: see search()
+
+        Returns:
+            list with the results of each query, as search() returns them
+        """
+        if mode not in ('semantic', 'lexical', 'hybrid'):
+            raise ValueError(f'mode must be "semantic", "lexical" or "hybrid", not {mode}')
+
+        ranges = None
+        if series is not None or episode is not None:
+            ranges = self.filter_ranges(series, episode)
+
+        # Fetch extra results when collapsing, so k remain after merging repeats
+        fetch = 2 * k if collapse else k
+        depth = fetch if mode != 'hybrid' else max(fetch, hybrid_depth)
+        semantic_hits = None
+        if mode in ('semantic', 'hybrid'):
+            semantic_hits = self.semantic_search_batch(queries, depth, nprobe, ef_search, ranges)
+
+        # Passages too short to be stored once as duplicates are not merged either
+        min_words = self.deduplicator.min_words if self.deduplicator is not None else MIN_WORDS
+        batch_results = []
+        for position, query in enumerate(queries):
+            scores = {}
+            rankings = []
+            if semantic_hits is not None:
+                distances, indices = semantic_hits[position]
+                for distance, idx in zip(distances, indices):
+                    scores.setdefault(int(idx), {})['similarity score'] = 1 / (1 + distance)
+                rankings.append(indices.tolist())
+            if mode in ('lexical', 'hybrid'):
+                with timer('lexical_search'):
+                    lexical_ranges = self.live_ranges() if ranges is None and self.removed else ranges
+                    bm25_scores, indices = self.lexical_index().search(query, depth, lexical_ranges, 
+                                                                       text_of=lambda idx: self.utterances[idx]['text'])
+                for bm25_score, idx in zip(bm25_scores, indices):
+                    scores.setdefault(int(idx), {})['bm25 score'] = float(bm25_score)
+                rankings.append(indices.tolist())
+
+            if mode == 'hybrid':
+                ranked = reciprocal_rank_fusion(rankings)[:fetch]
+                for idx, rrf_score in ranked:
+                    scores[idx]['rrf score'] = rrf_score
+                ranked = [idx for idx, _ in ranked]
+            else:
+                ranked = rankings[0]
+
+            # Copy the metadata of each hit into a result dictionary
+            with timer('results'):
+                results = []
+                for idx in ranked:
+                    result = self.utterances[idx].copy()
+                    result.update(scores[idx])
+                    result['series'] = clean_series_name(result['series'])
+                    if idx in self.duplicates:
+                        result['locations'] = [location(result)]
+                        for duplicate in self.duplicates[idx]:
+                            duplicate = dict(duplicate, series=clean_series_name(duplicate['series']))
+                            result['locations'].append(duplicate)
+                    results.append(result)
+
+                if collapse:
+                    results = collapse_results(results, min_words)
+                batch_results.append(results[:k])
+
+        print('Search completed')
+        return batch_results
+
+    @timer('save_database')
+    def save_database(self, filename, columnar=False):
+        """
+        Save FAISS index and documents to disk, along with the BM25 index if one was built
+
+        Args:
+            filename (str): Path prefix of the database files
+            columnar (bool): Also save the documents as a columnar UtteranceStore in <filename>.columns/,
+        which load_database() prefers over the .json file
+        """
+        directory, _ = os.path.split(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Written aside and renamed, since the index may be memory-mapped from the file being replaced
+        faiss.write_index(self.index, f"{filename}.index.tmp")
+        os.replace(f"{filename}.index.tmp", f"{filename}.index")
+
+        with open(f"{filename}.params.json", 'w') as f:
+            json.dump({'index_type': self.index_type,
+                       'index_params': self.index_params,
+                       'nprobe': self.nprobe,
+                       'ef_search': self.ef_search,
+                       'rerank_factor': self.rerank_factor}, f)
 
         print(f'FAISS index saved to {filename}.index')
 
+        # Full-precision vectors of a compressed index. Written aside and renamed, since they may be
+        # memory-mapped from the file being replaced
+        if self.full_vectors is not None:
+            np.asarray(self.full_vectors, dtype='float32').tofile(f"{filename}.vectors.tmp")
+            os.replace(f"{filename}.vectors.tmp", f"{filename}.vectors")
+            print(f'Full-precision vectors saved to {filename}.vectors')
+        elif os.path.exists(f"{filename}.vectors"):
+            os.remove(f"{filename}.vectors")
+
         with open(f"{filename}.json", 'w') as f:
-            json.dump(self.utterances, f)
+            json.dump(list(self.utterances), f)
 
         print(f'Text, metadata saved to {filename}.json')
 
-    def load_database(self, filename: str):
-        """Load FAISS index and documents from disk"""
-        self.index = faiss.read_index(f"{filename}.index")
-        with open(f"{filename}.json", 'r') as f:
-            self.utterances = json.load(f)
+        if self.duplicates:
+            with open(f"{filename}.duplicates.json", 'w') as f:
+                json.dump(self.duplicates, f)
+
+            print(f'Duplicate locations saved to {filename}.duplicates.json')
+
+        # Ids of removed episodes stay in the index and metadata, so they must be saved to stay hidden
+        if self.removed:
+            with open(f"{filename}.removed.json", 'w') as f:
+                json.dump(self.removed, f)
+
+            print(f'Removed episodes saved to {filename}.removed.json')
+        elif os.path.exists(f"{filename}.removed.json"):
+            os.remove(f"{filename}.removed.json")
+
+        # Keep the BM25 index next to the faiss files when there is an up to date one. An older one would no
+        # longer match the utterances, and is deleted
+        if self.lexical is not None and len(self.lexical) == len(self.utterances):
+            self.lexical.save(filename)
+
+            print(f'BM25 index saved to {filename}.bm25')
+        elif LexicalIndex.exists(filename):
+            shutil.rmtree(f'{filename}.bm25')
+
+        if columnar:
+            if not isinstance(self.utterances, UtteranceStore):
+                UtteranceStore.from_utterances(self.utterances).save(filename)
+            else:
+                self.utterances.save(filename)
+
+            print(f'Columnar metadata saved to {filename}.columns')
+        elif UtteranceStore.exists(filename):
+            # load_database() prefers the columnar store, which no longer matches the index
+            shutil.rmtree(f'{filename}.columns')
+
+    @timer('load_database')
+    def load_database(self, filename: str, columnar=None, mmap=False):
+        """
+        Load FAISS index and documents from disk
+
+        Args:
+            filename (str): Path prefix of the database files
+            columnar (bool): Whether to load the documents from <filename>.columns/ instead of 
+        <filename>.json. If None, the columnar store is used when it exists.
+            mmap (bool): Whether to memory-map the faiss index and the columnar store instead of reading
+        them into RAM. Pages are read from disk on demand, so loading takes milliseconds. The index is 
+        then read-only.
+        """
+        if mmap:
+            # IO_FLAG_MMAP_IFC maps the codes of flat indexes, IO_FLAG_MMAP the inverted lists of IVF indexes
+            io_flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, 'IO_FLAG_MMAP_IFC', 0)
+            self.index = faiss.read_index(f"{filename}.index", io_flags)
+        else:
+            self.index = faiss.read_index(f"{filename}.index")
+        self.read_only = mmap
+        self.dimension = self.index.d
+
+        # Only the rows of re-ranked candidates are ever read, so the full vectors are always memory-mapped
+        self.full_vectors = None
+        if os.path.exists(f"{filename}.vectors"):
+            self.full_vectors = np.memmap(f"{filename}.vectors", dtype='float32', mode='r',
+                                          shape=(self.index.ntotal, self.index.d))
+
+        # Index type and default search parameters. Databases saved before they existed are flat
+        if os.path.exists(f"{filename}.params.json"):
+            with open(f"{filename}.params.json", 'r') as f:
+                params = json.load(f)
+            self.index_type = params['index_type']
+            self.index_params = params['index_params']
+            self.nprobe = params['nprobe']
+            self.ef_search = params['ef_search']
+            self.rerank_factor = params.get('rerank_factor', self.rerank_factor)
+            ann.set_default_search_params(self.index, self.nprobe, self.ef_search)
+
+        prefer_columnar = columnar is None
+        if columnar is None:
+            columnar = UtteranceStore.exists(filename)
+
+        if columnar:
+            self.utterances = UtteranceStore.load(filename, mmap=mmap)
+            # A columnar store left behind by an older save would point search hits at the wrong utterances
+            if len(self.utterances) != self.index.ntotal and prefer_columnar and os.path.exists(f"{filename}.json"):
+                print(f'{filename}.columns holds {len(self.utterances)} utterances, not {self.index.ntotal}. '
+                      f'Loading {filename}.json instead')
+                columnar = False
+            else:
+                print(f'Loaded Vector Database from {filename}.index and {filename}.columns')
+        if not columnar:
+            with open(f"{filename}.json", 'r') as f:
+                self.utterances = json.load(f)
+            print(f'Loaded Vector Database from {filename}.index and {filename}.json')
+
+        if len(self.utterances) != self.index.ntotal:
+            raise ValueError(f'{filename} holds {len(self.utterances)} utterances but {self.index.ntotal} vectors. '
+                             'Save the database again to rewrite its metadata')
+
+        self.lexical = LexicalIndex.load(filename, mmap=mmap) if LexicalIndex.exists(filename) else None
+        self.episode_ranges = None
+
+        # JSON keys are strings, utterance ids are ints
+        self.duplicates = {}
+        if os.path.exists(f"{filename}.duplicates.json"):
+            with open(f"{filename}.duplicates.json", 'r') as f:
+                self.duplicates = {int(idx): locations for idx, locations in json.load(f).items()}
+        self.removed = []
+        if os.path.exists(f"{filename}.removed.json"):
+            with open(f"{filename}.removed.json", 'r') as f:
+                self.removed = [tuple(removed) for removed in json.load(f)]
+        self.removed_selector = None
+        if self.deduplicator is not None:
+            self.deduplicator.clear()
+        self.deduplicator_size = 0
+
+    def load_checkpoint(self, filename: str):
+        """Load FAISS index and documents from an append-only checkpoint, see add_episode()"""
+        checkpoint = Checkpoint(filename, self.dimension)
+
+        # Replay the segments in order into a flat index, so removals apply to what came before them
+        self.index = ann.make_index('flat', self.dimension)
+        self.full_vectors = None
+        self.read_only = False
+        self.utterances = []
+        self.lexical = None
+        self.episode_ranges = None
+        self.duplicates = {}
+        self.removed = []
+        self.removed_selector = None
+        if self.deduplicator is not None:
+            self.deduplicator.clear()
+        self.deduplicator_size = 0
+        for documents, embeddings, duplicates, removed in checkpoint.segments():
+            if removed is not None:
+                self.remove_episode(*removed, checkpoint=None)
+            self.index.add(embeddings)
+            self.utterances.extend(documents)
+            for idx, duplicate in duplicates:
+                self.duplicates.setdefault(idx, []).append(duplicate)
+
+        if self.index_type == 'flat' or self.index.ntotal == 0:
+            self.index_type = 'flat'
+        else:
+            vectors = ann.index_vectors(self.index)
+            self.index = ann.build_index(self.index_type, vectors, **self.index_params)
+            ann.set_default_search_params(self.index, self.nprobe, self.ef_search)
+            self.full_vectors = vectors if self.index_type in ann.COMPRESSED_TYPES else None
+
+        print(f'Loaded {len(self.utterances)} utterances from checkpoint {filename}')
+
+    def compact_checkpoint(self, filename: str, destination: str, remove=False):
+        """
+        Load an append-only checkpoint and save it as a regular database.
 
-        print(f'Loaded Vector Database from {filename}.index and {filename}.index')
\ No newline at end of file
+        Args:
+            filename (str): Path prefix of the checkpoint
+            destination (str): Path prefix of the database to write, as for save_database()
+            remove (bool): Whether to delete the checkpoint files afterwards
+        """
+        self.load_checkpoint(filename)
+        self.save_database(destination)
+        if remove:
+            Checkpoint(filename, self.dimension).remove()
+            self.checkpoints.pop(filename, None)
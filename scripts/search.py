@@ -1,4 +1,4 @@
-from scribe import Index
+from query import QueryIndex
 import argparse
 
 def search():
@@ -6,12 +6,20 @@ def search():
     parser.add_argument('search', type=str, help='String to search')
     parser.add_argument('-k', '--k_nearest_neighbors', type=int, default=5, help='How many of the nearest results to print out')
     parser.add_argument('-f', '--filename', default='database/bp_db', help='Path to the Vector Database files')
+    parser.add_argument('-s', '--series', default=None, help='Only search this series')
+    parser.add_argument('-e', '--episode', default=None, help='Only search this episode')
+    parser.add_argument('-m', '--mode', default='semantic', choices=['semantic', 'lexical', 'hybrid'],
+                        help='Rank by embedding similarity, BM25 keyword score, or both')
+    parser.add_argument('--nprobe', type=int, default=None, help='IVF cells to visit (ivf_flat and ivf_pq indexes only)')
+    parser.add_argument('--ef-search', type=int, default=None, help='HNSW search breadth (hnsw indexes only)')
     args = parser.parse_args()
 
-    index = Index()
-    index.load_database(args.filename)
+    # Only what search needs is imported, and the database is memory-mapped, so a search starts quickly
+    index = QueryIndex()
+    index.load_database(args.filename, mmap=True)
 
-    return index.search(args.search, args.k_nearest_neighbors, verbose=True)
+    return index.search(args.search, args.k_nearest_neighbors, verbose=True, nprobe=args.nprobe, ef_search=args.ef_search,
+                        series=args.series, episode=args.episode, mode=args.mode)
 
 if __name__ == "__main__":
     search()
\ No newline at end of file
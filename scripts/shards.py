@@ -0,0 +1,252 @@
+"""
+A database split into shards, one regular Index database per series (or per podcast), searched in parallel.
+
+Layout of a sharded database directory:
+    shards.json          manifest: {name: {"series": [series names], "utterances": count}}
+    <name>.index/.json   one database per shard, as written by Index.save_database(columnar=True)
+    <name>.params.json   ...
+
+A search embeds the query once, searches every shard on a thread pool and merges the top k of each by
+score. faiss releases the GIL while it searches, so shards are searched on separate cores and latency
+grows with the size of the largest shard rather than of the whole corpus. A series filter only visits
+the shards that hold the series. Shards are loaded on first use (memory-mapped by default) and can be
+unloaded on their own.
+
+Usage:
+    python shards.py build ../Bible_Project/ database/bp_shards
+    python shards.py search database/bp_shards 'The way through the desert is the way to God' -k 5
+"""
+
+import argparse
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import QueryCache
+from checkpoint import Checkpoint
+from dedup import collapse_results
+from metadata import UtteranceStore
+from scribe import Index, clean_path_name, clean_series_name, make_path_name
+
+
+# Score each search mode ranks by, higher is better
+SCORES = {'semantic': 'similarity score', 'lexical': 'bm25 score', 'hybrid': 'rrf score'}
+
+
+def series_sources(source_path):
+    """
+    Return the series of a podcast directory, as Index.add_podcast() finds them: its subdirectories of
+    .mp3 files and its .txt files of "title,url" lines.
+    """
+    sources = []
+    for entry in sorted(os.listdir(source_path)):
+        path = os.path.join(source_path, entry)
+        if os.path.isdir(path) or entry.endswith('.txt'):
+            sources.append(path)
+    return sources
+
+
+def series_names(index):
+    """Return the series of every utterance of an Index"""
+    if isinstance(index.utterances, UtteranceStore):
+        return index.utterances.field('series')
+    return [utterance['series'] for utterance in index.utterances]
+
+
+class ShardedIndex:
+
+    def __init__(self, directory, max_workers=None, mmap=True, query_cache=None, index_args=None):
+        """
+        Initialize a ShardedIndex instance
+
+        Args:
+            directory (str): Directory of the shards and their manifest
+            max_workers (int): Number of shards searched at once. Defaults to the number of cores
+            mmap (bool): Whether shards are memory-mapped when loaded, see Index.load_database()
+            query_cache (QueryCache): Query embedding cache shared by every shard, so a query is only
+        embedded once. If None, an in-memory cache is used.
+            index_args (dict): Arguments of Index() for every shard, e.g. dimension or embedding_model
+        """
+        self.directory = directory
+        self.mmap = mmap
+        self.query_cache = query_cache if query_cache is not None else QueryCache()
+        self.index_args = dict(index_args or {})
+        os.makedirs(directory, exist_ok=True)
+
+        self.manifest_path = os.path.join(directory, 'shards.json')
+        self.manifest = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r') as f:
+                self.manifest = json.load(f)
+
+        # Loaded shards by name, see load_shard()
+        self.shards = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or os.cpu_count())
+
+    def shard_path(self, name):
+        return os.path.join(self.directory, name)
+
+    def names(self, series=None):
+        """Return the names of the shards, or of those holding a series"""
+        if series is None:
+            return sorted(self.manifest)
+        series = clean_series_name(series)
+        return sorted(name for name, shard in self.manifest.items() if series in shard['series'])
+
+    def new_index(self):
+        return Index(query_cache=self.query_cache, **self.index_args)
+
+    def load_shard(self, name):
+        """Return the Index of a shard, loading it first if needed"""
+        with self.lock:
+            if name not in self.shards:
+                if name not in self.manifest:
+                    raise KeyError(f'No shard {name} in {self.directory}')
+                index = self.new_index()
+                index.load_database(self.shard_path(name), mmap=self.mmap)
+                self.shards[name] = index
+            return self.shards[name]
+
+    def unload_shard(self, name):
+        """Drop a loaded shard from memory. It is loaded again when next searched"""
+        with self.lock:
+            self.shards.pop(name, None)
+
+    def load_all(self):
+        for name in self.names():
+            self.load_shard(name)
+
+    def add_shard(self, name, index):
+        """Save an Index as the shard name, replacing any shard of that name"""
+        index.save_database(self.shard_path(name), columnar=True)
+        series = {clean_series_name(series) for series in series_names(index)}
+        with self.lock:
+            self.shards.pop(name, None)
+            self.manifest[name] = {'series': sorted(series), 'utterances': len(index.utterances)}
+            self.save_manifest()
+        print(f'Saved shard {name} with {len(index.utterances)} utterances')
+
+    def remove_shard(self, name):
+        """Remove a shard from the manifest, so it is no longer searched. Its files are left in place"""
+        with self.lock:
+            self.shards.pop(name, None)
+            self.manifest.pop(name, None)
+            self.save_manifest()
+
+    def save_manifest(self):
+        """Write the manifest beside shards.json and rename it into place, so an interrupted write loses no shard"""
+        temporary = f'{self.manifest_path}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(temporary, self.manifest_path)
+
+    def add_podcast(self, source_path, shard_by='series', **add_args):
+        """
+        Transcribe and embed a podcast into shards, one per series, or one for the whole podcast.
+
+        Finished shards are skipped, so an interrupted run picks up where it stopped. The shard being
+        built is checkpointed as <name>.temp, see Index.add_episode().
+
+        Args:
+            source_path (str): Podcast directory, as for Index.add_podcast()
+            shard_by (str): 'series' for a shard per series, 'podcast' for a single shard
+            add_args: Passed to Index.add_series() (or Index.add_podcast()), e.g. speaker_map or max_concurrent
+        """
+        if shard_by not in ('series', 'podcast'):
+            raise ValueError(f'shard_by must be "series" or "podcast", not {shard_by}')
+
+        if shard_by == 'podcast':
+            jobs = [(make_path_name(clean_path_name(os.path.basename(os.path.normpath(source_path)))), source_path)]
+        else:
+            jobs = [(make_path_name(clean_path_name(os.path.basename(path))), path) for path in series_sources(source_path)]
+
+        for name, path in jobs:
+            if name in self.manifest:
+                print(f'Shard {name} already built')
+                continue
+
+            checkpoint = f'{self.shard_path(name)}.temp'
+            index = self.new_index()
+            if shard_by == 'podcast':
+                index.add_podcast(path, temp_filename=checkpoint, **add_args)
+            else:
+                temp_episodes = set()
+                if Checkpoint(checkpoint, index.dimension).exists():
+                    index.load_checkpoint(checkpoint)
+                    temp_episodes = {index.utterances[idx]['episode'] for start, stop in index.live_ranges()
+                                     for idx in range(start, stop)}
+                index.add_series(path, temp_episodes, checkpoint=checkpoint, **add_args)
+            self.add_shard(name, index)
+            Checkpoint(checkpoint, index.dimension).remove()
+
+    def _search_shard(self, name, query, k, **search_args):
+        return self.load_shard(name).search(query, k=k, **search_args)
+
+    def search(self, query, k=5, verbose=False, series=None, episode=None, mode='semantic', collapse=True, **search_args):
+        """
+        Search every shard (or those holding series) in parallel and merge their top k.
+
+        Semantic results are merged by similarity, which is comparable across shards. Lexical and hybrid
+        scores are computed within each shard, so their merge is approximate.
+
+        Args: see Index.search(). search_args (nprobe, ef_search, hybrid_depth) are passed to each shard.
+        """
+        if mode not in SCORES:
+            raise ValueError(f'mode must be "semantic", "lexical" or "hybrid", not {mode}')
+        names = self.names(series)
+        if not names:
+            return []
+
+        # Embed the query once. Every shard then finds it in the shared query cache
+        if mode != 'lexical':
+            self.load_shard(names[0]).embed_query(query)
+
+        futures = [self.executor.submit(self._search_shard, name, query, k, series=series, episode=episode,
+                                        mode=mode, collapse=collapse, **search_args)
+                   for name in names]
+        results = [result for future in futures for result in future.result()]
+        results.sort(key=lambda result: result[SCORES[mode]], reverse=True)
+
+        # The same passage may be stored in several shards
+        if collapse:
+            results = collapse_results(results)
+        results = results[:k]
+
+        if verbose:
+            for result in results:
+                print(f"{result['series']}: {result['episode']} at {result['start']}")
+                print(result['text'])
+                print(f"{SCORES[mode].capitalize()}: {result[SCORES[mode]]}")
+                print('-------------------------------------------------------------------------------')
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help='Transcribe and embed a podcast into shards')
+    build.add_argument('source_path', type=str, help='Podcast directory of series directories or .txt files')
+    build.add_argument('directory', type=str, help='Directory of the sharded database, e.g. database/bp_shards')
+    build.add_argument('--shard-by', default='series', choices=['series', 'podcast'], help='One shard per series or per podcast')
+    build.add_argument('--max-concurrent', type=int, default=1, help='Transcription jobs in flight at once')
+
+    search = subparsers.add_parser('search', help='Search a sharded database')
+    search.add_argument('directory', type=str, help='Directory of the sharded database')
+    search.add_argument('query', type=str, help='String to search')
+    search.add_argument('-k', type=int, default=5, help='Number of results')
+    search.add_argument('-s', '--series', default=None, help='Only search this series')
+    search.add_argument('-m', '--mode', default='semantic', choices=['semantic', 'lexical', 'hybrid'],
+                        help='Rank by embedding similarity, BM25 keyword score, or both')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        ShardedIndex(args.directory).add_podcast(args.source_path, shard_by=args.shard_by, max_concurrent=args.max_concurrent)
+    else:
+        ShardedIndex(args.directory).search(args.query, args.k, verbose=True, series=args.series, mode=args.mode)
+
+
+if __name__ == '__main__':
+    main()
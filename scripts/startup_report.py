@@ -0,0 +1,170 @@
+"""
+Compare startup time and memory of the ways a database can be loaded.
+
+Each mode runs in a fresh Python process, which imports query, loads the database, and runs one search
+with a random vector (so no OpenAI call is made). Reported per mode:
+    import_s   seconds to import query
+    load_s     seconds for QueryIndex() and load_database()
+    search_s   seconds for the first search, including paging in the data it touches
+    rss_mb     resident memory after loading, and after the first search
+
+With --imports, it instead times the imports each entry point needs before it can search, in fresh
+processes: the search CLI (search.py) and the server (site/app.py). Each is timed with only what it
+imports ("lean"), and with the ingest-only stack (openai, assemblyai, reportlab, dotenv) that importing
+scribe used to load as well ("eager"). The median of --repeat runs is reported.
+
+Usage:
+    python startup_report.py database/bp_db
+    python startup_report.py database/bp_db --modes json mmap --json
+    python startup_report.py --imports --repeat 5
+"""
+
+import argparse
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+MODES = {'json': dict(columnar=False, mmap=False),
+         'columnar': dict(columnar=True, mmap=False),
+         'mmap': dict(columnar=None, mmap=True)}
+
+
+# Modules each entry point imports before it can search. app.py also imports its site modules
+ENTRY_POINTS = {'cli': ['query'],
+                'server': ['flask', 'flask_cors', 'query', 'cache', 'suggest', 'metrics', 'precompressed', 'transcripts']}
+
+# Imported by scribe at module import before query-time code was split from ingest, see query.py
+INGEST_MODULES = ['openai', 'assemblyai', 'reportlab.platypus', 'dotenv']
+
+
+def rss_mb():
+    """Resident set size of this process in MB (Linux), or peak RSS elsewhere"""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except FileNotFoundError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def measure(filename, mode):
+    """Run in the child process: load the database in the given mode and print a JSON report"""
+    import time
+
+    start = time.perf_counter()
+    import numpy as np
+    from query import QueryIndex
+    import_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = QueryIndex()
+    index.load_database(filename, **MODES[mode])
+    load_s = time.perf_counter() - start
+    rss_loaded = rss_mb()
+
+    start = time.perf_counter()
+    query = np.random.default_rng(0).standard_normal((1, index.index.d)).astype('float32')
+    _, ids = index.index.search(query, 5)
+    [index.utterances[i] for i in ids[0] if i >= 0]
+    search_s = time.perf_counter() - start
+
+    return {'mode': mode,
+            'import_s': import_s,
+            'load_s': load_s,
+            'search_s': search_s,
+            'rss_loaded_mb': rss_loaded,
+            'rss_searched_mb': rss_mb()}
+
+
+def measure_imports(entry_point, stack):
+    """Run in the child process: import what entry_point needs (plus the ingest stack if eager) and time it"""
+    import time
+
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'site'))
+    modules = ENTRY_POINTS[entry_point] + (INGEST_MODULES if stack == 'eager' else [])
+    start = time.perf_counter()
+    for module in modules:
+        importlib.import_module(module)
+    import_s = time.perf_counter() - start
+
+    return {'entry_point': entry_point,
+            'stack': stack,
+            'import_s': import_s,
+            'ingest_modules': [module for module in INGEST_MODULES if module in sys.modules],
+            'rss_mb': rss_mb()}
+
+
+def import_report(repeat):
+    """Time the imports of every entry point, lean and eager, over repeat fresh processes each"""
+    results = []
+    for entry_point in ENTRY_POINTS:
+        for stack in ('lean', 'eager'):
+            runs = []
+            for _ in range(repeat):
+                output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child-imports',
+                                         f'{entry_point}:{stack}'], capture_output=True, text=True, check=True)
+                runs.append(json.loads(output.stdout.strip().splitlines()[-1]))
+            result = runs[-1]
+            result['import_s'] = statistics.median(run['import_s'] for run in runs)
+            results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('filename', type=str, nargs='?', help='Path prefix of the database, e.g. database/bp_db')
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES), help='Load modes to compare')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    parser.add_argument('--imports', action='store_true', help='Time the imports of the search CLI and the server instead')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per entry point with --imports')
+    parser.add_argument('--child', type=str, help=argparse.SUPPRESS)
+    parser.add_argument('--child-imports', type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.filename, args.child)))
+        return
+    if args.child_imports:
+        print(json.dumps(measure_imports(*args.child_imports.split(':'))))
+        return
+
+    if args.imports:
+        results = import_report(args.repeat)
+        if args.json:
+            print(json.dumps(results, indent=4))
+            return
+        print(f"{'entry_point':<13}{'stack':<7}{'import_s':>10}{'rss_mb':>9}  ingest modules loaded")
+        for r in results:
+            print(f"{r['entry_point']:<13}{r['stack']:<7}{r['import_s']:>10.3f}{r['rss_mb']:>9.1f}  "
+                  f"{', '.join(r['ingest_modules']) or '-'}")
+        return
+    if args.filename is None:
+        parser.error('filename is required unless --imports is given')
+
+    results = []
+    for mode in args.modes:
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), args.filename, '--child', mode],
+                                capture_output=True, text=True, check=True)
+        results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return
+
+    print(f"{'mode':<10}{'import_s':>10}{'load_s':>10}{'search_s':>10}{'rss_loaded_mb':>15}{'rss_searched_mb':>17}")
+    for r in results:
+        print(f"{r['mode']:<10}{r['import_s']:>10.3f}{r['load_s']:>10.3f}{r['search_s']:>10.4f}"
+              f"{r['rss_loaded_mb']:>15.1f}{r['rss_searched_mb']:>17.1f}")
+
+
+if __name__ == '__main__':
+    main()
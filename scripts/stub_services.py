@@ -0,0 +1,221 @@
+"""
+Local stand-ins for the paid AI services used by scribe.py.
+
+FakeTranscriber can be passed as the transcriber argument of Episode() and Index.add_series() in place
+of AssemblyAI. The stub embeddings server speaks enough of the OpenAI embeddings API for OpenAI(base_url=...) to use it.
+Vectors are derived from a hash of each text, so the same text always gets the same embedding.
+
+Usage:
+    python stub_services.py --port 8089 --latency 0.2 --fail-rate 0.1
+    OPENAI_BASE_URL=http://localhost:8089/v1 OPENAI_API_KEY=stub python experiment.py
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+def stub_embedding(text, dimension=1536):
+    """Return a deterministic unit vector for text"""
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(dimension).astype('float32')
+    return vector / np.linalg.norm(vector)
+
+
+def make_vocabulary(size=5000, seed=0):
+    """
+    Return size made-up words, most frequent first, for synthetic text with a realistic long tail of
+    rare words. The first words are FakeTranscriber.WORDS, so the usual test queries still match.
+    """
+    rng = random.Random(seed)
+    syllables = ['ba', 'ka', 'lo', 'mi', 'ne', 'ru', 'sha', 'te', 'vo', 'zi', 'el', 'am', 'or', 'ith', 'un', 'ha']
+    words = list(FakeTranscriber.WORDS)
+    seen = set(words)
+    while len(words) < size:
+        word = ''.join(rng.choice(syllables) for _ in range(rng.randint(1, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def zipf_weights(size, exponent=1.1):
+    """Cumulative Zipf weights for random.choices(cum_weights=...) over a vocabulary of size words"""
+    weights = 1 / np.arange(1, size + 1) ** exponent
+    return np.cumsum(weights).tolist()
+
+
+def synthetic_text(rng, vocabulary, cum_weights=None, min_words=2, max_words=60):
+    """
+    Return one made-up utterance.
+
+    Args:
+        rng (random.Random): Source of randomness, so the same seed gives the same text
+        vocabulary (list(str)): Words to draw from
+        cum_weights (list(float)): Cumulative word weights, see zipf_weights(). Uniform if None
+        min_words (int): Fewest words in the utterance
+        max_words (int): Most words in the utterance
+    """
+    count = rng.randint(min_words, max_words)
+    return ' '.join(rng.choices(vocabulary, cum_weights=cum_weights, k=count)).capitalize() + '.'
+
+
+class FakeUtterance:
+    def __init__(self, speaker, text, start, end):
+        self.speaker = speaker
+        self.text = text
+        self.start = start
+        self.end = end
+
+
+class FakeTranscript:
+    def __init__(self, utterances, status='completed', error=None):
+        self.utterances = utterances
+        self.status = status
+        self.error = error
+
+
+class FakeTranscriber:
+    """
+    Stand-in for aai.Transcriber().transcribe.
+
+    Calling an instance with an audio source sleeps for latency seconds and returns a transcript with
+    utterance_count made-up utterances. The text is derived from the audio source, so the same source
+    always gives the same transcript. Sources listed in fail_on come back with status "error".
+    """
+
+    WORDS = ('the', 'exodus', 'story', 'god', 'temple', 'garden', 'wilderness', 'covenant', 'israel',
+             'chaos', 'dragon', 'waters', 'mountain', 'spirit', 'image', 'human', 'blessing', 'priest')
+
+    def __init__(self, utterance_count=200, latency=0.0, speakers='AB', fail_on=(), vocabulary_size=None):
+        """
+        Args:
+            utterance_count (int): Number of utterances in each transcript
+            latency (float): Seconds each call sleeps, standing in for transcription time
+            speakers (str): Speaker labels, assigned to utterances in turn
+            fail_on (iterable): Audio sources that fail
+            vocabulary_size (int): If given, text is drawn from make_vocabulary(vocabulary_size) with Zipf
+        word frequencies, like real speech, instead of from the 18 WORDS
+        """
+        self.utterance_count = utterance_count
+        self.latency = latency
+        self.speakers = speakers
+        self.fail_on = set(fail_on)
+        self.vocabulary = list(self.WORDS)
+        self.cum_weights = None
+        if vocabulary_size:
+            self.vocabulary = make_vocabulary(vocabulary_size)
+            self.cum_weights = zipf_weights(vocabulary_size)
+
+    def __call__(self, audio_file):
+        time.sleep(self.latency)
+        if audio_file in self.fail_on:
+            return FakeTranscript(None, status='error', error=f'Fake failure for {audio_file}')
+
+        seed = int.from_bytes(hashlib.sha256(audio_file.encode('utf-8')).digest()[:8], 'little')
+        rng = random.Random(seed)
+        utterances = []
+        start = 0
+        for i in range(self.utterance_count):
+            if self.cum_weights is None:
+                text = ' '.join(rng.choice(self.WORDS) for _ in range(rng.randint(2, 60))).capitalize() + '.'
+            else:
+                text = synthetic_text(rng, self.vocabulary, self.cum_weights)
+            end = start + 400 * len(text.split())
+            utterances.append(FakeUtterance(self.speakers[i % len(self.speakers)], text, start, end))
+            start = end + 200
+        return FakeTranscript(utterances)
+
+
+class StubEmbeddingsHandler(BaseHTTPRequestHandler):
+    # Set on the server by start_stub_server()
+    dimension = 1536
+    latency = 0.0
+    fail_rate = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+
+        if not self.path.rstrip('/').endswith('/embeddings'):
+            self._send_json(404, {'error': {'message': f'Unknown path {self.path}'}})
+            return
+
+        time.sleep(self.latency)
+
+        # Simulate rate limiting so retry logic can be exercised
+        if random.random() < self.fail_rate:
+            # Like the OpenAI API, say how long to wait before retrying
+            self._send_json(429, {'error': {'message': 'Rate limit reached (stub)', 'type': 'rate_limit'}},
+                            headers={'retry-after-ms': '20'})
+            return
+
+        texts = request.get('input', [])
+        if isinstance(texts, str):
+            texts = [texts]
+        dimension = request.get('dimensions', self.dimension)
+
+        data = [{'object': 'embedding', 'index': i, 'embedding': stub_embedding(text, dimension).tolist()}
+                for i, text in enumerate(texts)]
+        tokens = sum(max(1, len(text) // 4) for text in texts)
+        self._send_json(200, {'object': 'list',
+                              'data': data,
+                              'model': request.get('model', 'stub'),
+                              'usage': {'prompt_tokens': tokens, 'total_tokens': tokens}})
+
+
+def start_stub_server(port=0, dimension=1536, latency=0.0, fail_rate=0.0):
+    """
+    Start the stub embeddings server on a background thread.
+
+    Returns:
+        (server, base_url): The running ThreadingHTTPServer (call server.shutdown() to stop it) and the
+    base_url to pass to OpenAI()
+    """
+    handler = type('Handler', (StubEmbeddingsHandler,), {'dimension': dimension,
+                                                         'latency': latency,
+                                                         'fail_rate': fail_rate})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}/v1'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8089, help='Port to listen on')
+    parser.add_argument('--dimension', type=int, default=1536, help='Default embedding dimension')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before answering each request')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='Fraction of requests answered with 429')
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(args.port, args.dimension, args.latency, args.fail_rate)
+    print(f'Stub embeddings server running at {base_url}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
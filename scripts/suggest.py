@@ -0,0 +1,206 @@
+"""
+Typeahead suggestions from series and episode titles and frequent phrases of the transcripts.
+
+Completions come from sorted arrays of keys, searched with bisect, so a suggestion needs no embedding
+call and no network. The top completions of every one- and two-letter prefix, whose ranges cover most
+of the array, are computed up front.
+
+Phrases are word n-grams mined from the utterances, saved in <filename>.suggest.json:
+    [["covenant with abraham", 112], ["the garden of eden", 98], ...]
+
+Usage (mine the phrases of an existing database):
+    python suggest.py database/bp_db
+"""
+
+import argparse
+import json
+import os
+from bisect import bisect_left, bisect_right
+from collections import Counter
+
+import numpy as np
+
+from lexical import tokenize
+
+
+# Phrases may not start or end with these words ("of the", "and then it")
+STOPWORDS = frozenset('a an and are as at be but by do for from had has have he i if in is it its just kind know like '
+                      'me my of oh on or really right so that the then there they this to um uh was we what when '
+                      'which who with yeah you your'.split())
+
+
+def normalize(text):
+    """Lowercase text and reduce it to its words, the form keys and prefixes are compared in"""
+    return ' '.join(tokenize(text))
+
+
+def mine_phrases(texts, min_n=2, max_n=4, min_count=5, max_phrases=50000):
+    """
+    Count the word n-grams of texts and return the most frequent as (phrase, count) pairs.
+
+    Args:
+        texts (iterable(str)): Utterance texts
+        min_n (int): Fewest words in a phrase
+        max_n (int): Most words in a phrase
+        min_count (int): Phrases occurring fewer times are dropped
+        max_phrases (int): Number of phrases kept
+
+    Returns:
+        list of (phrase, count) tuples, most frequent first
+    """
+    counts = Counter()
+    for text in texts:
+        words = tokenize(text)
+        for n in range(min_n, max_n + 1):
+            for i in range(len(words) - n + 1):
+                if words[i] in STOPWORDS or words[i + n - 1] in STOPWORDS:
+                    continue
+                counts[' '.join(words[i:i + n])] += 1
+    return [(phrase, count) for phrase, count in counts.most_common(max_phrases) if count >= min_count]
+
+
+class PrefixIndex:
+    """
+    Sorted array of keys, each pointing at an entry with a score. top() returns the best scored entries
+    with a key starting with a prefix.
+    """
+
+    def __init__(self, keys, entries, scores, cache_length=2, max_k=20):
+        """
+        Initialize a PrefixIndex instance
+
+        Args:
+            keys (list(str)): Normalized keys. Several keys may point at the same entry
+            entries (list(int)): Entry of each key
+            scores (list(float)): Score of each key's entry, higher is better
+            cache_length (int): Top entries of every prefix up to this length are computed up front
+            max_k (int): Largest k the cached prefixes can answer
+        """
+        order = sorted(range(len(keys)), key=lambda i: keys[i])
+        self.keys = [keys[i] for i in order]
+        self.entries = np.array([entries[i] for i in order], dtype='int64')
+        self.scores = np.array([scores[i] for i in order], dtype='float64')
+        self.max_k = max_k
+
+        self.cache = {}
+        prefixes = {key[:length] for key in self.keys for length in range(1, cache_length + 1)}
+        for prefix in prefixes:
+            self.cache[prefix] = self._top(prefix, max_k)
+
+    def _top(self, prefix, k):
+        lo = bisect_left(self.keys, prefix)
+        hi = bisect_right(self.keys, prefix + '\uffff')
+        scores = self.scores[lo:hi]
+        entries = self.entries[lo:hi]
+
+        # Take the best few more than k, since several keys may point at the same entry
+        if len(scores) > 4 * k:
+            keep = np.argpartition(-scores, 4 * k)[:4 * k]
+            scores, entries = scores[keep], entries[keep]
+        top = []
+        for i in np.argsort(-scores, kind='stable'):
+            if entries[i] not in top:
+                top.append(int(entries[i]))
+                if len(top) == k:
+                    break
+        return top
+
+    def top(self, prefix, k=8):
+        """Return up to k entries with a key starting with prefix, best first"""
+        if prefix in self.cache and k <= self.max_k:
+            return self.cache[prefix][:k]
+        return self._top(prefix, k)
+
+
+class Suggester:
+
+    def __init__(self, series_data, phrases=()):
+        """
+        Initialize a Suggester instance
+
+        Args:
+            series_data (dict): Map from series name to its list of episode names, like site/seriesData.json
+            phrases (list): (phrase, count) pairs, see mine_phrases()
+        """
+        # Titles match from the start of any of their words, so "snake" finds "The Snake in the Throne Room"
+        self.titles = []
+        keys, entries, scores = [], [], []
+        for series, episodes in series_data.items():
+            for episode in [None] + list(episodes):
+                entry = len(self.titles)
+                self.titles.append({'type': 'series' if episode is None else 'episode',
+                                    'text': series if episode is None else episode,
+                                    'series': series,
+                                    'episode': episode})
+                words = normalize(series if episode is None else episode).split()
+                for i in range(len(words)):
+                    keys.append(' '.join(words[i:]))
+                    entries.append(entry)
+                    # A match at the start of the title beats one in the middle, and series beat episodes
+                    scores.append((2 if i == 0 else 1) + (0.5 if episode is None else 0))
+        self.title_index = PrefixIndex(keys, entries, scores)
+
+        self.phrases = [phrase for phrase, _ in phrases]
+        self.phrase_index = PrefixIndex(self.phrases, list(range(len(self.phrases))), [count for _, count in phrases])
+
+    @classmethod
+    def load(cls, filename, series_path):
+        """
+        Load the phrases mined for the database at filename (if any) and the titles in series_path
+        """
+        with open(series_path, 'r') as f:
+            series_data = json.load(f)
+        phrases = []
+        if os.path.exists(f'{filename}.suggest.json'):
+            with open(f'{filename}.suggest.json', 'r') as f:
+                phrases = json.load(f)
+        return cls(series_data, phrases)
+
+    def suggest(self, prefix, k=8):
+        """
+        Return up to k completions of prefix: matching titles first, then frequent phrases.
+
+        Returns:
+            list of dictionaries with type ('series', 'episode' or 'phrase') and text, plus series and
+        episode for titles
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        suggestions = [self.titles[entry] for entry in self.title_index.top(prefix, k)]
+        if len(suggestions) < k:
+            # A phrase that is just a suggested title (e.g. "chaos dragon") adds nothing
+            titles = {normalize(suggestion['text']) for suggestion in suggestions}
+            for entry in self.phrase_index.top(prefix, k):
+                if self.phrases[entry] not in titles:
+                    suggestions.append({'type': 'phrase', 'text': self.phrases[entry]})
+                    if len(suggestions) == k:
+                        break
+        return suggestions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('filename', type=str, help='Path prefix of the database, e.g. database/bp_db')
+    parser.add_argument('--min-count', type=int, default=5, help='Phrases occurring fewer times are dropped')
+    parser.add_argument('--max-phrases', type=int, default=50000, help='Number of phrases kept')
+    args = parser.parse_args()
+
+    # Loading through Index reads both .json and columnar databases. Imported here so the server, which
+    # only reads the mined phrases, does not import scribe through this module
+    from scribe import Index
+    index = Index()
+    index.load_database(args.filename, mmap=True)
+
+    # Utterances of removed episodes stay in the database, but must not be suggested
+    ids = [idx for start, stop in index.live_ranges() for idx in range(start, stop)]
+    phrases = mine_phrases((index.utterances[idx]['text'] for idx in ids),
+                           min_count=args.min_count,
+                           max_phrases=args.max_phrases)
+    with open(f'{args.filename}.suggest.json', 'w') as f:
+        json.dump(phrases, f)
+    print(f'Mined {len(phrases)} phrases from {len(ids)} utterances into {args.filename}.suggest.json')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Synthetic corpora for benchmarks, from a single series to millions of utterances.
+
+Two kinds of corpus are generated:
+    synthetic_jobs()      .txt files of made-up episodes, to ingest with Index.add_series() and a
+                          FakeTranscriber, exercising the whole ingest path
+    synthetic_database()  a saved database written directly, without embedding anything, so it scales
+                          to 1M+ utterances in minutes
+
+The vectors of a synthetic database are drawn around a few hundred random centers, so an ANN index sees
+clusters like it would with real embeddings. Everything is seeded, so the same arguments always give
+the same corpus.
+
+Usage:
+    python synthetic.py database/syn --utterances 1000000 --dimension 384
+"""
+
+import argparse
+import os
+import random
+
+import numpy as np
+
+from scribe import Index, ms2hms
+from stub_services import make_vocabulary, synthetic_text, zipf_weights
+
+
+def synthetic_jobs(directory, series_count=1, episodes_per_series=10):
+    """
+    Write one "title,url" .txt file per series for Index.add_series(), with made-up urls a FakeTranscriber
+    turns into transcripts.
+
+    Returns:
+        list of the .txt paths
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for series in range(series_count):
+        path = os.path.join(directory, f'Synthetic_Series_{series}.txt')
+        with open(path, 'w') as f:
+            for episode in range(episodes_per_series):
+                f.write(f'Episode {episode},synthetic://series-{series}/episode-{episode}\n')
+        paths.append(path)
+    return paths
+
+
+def synthetic_utterances(count, utterances_per_episode=500, episodes_per_series=20, vocabulary_size=20000, seed=0):
+    """
+    Return count utterance dictionaries shaped like Index.utterances, grouped into episodes and series.
+    """
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(vocabulary_size, seed)
+    cum_weights = zipf_weights(vocabulary_size)
+
+    utterances = []
+    start = 0
+    for i in range(count):
+        episode, position = divmod(i, utterances_per_episode)
+        if position == 0:
+            start = 0
+        text = synthetic_text(rng, vocabulary, cum_weights)
+        end = start + 400 * (text.count(' ') + 1)
+        utterances.append({'text': text,
+                           'start': ms2hms(start),
+                           'end': ms2hms(end),
+                           'series': f'Synthetic Series {episode // episodes_per_series}',
+                           'episode': f'Episode {episode % episodes_per_series}'})
+        start = end + 200
+    return utterances
+
+
+def synthetic_vectors(count, dimension, clusters=256, spread=0.5, seed=0, chunk_size=100000):
+    """
+    Yield count unit vectors in chunks of up to chunk_size rows, drawn around clusters random centers.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimension)).astype('float32')
+    for first in range(0, count, chunk_size):
+        rows = min(chunk_size, count - first)
+        vectors = centers[rng.integers(0, clusters, rows)]
+        vectors += spread * rng.standard_normal((rows, dimension)).astype('float32')
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        yield vectors
+
+
+def synthetic_database(filename, count, dimension=1536, columnar=True, seed=0, **utterance_args):
+    """
+    Write a database of count synthetic utterances at filename, as Index.save_database() would.
+
+    Args:
+        filename (str): Path prefix of the database files
+        count (int): Number of utterances
+        dimension (int): Dimension of the vectors. A flat index holds count * dimension * 4 bytes, so
+    use a small dimension for the largest corpora
+        columnar (bool): Also write the columnar metadata store
+        seed (int): Seed of the corpus
+        utterance_args: Passed to synthetic_utterances()
+    """
+    index = Index(dimension=dimension)
+    for vectors in synthetic_vectors(count, dimension, seed=seed):
+        index.index.add(vectors)
+    index.utterances = synthetic_utterances(count, seed=seed, **utterance_args)
+    index.save_database(filename, columnar=columnar)
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('filename', type=str, help='Path prefix of the database to write, e.g. database/syn')
+    parser.add_argument('-n', '--utterances', type=int, default=100000, help='Number of utterances')
+    parser.add_argument('-d', '--dimension', type=int, default=1536, help='Dimension of the vectors')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the corpus')
+    parser.add_argument('--no-columnar', action='store_true', help='Only write the .json metadata')
+    args = parser.parse_args()
+
+    synthetic_database(args.filename, args.utterances, args.dimension, columnar=not args.no_columnar, seed=args.seed)
+    print(f'Wrote {args.utterances} synthetic utterances to {args.filename}')
+
+
+if __name__ == '__main__':
+    main()
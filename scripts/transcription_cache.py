@@ -0,0 +1,159 @@
+"""
+Local cache of raw AssemblyAI transcripts, so an episode is only ever paid for and waited on once.
+
+Entries are content-addressed: the key is a hash of the audio and of the transcription settings. Local
+files are identified by a hash of their bytes, and urls by the url plus the ETag (or Last-Modified and
+Content-Length) the server reports for it. A re-uploaded file or a different speech model therefore gets
+a new entry, while the same audio under another episode title or path is a hit.
+
+Each entry is a .json file holding the utterances as AssemblyAI returned them, before speaker_map is
+applied:
+    {"source": "...", "settings": {...}, "utterances": [{"speaker": "A", "text": "...", "start": 0, "end": 5120}, ...]}
+
+so transcripts can be re-derived locally, e.g. with a new speaker_map, see Episode.add_speaker_labels().
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+import httpx
+
+
+class CachedUtterance:
+    def __init__(self, speaker, text, start, end):
+        self.speaker = speaker
+        self.text = text
+        self.start = start
+        self.end = end
+
+
+class CachedTranscript:
+    """Raw transcript shaped like a finished aai.Transcript: status, error and utterances attributes"""
+
+    def __init__(self, utterances, status='completed', error=None):
+        self.utterances = utterances
+        self.status = status
+        self.error = error
+
+    @classmethod
+    def from_transcript(cls, transcript):
+        """Copy the utterances of a finished transcript (from AssemblyAI or a stand-in)"""
+        return cls([CachedUtterance(utterance.speaker, utterance.text, utterance.start, utterance.end)
+                    for utterance in transcript.utterances or []])
+
+    def to_json(self):
+        return [{'speaker': utterance.speaker,
+                 'text': utterance.text,
+                 'start': utterance.start,
+                 'end': utterance.end} for utterance in self.utterances]
+
+    @classmethod
+    def from_json(cls, utterances):
+        return cls([CachedUtterance(**utterance) for utterance in utterances])
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """Return the blake2b hex digest of the bytes of a file"""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def url_version(url, timeout=10):
+    """
+    Return what identifies the current contents of url without downloading it: its ETag, or else its
+    Last-Modified and Content-Length. Returns '' if the server reports neither or cannot be reached, in
+    which case the url alone identifies the audio.
+    """
+    try:
+        response = httpx.head(url, follow_redirects=True, timeout=timeout)
+    except (httpx.HTTPError, httpx.InvalidURL, httpx.UnsupportedProtocol):
+        return ''
+    if response.status_code >= 400:
+        return ''
+    headers = response.headers
+    if headers.get('etag'):
+        return headers['etag']
+    if headers.get('last-modified'):
+        return f"{headers['last-modified']};{headers.get('content-length', '')}"
+    return ''
+
+
+class TranscriptionCache:
+
+    def __init__(self, directory='database/transcription_cache'):
+        """
+        Initialize a TranscriptionCache instance
+
+        Args:
+            directory (str): Directory the entries are written to
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        # Digests of local files by (path, size, mtime), so a file is only hashed once per process
+        self.digests = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def source_id(self, audio_file):
+        """Return a string identifying the contents of audio_file, a local path or a url"""
+        if os.path.isfile(audio_file):
+            stat = os.stat(audio_file)
+            signature = (os.path.abspath(audio_file), stat.st_size, stat.st_mtime_ns)
+            if signature not in self.digests:
+                self.digests[signature] = file_digest(audio_file)
+            return f'file:{self.digests[signature]}'
+        # Urls read from .txt files keep their trailing newline
+        url = audio_file.strip()
+        return f'url:{url}#{url_version(url)}'
+
+    def key(self, audio_file, settings):
+        """
+        Return the cache key of audio_file transcribed with settings.
+
+        Args:
+            audio_file (str): Local path or url of the audio
+            settings (dict): Transcription settings that change the result, see Episode.transcription_settings()
+        """
+        payload = json.dumps({'source': self.source_id(audio_file), 'settings': settings}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    def get(self, key):
+        """Return the CachedTranscript stored under key, or None on a miss"""
+        try:
+            with open(self.path(key), 'r') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return CachedTranscript.from_json(entry['utterances'])
+
+    def put(self, key, transcript, source='', settings=None):
+        """
+        Store the utterances of a finished transcript under key and return them as a CachedTranscript.
+
+        source and settings are only saved for reference.
+        """
+        cached = CachedTranscript.from_transcript(transcript)
+        entry = {'source': source.strip(), 'settings': settings or {}, 'utterances': cached.to_json()}
+        # Write to a temporary file and rename, so a crash or a concurrent reader never sees half an entry
+        temporary = f'{self.path(key)}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(entry, f)
+        os.replace(temporary, self.path(key))
+        return cached
+
+    def stats(self):
+        """Return hit and miss counts and the number of stored transcripts"""
+        entries = sum(1 for name in os.listdir(self.directory) if name.endswith('.json'))
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries}
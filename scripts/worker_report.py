@@ -0,0 +1,133 @@
+"""
+Measure the memory of each process of a multi-worker server, to check that workers share the database.
+
+For the master and each worker, reported from /proc/<pid>/smaps_rollup (Linux only):
+    rss_mb      resident memory, counting shared pages in full in every process
+    pss_mb      proportional memory, where a page shared by n processes counts 1/n in each
+    shared_mb   resident pages shared with other processes (the database, when sharing works)
+    private_mb  resident pages only this process uses
+
+The sum of pss_mb is the real footprint of the server. When the database is shared it grows by much less
+than one database per worker.
+
+Usage (measure a running server, given the gunicorn master pid):
+    python worker_report.py --pid 12345
+
+Usage (start gunicorn with site/gunicorn.conf.py, send a few searches, measure, and stop it):
+    python worker_report.py --launch database/bp_db --workers 4 --requests 20
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.parse
+import urllib.request
+
+
+SITE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'site')
+
+
+def process_memory(pid):
+    """Return rss, pss, shared and private memory of a process in MB"""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup', 'r') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {'pid': pid,
+            'rss_mb': fields.get('Rss', 0.0),
+            'pss_mb': fields.get('Pss', 0.0),
+            'shared_mb': fields.get('Shared_Clean', 0.0) + fields.get('Shared_Dirty', 0.0),
+            'private_mb': fields.get('Private_Clean', 0.0) + fields.get('Private_Dirty', 0.0)}
+
+
+def children(pid):
+    """Return the pids of the child processes of pid"""
+    pids = []
+    for task in os.listdir(f'/proc/{pid}/task'):
+        with open(f'/proc/{pid}/task/{task}/children', 'r') as f:
+            pids.extend(int(child) for child in f.read().split())
+    return pids
+
+
+def report(master_pid):
+    """Return the memory of the master and its workers, as a list of dictionaries"""
+    results = [dict(process_memory(master_pid), role='master')]
+    for pid in children(master_pid):
+        results.append(dict(process_memory(pid), role='worker'))
+    return results
+
+
+def launch(database, workers, port, requests, mode, query):
+    """Start gunicorn, wait for it to answer, send search requests, and return the master's Popen"""
+    env = dict(os.environ)
+    env.update({'DB_PATH': os.path.abspath(database),
+                'WEB_CONCURRENCY': str(workers),
+                'PORT': str(port)})
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+                              cwd=SITE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 120
+    while True:
+        try:
+            urllib.request.urlopen(f'{base_url}/health', timeout=5).read()
+            break
+        except OSError:
+            if server.poll() is not None or time.time() > deadline:
+                server.kill()
+                raise RuntimeError('gunicorn did not start, run it by hand to see its output')
+            time.sleep(0.5)
+
+    # Spread requests over the workers so each one touches the index
+    params = urllib.parse.urlencode({'q': query, 'mode': mode})
+    for _ in range(requests):
+        urllib.request.urlopen(f'{base_url}/search?{params}', timeout=60).read()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pid', type=int, help='Pid of the gunicorn master of a running server')
+    parser.add_argument('--launch', type=str, help='Path prefix of a database to serve, e.g. database/bp_db')
+    parser.add_argument('-w', '--workers', type=int, default=2, help='Number of workers to launch')
+    parser.add_argument('--port', type=int, default=5055, help='Port of the launched server')
+    parser.add_argument('-r', '--requests', type=int, default=10, help='Searches sent before measuring')
+    parser.add_argument('-m', '--mode', type=str, default='lexical', help='Search mode of those requests. '
+                        'lexical needs no OpenAI key')
+    parser.add_argument('-q', '--query', type=str, default='covenant', help='Query of those requests')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args()
+
+    if (args.pid is None) == (args.launch is None):
+        parser.error('give exactly one of --pid and --launch')
+
+    server = None
+    master_pid = args.pid
+    if args.launch:
+        server = launch(args.launch, args.workers, args.port, args.requests, args.mode, args.query)
+        master_pid = server.pid
+    try:
+        results = report(master_pid)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return
+
+    print(f"{'role':<8}{'pid':>8}{'rss_mb':>10}{'pss_mb':>10}{'shared_mb':>11}{'private_mb':>12}")
+    for r in results:
+        print(f"{r['role']:<8}{r['pid']:>8}{r['rss_mb']:>10.1f}{r['pss_mb']:>10.1f}"
+              f"{r['shared_mb']:>11.1f}{r['private_mb']:>12.1f}")
+    print(f"{'total':<16}{sum(r['rss_mb'] for r in results):>10.1f}{sum(r['pss_mb'] for r in results):>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,66 +4,204 @@ Production WSGI application for pod-search web app.
 This file serves both the Flask API and static files for deployment.
 """
 
+import gc
+import json
 import os
 import sys
-from flask import Flask, request, jsonify, send_from_directory, send_file
+import time
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
 
 # Add the scripts directory to the path so we can import scribe
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'scripts'))
 
-from scribe import Index
+from scribe import load_env
+from query import QueryIndex
+from batching import MicroBatcher
+from cache import QueryCache
+from suggest import Suggester
+from metrics import REGISTRY, end_trace, start_trace, timer
+from precompressed import send_precompressed
+from transcripts import episode_path, hms2ms, load_transcript
 
-app = Flask(__name__, static_folder='.', static_url_path='')
+# Settings below may come from .env, which importing scribe no longer reads
+load_env()
+
+# Static files are served by static_files() below, not by Flask's built-in static route, which would
+# otherwise match first and skip the precompressed variants
+app = Flask(__name__, static_folder=None)
 CORS(app)  # Enable CORS for all routes
 
+# Seconds browsers may reuse static files (transcripts, seriesData.json, scripts) and search results
+# before checking back. Either way, an unchanged file is revalidated with its ETag and costs a 304
+STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', 3600))
+SEARCH_MAX_AGE = int(os.environ.get('SEARCH_MAX_AGE', 60))
+
+# Set TRACE_REQUESTS=1 to print one JSON line per request with the time spent in each stage
+TRACE_REQUESTS = os.environ.get('TRACE_REQUESTS', '0') == '1'
+
 # Initialize the Index object once when the server starts
 print("Loading database...")
-index = Index()
-# Database path relative to the site directory
-index.load_database('../scripts/database/bp_db')
+# Query embeddings are cached in memory and on disk, so popular searches skip the OpenAI call
+query_cache = QueryCache(path='../scripts/database/query_cache.sqlite',
+                         max_size=int(os.environ.get('QUERY_CACHE_SIZE', 10000)),
+                         ttl=float(os.environ.get('QUERY_CACHE_TTL', 30 * 24 * 3600)))
+# QueryIndex never imports the ingest-only stack (openai, assemblyai, reportlab), see scripts/query.py
+index = QueryIndex(query_cache=query_cache)
+# Database path relative to the site directory (override with DB_PATH). The server never adds to the index,
+# so by default the index is memory-mapped and paged in on demand, which keeps startup fast (set DB_MMAP=0
+# to disable)
+db_path = os.environ.get('DB_PATH', '../scripts/database/bp_db')
+index.load_database(db_path, mmap=os.environ.get('DB_MMAP', '1') == '1')
 print("Database loaded successfully!")
+# Lexical and hybrid searches use the BM25 index saved next to the database (see scripts/lexical.py). Building
+# it would tokenize the whole corpus on every boot, so without an up to date one the server is semantic-only
+LEXICAL_SEARCH = index.lexical is not None and len(index.lexical) == len(index.utterances)
+if not LEXICAL_SEARCH:
+    print(f"WARNING: no up to date BM25 index in {db_path}.bm25, lexical and hybrid searches fall back to "
+          f"semantic. Run `python lexical.py {db_path}` from scripts to build it")
+
+# Concurrent searches with the same options are run together: one embeddings request and one multi-row
+# faiss search per batch. A batch waits at most SEARCH_BATCH_WAIT_MS for company (SEARCH_BATCH_SIZE=1
+# disables batching). Requests are only concurrent within a worker with threads, see gunicorn.conf.py
+batcher = MicroBatcher(index.search_batch,
+                       max_batch_size=int(os.environ.get('SEARCH_BATCH_SIZE', 16)),
+                       max_wait=float(os.environ.get('SEARCH_BATCH_WAIT_MS', 5)) / 1000)
+
+# Typeahead over titles and frequent phrases (mined with scripts/suggest.py), answered without OpenAI
+suggester = Suggester.load(db_path, 'seriesData.json')
+
+# Under gunicorn with preload_app (see gunicorn.conf.py) the database is loaded once and forked into every
+# worker. Freezing moves the loaded objects out of the garbage collector's reach, so collections in the
+# workers do not write to, and so copy, the pages they share with the master
+gc.freeze()
+
+@app.before_request
+def start_timing():
+    g.request_start = time.perf_counter()
+    start_trace()
+
+@app.after_request
+def record_timing(response):
+    """Add the request's duration to the request_seconds histogram of its endpoint"""
+    elapsed = time.perf_counter() - g.request_start
+    endpoint = request.endpoint or 'not_found'
+    REGISTRY.observe('request_seconds', endpoint, elapsed)
+    stages = end_trace()
+    if TRACE_REQUESTS:
+        print(json.dumps({'endpoint': endpoint,
+                          'url': request.full_path,
+                          'status': response.status_code,
+                          'seconds': round(elapsed, 6),
+                          'stages': [[stage, round(seconds, 6)] for stage, seconds in stages]}))
+    return response
 
 @app.route('/')
 def index_page():
     """Serve the main index.html page"""
-    return send_file('index.html')
+    # Always revalidated, so a new deploy is picked up on the next visit
+    return send_precompressed('.', 'index.html', max_age=0)
 
 @app.route('/<path:filename>')
 def static_files(filename):
-    """Serve static files (CSS, JS, JSON, etc.)"""
-    return send_from_directory('.', filename)
+    """Serve static files (CSS, JS, JSON, etc.), precompressed by precompressed.py when possible"""
+    return send_precompressed('.', filename, max_age=STATIC_MAX_AGE)
 
 @app.route('/search', methods=['GET'])
 def search():
     """Search API endpoint"""
     query = request.args.get('q', '')
     k = request.args.get('k', 5, type=int)
+    # Optional filters, to search a single series or episode
+    series = request.args.get('series') or None
+    episode = request.args.get('episode') or None
+    # 'semantic' (default), 'lexical' (keywords or "exact phrase", no embedding call) or 'hybrid'
+    mode = request.args.get('mode', 'semantic')
+    if mode in ('lexical', 'hybrid') and not LEXICAL_SEARCH:
+        mode = 'semantic'
     
     if not query:
         return jsonify([])
     
     try:
-        results = index.search(query, k=k)
+        results = batcher.search(query, k=k, series=series, episode=episode, mode=mode)
         # Convert numpy types to native Python types for JSON serialization
-        serializable_results = []
-        for result in results:
-            serializable_result = {}
-            for key, value in result.items():
-                if hasattr(value, 'item'):  # numpy scalar
-                    serializable_result[key] = value.item()
-                else:
-                    serializable_result[key] = value
-            serializable_results.append(serializable_result)
-        return jsonify(serializable_results)
+        with timer('serialize'):
+            serializable_results = []
+            for result in results:
+                serializable_result = {}
+                for key, value in result.items():
+                    if hasattr(value, 'item'):  # numpy scalar
+                        serializable_result[key] = value.item()
+                    else:
+                        serializable_result[key] = value
+                serializable_results.append(serializable_result)
+            response = jsonify(serializable_results)
+        # Results only change when the database does, so repeat searches can be answered by the browser
+        response.cache_control.public = True
+        response.cache_control.max_age = SEARCH_MAX_AGE
+        response.add_etag()
+        return response.make_conditional(request)
     except Exception as e:
         print(f"Search error: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/suggest', methods=['GET'])
+def suggest():
+    """Typeahead endpoint: completions of q from series/episode titles and frequent phrases"""
+    query = request.args.get('q', '')
+    k = min(request.args.get('k', 8, type=int), 20)
+    response = jsonify(suggester.suggest(query, k))
+    response.cache_control.public = True
+    response.cache_control.max_age = STATIC_MAX_AGE
+    return response
+
+@app.route('/transcript', methods=['GET'])
+def transcript():
+    """
+    Part of an episode's transcript, as compact arrays with millisecond timestamps (see transcripts.py).
+
+    With t (milliseconds or "hh:mm:ss"), returns the paragraph playing at t and the paragraphs around it.
+    Otherwise returns the page of limit paragraphs starting at cursor. Every response has prev_cursor and
+    next_cursor for the neighbouring pages.
+    """
+    series = request.args.get('series', '')
+    episode = request.args.get('episode', '')
+    path = episode_path('Template', series, episode)
+    if not series or not episode or path is None or not os.path.isfile(path):
+        return jsonify({'error': f'No transcript for {series}: {episode}'}), 404
+
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    target = request.args.get('t')
+    try:
+        paragraphs = load_transcript(path)
+        if target:
+            ms = hms2ms(target) if ':' in target else int(target)
+            before = min(request.args.get('before', 5, type=int), limit)
+            result = paragraphs.window(ms, before=before, after=max(limit - before - 1, 0))
+        else:
+            result = paragraphs.page(request.args.get('cursor', 0, type=int), limit)
+    except ValueError:
+        return jsonify({'error': f'Invalid time: {target}'}), 400
+
+    response = jsonify(result)
+    response.cache_control.public = True
+    response.cache_control.max_age = STATIC_MAX_AGE
+    response.add_etag()
+    return response.make_conditional(request)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Latency histograms of each search stage and endpoint, in the Prometheus text format"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
-    return jsonify({'status': 'healthy'})
+    return jsonify({'status': 'healthy',
+                    'lexical_search': LEXICAL_SEARCH,
+                    'query_cache': query_cache.stats(),
+                    'search_batches': batcher.stats()})
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,257 @@
+"""
+Build the transcripts, seriesData.json and PDFs of the site from an index database.
+
+Every episode in the database becomes:
+    Template/<Series>/<Episode>.json           list of {"text", "start", "end"} paragraphs, read by script.js
+    Template/<Series>/<Episode>.compact.json   the same paragraphs in compact form, see transcripts.py
+    pdfs/<Series>/<Episode>.pdf                printable transcript
+
+and seriesData.json lists the episodes of every series, in the order they were added to the index.
+
+Builds are incremental. build_manifest.json records a hash of the paragraphs of every episode, and only
+episodes whose hash changed (or whose files are missing) are rendered again, on a pool of processes.
+Artifacts of episodes that are no longer in the database are deleted. Adding one episode to the index
+therefore re-renders only that episode.
+
+Transcripts rebuilt from an index have no speaker labels, so neither do their PDFs.
+
+Usage (build step, from the repo root, after the database changes):
+    python site/build_site.py scripts/database/bp_db site
+    python site/precompressed.py site
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+
+from scribe import Index, clean_series_name, transcript_pdf
+from transcripts import COMPACT_SUFFIX, CompactTranscript, episode_path
+
+
+# Changing how artifacts are rendered must change this, so that every episode is rendered again
+BUILD_VERSION = 1
+
+MANIFEST = 'build_manifest.json'
+
+
+def episode_paragraphs(utterance, emitted):
+    """
+    Return the paragraph of an utterance, leaving out the parts a previous overlapping window already
+    emitted (see chunking.Chunker), or None when nothing is left.
+
+    Args:
+        utterance (dict): Stored utterance
+        emitted (set): (start, end) of the parts of the episode emitted so far. Updated in place
+    """
+    parts = utterance.get('parts')
+    if not parts:
+        return {'text': utterance['text'], 'start': utterance['start'], 'end': utterance['end']}
+
+    new = [i for i, part in enumerate(parts) if (part['start'], part['end']) not in emitted]
+    emitted.update((part['start'], part['end']) for part in parts)
+    if not new:
+        return None
+    first = parts[new[0]]
+    return {'text': utterance['text'][first['offset']:].strip(), 'start': first['start'], 'end': utterance['end']}
+
+
+def index_episodes(index):
+    """
+    Regroup the utterances of an index into episodes.
+
+    Removed episodes are left out, and passages stored once for several episodes (see Index.deduplicate())
+    are put back in each of them.
+
+    Returns:
+        dict mapping (series, episode) to its list of {"text", "start", "end"} paragraphs in time order.
+    Series appear in the order they were added, and episodes within them too.
+    """
+    episodes = {}
+    emitted = {}
+    for start, stop in index.live_ranges():
+        for idx in range(start, stop):
+            utterance = index.utterances[idx]
+            key = (clean_series_name(utterance['series']), utterance['episode'])
+            paragraph = episode_paragraphs(utterance, emitted.setdefault(key, set()))
+            if paragraph is not None:
+                episodes.setdefault(key, []).append(paragraph)
+
+            # A duplicate location keeps its own chunk parts, and a near duplicate its own text
+            for duplicate in index.duplicates.get(idx, []):
+                key = (clean_series_name(duplicate['series']), duplicate['episode'])
+                paragraph = episode_paragraphs({'text': utterance['text'], **duplicate}, emitted.setdefault(key, set()))
+                if paragraph is not None:
+                    episodes.setdefault(key, []).append(paragraph)
+
+    # "hh:mm:ss" timestamps sort in time order
+    for paragraphs in episodes.values():
+        paragraphs.sort(key=lambda paragraph: paragraph['start'])
+    return episodes
+
+
+def episode_hash(series, episode, paragraphs):
+    payload = json.dumps({'version': BUILD_VERSION, 'series': series, 'episode': episode, 'paragraphs': paragraphs},
+                         sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def write_atomic(path, write):
+    """Write a file beside path and rename it into place, so the site never serves half a file"""
+    directory, _ = os.path.split(path)
+    os.makedirs(directory, exist_ok=True)
+    temporary = f'{path}.{os.getpid()}.tmp'
+    write(temporary)
+    os.replace(temporary, path)
+
+
+def render_episode(job):
+    """Write the artifacts of one episode. Runs in a worker process"""
+    series, episode, paragraphs, paths = job
+
+    def write_json(path):
+        with open(path, 'w') as f:
+            json.dump(paragraphs, f, indent=2)
+
+    write_atomic(paths['json'], write_json)
+    write_atomic(paths['compact'], CompactTranscript.from_paragraphs(paragraphs).save)
+    if paths.get('pdf'):
+        write_atomic(paths['pdf'], lambda path: transcript_pdf(path, episode, series, paragraphs))
+    return series, episode
+
+
+class SiteBuilder:
+
+    def __init__(self, site_dir, pdf_dir=None, max_workers=None):
+        """
+        Initialize a SiteBuilder instance
+
+        Args:
+            site_dir (str): Directory of the site, holding Template/ and seriesData.json
+            pdf_dir (str): Directory PDFs are written to, one subdirectory per series. Defaults to
+        <site_dir>/pdfs. Pass '' to skip PDFs.
+            max_workers (int): Number of rendering processes. Defaults to the number of cores
+        """
+        self.site_dir = site_dir
+        self.template_dir = os.path.join(site_dir, 'Template')
+        self.pdf_dir = os.path.join(site_dir, 'pdfs') if pdf_dir is None else pdf_dir
+        self.max_workers = max_workers or os.cpu_count()
+
+        self.manifest_path = os.path.join(site_dir, MANIFEST)
+        self.manifest = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r') as f:
+                self.manifest = json.load(f)
+
+    def paths(self, series, episode):
+        """Return the artifact paths of an episode, or None when its names do not make a safe path"""
+        json_path = episode_path(self.template_dir, series, episode)
+        if json_path is None:
+            return None
+        paths = {'json': json_path, 'compact': json_path[:-len('.json')] + COMPACT_SUFFIX}
+        if self.pdf_dir:
+            pdf_path = episode_path(self.pdf_dir, series, episode)
+            if pdf_path is None:
+                return None
+            paths['pdf'] = pdf_path[:-len('.json')] + '.pdf'
+        return paths
+
+    def up_to_date(self, key, digest, paths):
+        entry = self.manifest.get(key)
+        return (entry is not None and entry['hash'] == digest and entry['paths'] == paths
+                and all(os.path.exists(path) for path in paths.values()))
+
+    def save_manifest(self):
+        def write(path):
+            with open(path, 'w') as f:
+                json.dump(self.manifest, f, indent=1)
+        write_atomic(self.manifest_path, write)
+
+    def build(self, episodes):
+        """
+        Render every episode whose paragraphs changed since the last build, delete the artifacts of
+        episodes that are gone, and rewrite seriesData.json.
+
+        Args:
+            episodes (dict): (series, episode) to paragraphs, see index_episodes()
+
+        Returns:
+            dict with the number of episodes rendered, skipped and deleted
+        """
+        start = time.perf_counter()
+        jobs, hashes = [], {}
+        for (series, episode), paragraphs in episodes.items():
+            paths = self.paths(series, episode)
+            if paths is None:
+                print(f'Skipped {series}: {episode}, its name is not a safe path')
+                continue
+            key = f'{series}/{episode}'
+            digest = episode_hash(series, episode, paragraphs)
+            hashes[key] = (digest, paths)
+            if not self.up_to_date(key, digest, paths):
+                jobs.append((series, episode, paragraphs, paths))
+
+        # Render in worker processes, recording each episode as soon as it is done so an interrupted
+        # build keeps its progress
+        if jobs:
+            workers = min(self.max_workers, len(jobs))
+            chunksize = max(1, len(jobs) // (4 * workers))
+            try:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    for series, episode in executor.map(render_episode, jobs, chunksize=chunksize):
+                        key = f'{series}/{episode}'
+                        digest, paths = hashes[key]
+                        self.manifest[key] = {'hash': digest, 'paths': paths}
+            finally:
+                self.save_manifest()
+
+        # Another episode may now own the same paths, e.g. after a series is renamed
+        deleted = 0
+        live = {path for _, paths in hashes.values() for path in paths.values()}
+        for key in [key for key in self.manifest if key not in hashes]:
+            for path in self.manifest.pop(key)['paths'].values():
+                if path not in live and os.path.exists(path):
+                    os.remove(path)
+            deleted += 1
+        if deleted:
+            self.save_manifest()
+
+        series_data = {}
+        for series, episode in episodes:
+            series_data.setdefault(series, []).append(episode)
+
+        def write_series_data(path):
+            with open(path, 'w') as f:
+                json.dump(series_data, f, indent=2)
+        write_atomic(os.path.join(self.site_dir, 'seriesData.json'), write_series_data)
+
+        elapsed = time.perf_counter() - start
+        print(f'Rendered {len(jobs)} episodes, {len(hashes) - len(jobs)} were up to date, '
+              f'deleted {deleted} ({elapsed:.2f}s)')
+        return {'rendered': len(jobs), 'skipped': len(hashes) - len(jobs), 'deleted': deleted}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('database', type=str, help='Path prefix of the index database, e.g. scripts/database/bp_db')
+    parser.add_argument('site_dir', type=str, help='Directory of the site, e.g. site')
+    parser.add_argument('--pdf-dir', type=str, default=None, help='Directory of the PDFs, defaults to <site_dir>/pdfs')
+    parser.add_argument('--no-pdf', action='store_true', help='Do not render PDFs')
+    parser.add_argument('--workers', type=int, default=None, help='Number of rendering processes')
+    args = parser.parse_args()
+
+    # The build only reads utterances, so the faiss index and vectors are memory-mapped rather than read into RAM
+    index = Index()
+    index.load_database(args.database, mmap=True)
+
+    builder = SiteBuilder(args.site_dir, '' if args.no_pdf else args.pdf_dir, args.workers)
+    builder.build(index_episodes(index))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""
+Gunicorn settings for serving app.py with several workers that share one copy of the database.
+
+With preload_app, app.py (and so load_database()) runs once in the master process before the workers are
+forked. The faiss index and the columnar metadata are memory-mapped from disk, so every worker maps the
+same page cache pages instead of holding its own copy. Anything still read into RAM at load time (e.g.
+utterances from a .json database) is shared copy-on-write, and app.py freezes it out of the garbage
+collector so the collector does not touch, and copy, those pages.
+
+Usage (from the site directory):
+    gunicorn -c gunicorn.conf.py app:app
+
+Environment variables:
+    PORT             port to listen on (default 5000)
+    WEB_CONCURRENCY  number of worker processes (default 2)
+    WEB_THREADS      request threads per worker (default 4). Concurrent searches in a worker are
+                     micro-batched into one embeddings request and one faiss search, see
+                     scripts/batching.py
+    FAISS_THREADS    OpenMP threads per worker for faiss searches (default 1, so workers do not
+                     compete for cores)
+
+Memory per worker can be checked with scripts/worker_report.py.
+"""
+
+import os
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+# More than one thread runs the gthread worker, so searches in a worker can be batched together
+threads = int(os.environ.get('WEB_THREADS', 4))
+timeout = 120
+
+# Load the database once in the master, before forking
+preload_app = True
+
+
+def post_fork(server, worker):
+    # OpenMP threads do not survive fork, and one thread per worker avoids oversubscribing the cores
+    import faiss
+    faiss.omp_set_num_threads(int(os.environ.get('FAISS_THREADS', 1)))
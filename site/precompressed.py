@@ -0,0 +1,136 @@
+"""
+Precompressed static files with strong ETags and Cache-Control headers.
+
+At build time, compress() writes a gzip (.gz) and, when the brotli package is installed, a brotli (.br)
+copy next to every compressible file. At request time, send_precompressed() picks the smallest variant
+the client accepts, so nothing is compressed per request. Every response carries a strong ETag derived
+from the file contents, so a revisit costs a 304 with no body.
+
+Usage (build step, from the repo root):
+    python site/precompressed.py site
+"""
+
+import argparse
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from flask import abort, request, send_file
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+COMPRESSIBLE = ('.json', '.js', '.css', '.html')
+
+# Content-Encoding and file suffix of each variant, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# ETags by path, with the (mtime, size) they were computed for
+_etags = {}
+
+
+def _up_to_date(variant, source):
+    return os.path.exists(variant) and os.path.getmtime(variant) >= os.path.getmtime(source)
+
+
+def compress_file(path):
+    """
+    Write the compressed variants of a file that are missing or older than it.
+
+    Returns:
+        number of variants written
+    """
+    with open(path, 'rb') as f:
+        data = None
+        written = 0
+        for encoding, suffix in ENCODINGS:
+            if encoding == 'br' and brotli is None:
+                continue
+            if _up_to_date(path + suffix, path):
+                continue
+            if data is None:
+                data = f.read()
+            if encoding == 'br':
+                compressed = brotli.compress(data, quality=11)
+            else:
+                # mtime=0 makes the output depend only on the contents
+                compressed = gzip.compress(data, compresslevel=9, mtime=0)
+            with open(path + suffix, 'wb') as out:
+                out.write(compressed)
+            written += 1
+    return written
+
+
+def compress(directory):
+    """Write compressed variants of every compressible file under directory, and print a summary"""
+    if brotli is None:
+        print('brotli is not installed, writing gzip variants only')
+    files, written = 0, 0
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            if filename.endswith(COMPRESSIBLE):
+                files += 1
+                written += compress_file(os.path.join(root, filename))
+    print(f'Compressed {files} files under {directory} ({written} variants written, the rest were up to date)')
+
+
+def file_etag(path):
+    """Strong ETag of a file: a hash of its contents, recomputed only when the file changes"""
+    stat = os.stat(path)
+    cached = _etags.get(path)
+    if cached is not None and cached[0] == (stat.st_mtime_ns, stat.st_size):
+        return cached[1]
+    with open(path, 'rb') as f:
+        etag = hashlib.sha1(f.read()).hexdigest()
+    _etags[path] = ((stat.st_mtime_ns, stat.st_size), etag)
+    return etag
+
+
+def send_precompressed(directory, filename, max_age=3600):
+    """
+    Flask response for a static file, using a precompressed variant when the client accepts one.
+
+    Args:
+        directory (str): Directory files are served from
+        filename (str): Path of the file relative to directory, as given in the URL
+        max_age (int): Seconds browsers may reuse the file without asking. With 0, browsers revalidate
+    with the ETag on every use.
+    """
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    etag = file_etag(path)
+    served, content_encoding = path, None
+    for encoding, suffix in ENCODINGS:
+        if request.accept_encodings[encoding] and _up_to_date(path + suffix, path):
+            served, content_encoding = path + suffix, encoding
+            break
+
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    response = send_file(served, mimetype=mimetype, conditional=False, etag=False, max_age=max_age)
+    if content_encoding:
+        response.headers['Content-Encoding'] = content_encoding
+        # Each encoding is a different representation, so it needs its own strong ETag
+        etag = f'{etag}-{content_encoding}'
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.set_etag(etag)
+    response.cache_control.public = True
+    return response.make_conditional(request)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('directory', type=str, help='Directory of static files to compress, e.g. site')
+    args = parser.parse_args()
+
+    compress(args.directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,57 @@
 console.log('Script loaded successfully');
 
-// Load episode content from JSON files
-function loadEpisodeContent(series, episode, targetTime = null) {
-  console.log('Loading episode content:', series, episode, targetTime);
-  
+// Number of paragraphs fetched per page of a transcript
+const TRANSCRIPT_PAGE_SIZE = 50;
+
+// Convert integer milliseconds to "hh:mm:ss", the timestamp format of the transcripts
+function msToHms(ms) {
+  const seconds = Math.floor(ms / 1000);
+  const pad = n => String(n).padStart(2, '0');
+  return `${pad(Math.floor(seconds / 3600))}:${pad(Math.floor(seconds % 3600 / 60))}:${pad(seconds % 60)}`;
+}
+
+// Turn a page from the /transcript endpoint (compact arrays in milliseconds) into paragraph objects
+function pageToParagraphs(page) {
+  return page.text.map((text, i) => ({
+    text: text,
+    start: msToHms(page.start[i]),
+    end: msToHms(page.end[i])
+  }));
+}
+
+// Build the HTML of a list of transcript paragraphs
+function renderParagraphs(paragraphs, firstIndex = 0) {
+  return paragraphs.map((paraObj, i) => {
+    const index = firstIndex + i;
+    const timeId = paraObj.start ? paraObj.start.replace(/:/g, '-') : `para-${index}`;
+    const timeDisplay = paraObj.start ? paraObj.start : '';
+    const textContent = paraObj.text ? paraObj.text : '';
+    
+    return `
+      <div class="transcript-row" id="time-${timeId}" data-start="${paraObj.start || ''}" data-end="${paraObj.end || ''}">
+        <div class="timestamp-column">
+          ${timeDisplay ? `<span class="timestamp">${timeDisplay}</span>` : ''}
+        </div>
+        <div class="text-column">
+          <p>${textContent}</p>
+        </div>
+      </div>
+    `;
+  }).join('');
+}
+
+// Fetch part of a transcript from the /transcript endpoint, either around a time (t) or a page (cursor, limit)
+async function fetchTranscriptPage(series, episode, params) {
+  const query = new URLSearchParams({ series: series, episode: episode, ...params });
+  const response = await fetch(`/transcript?${query}`);
+  if (!response.ok) {
+    throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+  }
+  return response.json();
+}
+
+// Fetch a whole transcript JSON file. Used when the site is served without the API (serve_site.py)
+async function fetchTranscriptFile(series, episode) {
   // Construct the file path using the specified format
   // Replace spaces with underscores but preserve colons
   const safeSeries = series.replace(/ /g, '_').replace(/[&\/]/g, '_');
@@ -15,69 +63,98 @@ function loadEpisodeContent(series, episode, targetTime = null) {
   const encodedFilePath = filePath.replace(/\?/g, '%3F');
   
   console.log('Fetching file:', filePath);
+  const response = await fetch(encodedFilePath);
+  if (!response.ok) {
+    throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+  }
+  const paragraphs = await response.json();
+  return { first: 0, total: paragraphs.length, paragraphs: paragraphs, prev_cursor: null, next_cursor: null };
+}
+
+// Update the main header to show episode information
+function setEpisodeHeader(series, episode) {
+  const mainTitle = document.querySelector('.main-title');
+  
+  // Extract episode number and clean title
+  const episodeMatch = episode.match(/^Episode \d+:\s*(.+)$/);
+  const cleanEpisodeTitle = episodeMatch ? episodeMatch[1] : episode;
+  
+  // Extract episode number for the series line
+  const episodeNumberMatch = episode.match(/^Episode (\d+):/);
+  const episodeNumber = episodeNumberMatch ? episodeNumberMatch[1] : '';
+  
+  mainTitle.innerHTML = `
+    <div class="episode-title">${cleanEpisodeTitle}</div>
+    <div class="series-name">${series.replace(/_/g, ' ')}, Episode ${episodeNumber}</div>
+  `;
+}
+
+// Load episode content. With a target time, only the paragraphs around it are fetched, and the rest
+// of the episode is loaded a page at a time with the "Show earlier" / "Show more" buttons
+async function loadEpisodeContent(series, episode, targetTime = null) {
+  console.log('Loading episode content:', series, episode, targetTime);
   
   // Show loading message
   document.getElementById('search-results').innerHTML = '<div>Loading episode...</div>';
   
-  fetch(encodedFilePath)
-    .then(response => {
-      if (!response.ok) {
-        throw new Error(`HTTP ${response.status}: ${response.statusText}`);
-      }
-      return response.json();
-    })
-    .then(paragraphs => {
-      // Update the main header to show episode information
-      const mainTitle = document.querySelector('.main-title');
-      
-      // Extract episode number and clean title
-      const episodeMatch = episode.match(/^Episode \d+:\s*(.+)$/);
-      const cleanEpisodeTitle = episodeMatch ? episodeMatch[1] : episode;
-      
-      // Extract episode number for the series line
-      const episodeNumberMatch = episode.match(/^Episode (\d+):/);
-      const episodeNumber = episodeNumberMatch ? episodeNumberMatch[1] : '';
-      
-      mainTitle.innerHTML = `
-        <div class="episode-title">${cleanEpisodeTitle}</div>
-        <div class="series-name">${series.replace(/_/g, ' ')}, Episode ${episodeNumber}</div>
-      `;
-      
-      let contentHtml = `<div class="transcript-container">`;
-      
-      paragraphs.forEach((paraObj, index) => {
-        const timeId = paraObj.start ? paraObj.start.replace(/:/g, '-') : `para-${index}`;
-        const timeDisplay = paraObj.start ? paraObj.start : '';
-        const textContent = paraObj.text ? paraObj.text : '';
-        
-        contentHtml += `
-          <div class="transcript-row" id="time-${timeId}" data-start="${paraObj.start || ''}" data-end="${paraObj.end || ''}">
-            <div class="timestamp-column">
-              ${timeDisplay ? `<span class="timestamp">${timeDisplay}</span>` : ''}
-            </div>
-            <div class="text-column">
-              <p>${textContent}</p>
-            </div>
-          </div>
-        `;
-      });
-      
-      contentHtml += `</div>`;
-      document.getElementById('search-results').innerHTML = contentHtml;
-      console.log('Episode content loaded successfully');
-      
-      // If a target time was specified, scroll to that paragraph
-      if (targetTime) {
-        scrollToParagraph(targetTime);
-      }
-    })
-    .catch(err => {
-      console.error('Error loading episode:', err);
-      document.getElementById('search-results').innerHTML = `
-        <div class="episode-header"><strong>${series}:</strong> ${episode}</div>
-        <p style='color:red;'>Could not load episode content: ${err.message}</p>
-      `;
-    });
+  let page;
+  try {
+    try {
+      const params = targetTime ? { t: targetTime, limit: TRANSCRIPT_PAGE_SIZE } : { cursor: 0, limit: TRANSCRIPT_PAGE_SIZE };
+      page = await fetchTranscriptPage(series, episode, params);
+      page.paragraphs = pageToParagraphs(page);
+    } catch (err) {
+      console.warn('Transcript endpoint unavailable, loading the whole file:', err);
+      page = await fetchTranscriptFile(series, episode);
+    }
+  } catch (err) {
+    console.error('Error loading episode:', err);
+    document.getElementById('search-results').innerHTML = `
+      <div class="episode-header"><strong>${series}:</strong> ${episode}</div>
+      <p style='color:red;'>Could not load episode content: ${err.message}</p>
+    `;
+    return;
+  }
+  
+  setEpisodeHeader(series, episode);
+  
+  document.getElementById('search-results').innerHTML = `
+    <div class="transcript-container">
+      <button class="transcript-more" id="transcript-earlier">Show earlier</button>
+      <div id="transcript-rows">${renderParagraphs(page.paragraphs, page.first)}</div>
+      <button class="transcript-more" id="transcript-later">Show more</button>
+    </div>
+  `;
+  console.log('Episode content loaded successfully');
+  
+  // Range of paragraphs on the page, extended as more pages are loaded
+  let first = page.first;
+  let next = page.next_cursor;
+  const earlierButton = document.getElementById('transcript-earlier');
+  const laterButton = document.getElementById('transcript-later');
+  const rows = document.getElementById('transcript-rows');
+  earlierButton.style.display = first > 0 ? '' : 'none';
+  laterButton.style.display = next !== null ? '' : 'none';
+  
+  earlierButton.addEventListener('click', async () => {
+    const cursor = Math.max(first - TRANSCRIPT_PAGE_SIZE, 0);
+    const earlier = await fetchTranscriptPage(series, episode, { cursor: cursor, limit: first - cursor });
+    rows.insertAdjacentHTML('afterbegin', renderParagraphs(pageToParagraphs(earlier), earlier.first));
+    first = earlier.first;
+    earlierButton.style.display = first > 0 ? '' : 'none';
+  });
+  
+  laterButton.addEventListener('click', async () => {
+    const later = await fetchTranscriptPage(series, episode, { cursor: next, limit: TRANSCRIPT_PAGE_SIZE });
+    rows.insertAdjacentHTML('beforeend', renderParagraphs(pageToParagraphs(later), later.first));
+    next = later.next_cursor;
+    laterButton.style.display = next !== null ? '' : 'none';
+  });
+  
+  // If a target time was specified, scroll to that paragraph
+  if (targetTime) {
+    scrollToParagraph(targetTime);
+  }
 }
 
 // Function to reset the header to default state
@@ -90,7 +167,16 @@ function resetHeader() {
 function scrollToParagraph(targetTime) {
   // Convert target time to the format used in paragraph IDs
   const timeId = targetTime.replace(/:/g, '-');
-  const targetElement = document.getElementById(`time-${timeId}`);
+  let targetElement = document.getElementById(`time-${timeId}`);
+  
+  // Otherwise use the paragraph playing at that time: the last one starting before it
+  if (!targetElement) {
+    document.querySelectorAll('.transcript-row').forEach(row => {
+      if (row.dataset.start && row.dataset.start <= targetTime) {
+        targetElement = row;
+      }
+    });
+  }
   
   if (targetElement) {
     // Scroll to the element with some offset for better visibility
@@ -315,12 +401,71 @@ function setupSidebarSearch(seriesData) {
     }
   }
   
-  sidebarSearchBtn.addEventListener('click', performSidebarSearch);
+  sidebarSearchBtn.addEventListener('click', () => {
+    hideSuggestions();
+    performSidebarSearch();
+  });
   sidebarSearchInput.addEventListener('keydown', (e) => {
     if (e.key === 'Enter') {
+      hideSuggestions();
       performSidebarSearch();
     }
   });
+  
+  // Typeahead: /suggest answers from titles and frequent phrases without an embedding call, so it is
+  // cheap enough to ask on every keystroke. Only the answer to the latest keystroke is shown
+  const suggestionsBox = document.getElementById('sidebar-suggestions');
+  let suggestRequest = null;
+  
+  function hideSuggestions() {
+    if (suggestRequest) {
+      suggestRequest.abort();
+    }
+    suggestionsBox.innerHTML = '';
+  }
+  
+  sidebarSearchInput.addEventListener('input', async () => {
+    const query = sidebarSearchInput.value.trim();
+    if (suggestRequest) {
+      suggestRequest.abort();
+    }
+    if (!query) {
+      suggestionsBox.innerHTML = '';
+      return;
+    }
+    suggestRequest = new AbortController();
+    let suggestions;
+    try {
+      const response = await fetch(`/suggest?q=${encodeURIComponent(query)}&k=8`, { signal: suggestRequest.signal });
+      if (!response.ok) {
+        return;
+      }
+      suggestions = await response.json();
+    } catch (error) {
+      // Aborted by a newer keystroke, or the API is not running (serve_site.py)
+      return;
+    }
+    
+    suggestionsBox.innerHTML = suggestions.map(s => `
+      <div class="sidebar-suggestion" data-type="${s.type}" data-series="${s.series || ''}" data-episode="${s.episode || ''}">
+        ${s.text}${s.type === 'phrase' ? '' : ` <span class="suggestion-type">${s.type}</span>`}
+      </div>
+    `).join('');
+    
+    suggestionsBox.querySelectorAll('.sidebar-suggestion').forEach((el, i) => {
+      el.addEventListener('click', () => {
+        const suggestion = suggestions[i];
+        hideSuggestions();
+        if (suggestion.type === 'episode') {
+          // Titles open the episode directly
+          loadEpisodeContent(suggestion.series, suggestion.episode);
+        } else {
+          sidebarSearchInput.value = suggestion.text;
+          performSidebarSearch();
+        }
+      });
+    });
+  });
 }
 
 function renderSidebarSearchResults(results, container) {
@@ -14,19 +14,24 @@ CORS(app)  # Enable CORS for all routes
 # Initialize the Index object once when the server starts
 print("Loading database...")
 index = Index()
-index.load_database('scripts/database/bp_db')
+index.load_database('scripts/database/bp_db', mmap=True)
 print("Database loaded successfully!")
 
 @app.route('/search', methods=['GET'])
 def search():
     query = request.args.get('q', '')
     k = request.args.get('k', 5, type=int)
+    # Optional filters, to search a single series or episode
+    series = request.args.get('series') or None
+    episode = request.args.get('episode') or None
+    # 'semantic' (default), 'lexical' (keywords or "exact phrase", no embedding call) or 'hybrid'
+    mode = request.args.get('mode', 'semantic')
     
     if not query:
         return jsonify([])
     
     try:
-        results = index.search(query, k=k)
+        results = index.search(query, k=k, series=series, episode=episode, mode=mode)
         # Convert numpy types to native Python types for JSON serialization
         serializable_results = []
         for result in results:
@@ -0,0 +1,164 @@
+"""
+Compact episode transcripts, served a window or a page at a time.
+
+The transcripts in Template/ are lists of {"text", "start", "end"} paragraphs with "hh:mm:ss" timestamps.
+The compact form keeps the same paragraphs as three parallel arrays, with integer milliseconds:
+    {"start": [0, 15000, ...], "end": [15000, 31000, ...], "text": ["...", "...", ...]}
+
+so the paragraph playing at a given time is found by binary search over "start", and any slice of
+paragraphs can be sent on its own. A search result then loads the few paragraphs around its timestamp
+instead of the whole episode, and the rest is fetched page by page with cursors.
+
+Usage (build step, from the repo root, writes <episode>.compact.json next to each transcript):
+    python site/transcripts.py site/Template
+"""
+
+import argparse
+import json
+import os
+from bisect import bisect_right
+from functools import lru_cache
+
+from werkzeug.security import safe_join
+
+
+COMPACT_SUFFIX = '.compact.json'
+
+
+def hms2ms(hms):
+    """Convert "hh:mm:ss" (or "mm:ss") to integer milliseconds"""
+    seconds = 0
+    for part in hms.split(':'):
+        seconds = seconds * 60 + int(part)
+    return seconds * 1000
+
+
+def ms2hms(ms):
+    """Convert integer milliseconds to "hh:mm:ss", as in the Template transcripts"""
+    seconds = ms // 1000
+    return f'{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}'
+
+
+def episode_path(directory, series, episode):
+    """
+    Path of an episode's transcript, named the way script.js names it, or None if it would fall
+    outside directory
+    """
+    safe_series = series.replace(' ', '_').replace('&', '_').replace('/', '_')
+    safe_episode = episode.replace(' ', '_')
+    return safe_join(directory, safe_series, f'{safe_episode}.json')
+
+
+class CompactTranscript:
+
+    def __init__(self, start, end, text):
+        """
+        Initialize a CompactTranscript instance
+
+        Args:
+            start (list(int)): Start of each paragraph in milliseconds, in increasing order
+            end (list(int)): End of each paragraph in milliseconds
+            text (list(str)): Text of each paragraph
+        """
+        self.start = start
+        self.end = end
+        self.text = text
+
+    @classmethod
+    def from_paragraphs(cls, paragraphs):
+        """Build from a list of {"text", "start", "end"} dictionaries with "hh:mm:ss" timestamps"""
+        return cls([hms2ms(paragraph['start']) for paragraph in paragraphs],
+                   [hms2ms(paragraph['end']) for paragraph in paragraphs],
+                   [paragraph['text'] for paragraph in paragraphs])
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load the transcript at path (a Template .json file), from its compact file when that is up to date
+        """
+        compact_path = path[:-len('.json')] + COMPACT_SUFFIX
+        if os.path.exists(compact_path) and os.path.getmtime(compact_path) >= os.path.getmtime(path):
+            with open(compact_path, 'r') as f:
+                data = json.load(f)
+            return cls(data['start'], data['end'], data['text'])
+        with open(path, 'r') as f:
+            return cls.from_paragraphs(json.load(f))
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'start': self.start, 'end': self.end, 'text': self.text}, f, separators=(',', ':'))
+
+    def __len__(self):
+        return len(self.start)
+
+    def find(self, ms):
+        """Return the position of the paragraph playing at ms (the last one starting at or before it)"""
+        return max(bisect_right(self.start, ms) - 1, 0)
+
+    def page(self, cursor=0, limit=50):
+        """
+        Return paragraphs [cursor, cursor + limit) as a dictionary with the compact arrays, the position
+        of the first paragraph, and cursors of the previous and next pages (None at either end)
+        """
+        first = min(max(cursor, 0), len(self))
+        last = min(first + limit, len(self))
+        return {'first': first,
+                'total': len(self),
+                'start': self.start[first:last],
+                'end': self.end[first:last],
+                'text': self.text[first:last],
+                'prev_cursor': max(first - limit, 0) if first > 0 else None,
+                'next_cursor': last if last < len(self) else None}
+
+    def window(self, ms, before=5, after=15):
+        """
+        Return the paragraph playing at ms with up to before paragraphs ahead of it and after paragraphs
+        following it, as page() does, plus the position of that paragraph under 'target'
+        """
+        target = self.find(ms)
+        first = max(target - before, 0)
+        window = self.page(first, target - first + after + 1)
+        window['target'] = target
+        # Paging backwards from a window fetches the paragraphs just before it
+        if first > 0:
+            window['prev_cursor'] = max(first - (before + after + 1), 0)
+        return window
+
+
+@lru_cache(maxsize=256)
+def _load(path, mtime):
+    return CompactTranscript.load(path)
+
+
+def load_transcript(path):
+    """Load a transcript, reusing the loaded copy of recently used episodes until the file changes"""
+    return _load(path, os.path.getmtime(path))
+
+
+def build(directory):
+    """Write a compact file next to every transcript under directory that lacks an up to date one"""
+    written, total = 0, 0
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            if not filename.endswith('.json') or filename.endswith(COMPACT_SUFFIX):
+                continue
+            total += 1
+            path = os.path.join(root, filename)
+            compact_path = path[:-len('.json')] + COMPACT_SUFFIX
+            if os.path.exists(compact_path) and os.path.getmtime(compact_path) >= os.path.getmtime(path):
+                continue
+            CompactTranscript.load(path).save(compact_path)
+            written += 1
+    print(f'Wrote {written} compact transcripts under {directory} ({total - written} were up to date)')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('directory', type=str, help='Directory of transcripts, e.g. site/Template')
+    args = parser.parse_args()
+
+    build(args.directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Shared fixtures. Tests run offline: embeddings come from the stub server in scripts/stub_services.py,
+and episodes are built from made-up transcripts, so neither OpenAI nor AssemblyAI is contacted.
+
+Usage (from the repo root):
+    python -m pytest tests
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+
+from stub_services import FakeTranscript, FakeUtterance, start_stub_server
+
+
+# Small embeddings keep the tests fast
+DIMENSION = 64
+
+WORDS = ('desert', 'temple', 'garden', 'exile', 'covenant', 'wilderness', 'priest', 'river', 'mountain',
+         'blessing', 'serpent', 'kingdom', 'prophet', 'sabbath', 'creation', 'chaos', 'dragon', 'exodus')
+
+
+@pytest.fixture(scope='session', autouse=True)
+def stub_embeddings():
+    """Point the OpenAI client (and QueryEmbedder) at the stub embeddings server for the whole session"""
+    server, url = start_stub_server(dimension=DIMENSION)
+    saved = {name: os.environ.get(name) for name in ('OPENAI_BASE_URL', 'OPENAI_API_KEY')}
+    os.environ['OPENAI_BASE_URL'] = url
+    os.environ['OPENAI_API_KEY'] = 'stub'
+    yield url
+    server.shutdown()
+    for name, value in saved.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+
+
+def sentence(seed, words=12):
+    """A deterministic made-up sentence of words words"""
+    return ' '.join(WORDS[(seed * 7 + i * (seed % 5 + 1)) % len(WORDS)] for i in range(words)).capitalize() + '.'
+
+
+def make_episode(episode_title, series_title, texts):
+    """Build an Episode whose utterances have texts, 10 seconds apart"""
+    from scribe import Episode
+    utterances = [FakeUtterance('A', text, 10000 * i, 10000 * i + 9000) for i, text in enumerate(texts)]
+    return Episode.from_transcript(episode_title, series_title, FakeTranscript(utterances))
+
+
+def new_index(**index_args):
+    """An empty Index of the test dimension"""
+    from scribe import Index
+    return Index(dimension=DIMENSION, **index_args)
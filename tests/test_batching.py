@@ -0,0 +1,120 @@
+import threading
+import time
+
+import pytest
+
+import metrics
+from batching import MicroBatcher
+from conftest import make_episode, new_index, sentence
+from metrics import end_trace, start_trace, timer
+
+
+class FakeSearch:
+    """search_batch() stand-in recording its calls, blocking while release is unset, failing on 'bad'"""
+
+    def __init__(self):
+        self.calls = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, queries, **options):
+        self.calls.append(list(queries))
+        self.started.set()
+        self.release.wait()
+        with timer('vector_search'):
+            if 'bad' in queries:
+                raise ValueError('bad query')
+        return [[f'{query} k={options["k"]}'] for query in queries]
+
+
+def run(batcher, queries, first='a'):
+    """
+    Search first, holding it in search_batch() while queries are searched on one thread each, and return
+    (results or exception, stages traced) by query.
+    """
+    outcomes = {}
+
+    def search(query):
+        start_trace()
+        try:
+            outcomes[query] = batcher.search(query, k=3)
+        except Exception as e:
+            outcomes[query] = e
+        outcomes[query] = (outcomes[query], [stage for stage, _ in end_trace()])
+
+    fake = batcher.search_batch
+    fake.release.clear()
+    held = threading.Thread(target=search, args=(first,))
+    held.start()
+    fake.started.wait()
+
+    # The others find a search in progress, so they wait for each other and fill one batch
+    threads = [threading.Thread(target=search, args=(query,)) for query in queries]
+    for thread in threads:
+        thread.start()
+    while batcher.active < 1 + len(queries):
+        time.sleep(0.001)
+    fake.release.set()
+    for thread in [held] + threads:
+        thread.join()
+    return outcomes
+
+
+def stage_count(stage):
+    histogram = metrics.REGISTRY.histograms.get(('stage_seconds', stage))
+    return histogram.count if histogram else 0
+
+
+def test_concurrent_searches_are_batched_and_get_their_own_results():
+    batcher = MicroBatcher(FakeSearch(), max_batch_size=4, max_wait=5.0)
+    queries = ['b', 'c', 'd', 'e']
+    outcomes = run(batcher, queries)
+
+    assert batcher.search_batch.calls == [['a'], queries]
+    assert batcher.stats() == {'batches': 2, 'queries': 5, 'mean_batch_size': 2.5, 'largest_batch': 4}
+    for query in ['a'] + queries:
+        assert outcomes[query][0] == [f'{query} k=3']
+
+
+def test_stage_timings_are_recorded_for_every_request():
+    before = stage_count('vector_search')
+    batcher = MicroBatcher(FakeSearch(), max_batch_size=4, max_wait=5.0)
+    outcomes = run(batcher, ['b', 'c', 'd', 'e'])
+
+    assert stage_count('vector_search') == before + 5
+    assert all('vector_search' in stages for _, stages in outcomes.values())
+    # Followers also waited for their batch
+    assert sum('batch_wait' in stages for _, stages in outcomes.values()) >= 3
+
+
+def test_a_bad_query_only_fails_its_own_search():
+    batcher = MicroBatcher(FakeSearch(), max_batch_size=4, max_wait=5.0)
+    queries = ['b', 'bad', 'd', 'e']
+    outcomes = run(batcher, queries)
+
+    assert batcher.search_batch.calls[1] == queries
+    # Each query of the failed batch was searched again on its own
+    assert sorted(batcher.search_batch.calls[2:]) == [[query] for query in sorted(queries)]
+    assert isinstance(outcomes['bad'][0], ValueError)
+    for query in ('a', 'b', 'd', 'e'):
+        assert outcomes[query][0] == [f'{query} k=3']
+
+
+def test_lone_search_is_not_delayed():
+    batcher = MicroBatcher(FakeSearch(), max_batch_size=16, max_wait=5.0)
+    start_trace()
+    assert batcher.search('a', k=3) == ['a k=3']
+    assert [stage for stage, _ in end_trace()] == ['vector_search']
+
+
+def test_index_search_batch_matches_search():
+    index = new_index()
+    index.add_episode(make_episode('Episode 1', 'Series', [sentence(i) for i in range(20)]), checkpoint=None)
+    queries = [sentence(4), sentence(13), 'the prophet by the river']
+
+    for mode in ('semantic', 'lexical', 'hybrid'):
+        expected = [index.search(query, k=4, mode=mode) for query in queries]
+        assert index.search_batch(queries, k=4, mode=mode) == expected
+    with pytest.raises(ValueError):
+        index.search_batch(queries, mode='fuzzy')
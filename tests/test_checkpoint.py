@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+
+from checkpoint import Checkpoint
+from conftest import DIMENSION, make_episode, new_index, sentence
+
+
+def ingest(checkpoint, episodes=3, utterances=5):
+    index = new_index()
+    for e in range(episodes):
+        texts = [sentence(e * utterances + i) for i in range(utterances)]
+        index.add_episode(make_episode(f'Episode {e}', 'Series', texts), checkpoint=checkpoint)
+    return index
+
+
+def test_replayed_checkpoint_matches_live_index(tmp_path):
+    checkpoint = str(tmp_path / 'temp')
+    live = ingest(checkpoint)
+
+    replayed = new_index()
+    replayed.load_checkpoint(checkpoint)
+
+    assert list(replayed.utterances) == list(live.utterances)
+    np.testing.assert_array_equal(replayed.all_vectors(), live.all_vectors())
+
+
+def test_each_episode_appends_only_its_own_rows(tmp_path):
+    checkpoint = str(tmp_path / 'temp')
+    index = ingest(checkpoint, episodes=1, utterances=4)
+    size = os.path.getsize(f'{checkpoint}.wal.vectors')
+    assert size == 4 * DIMENSION * 4
+
+    index.add_episode(make_episode('Episode 1', 'Series', [sentence(100), sentence(101)]), checkpoint=checkpoint)
+    assert os.path.getsize(f'{checkpoint}.wal.vectors') == size + 2 * DIMENSION * 4
+
+
+def test_torn_tail_is_ignored_and_cut_before_next_append(tmp_path):
+    checkpoint = str(tmp_path / 'temp')
+    ingest(checkpoint, episodes=2)
+
+    # A run that died halfway through appending a third episode
+    with open(f'{checkpoint}.wal.vectors', 'ab') as f:
+        f.write(np.ones(3 * DIMENSION, dtype='float32').tobytes())
+    with open(f'{checkpoint}.wal.jsonl', 'ab') as f:
+        f.write(b'{"dimension": 64, "utterances": [{"text": "half')
+
+    assert len(list(Checkpoint(checkpoint, DIMENSION).segments())) == 2
+
+    # The next run resumes from the checkpoint and appends after the committed episodes
+    resumed = new_index()
+    resumed.load_checkpoint(checkpoint)
+    resumed.add_episode(make_episode('Episode 2', 'Series', [sentence(200)]), checkpoint=checkpoint)
+
+    replayed = new_index()
+    replayed.load_checkpoint(checkpoint)
+    assert [u['episode'] for u in replayed.utterances] == ['Episode 0'] * 5 + ['Episode 1'] * 5 + ['Episode 2']
+    np.testing.assert_array_equal(replayed.all_vectors(), resumed.all_vectors())
+
+
+def test_compact_checkpoint_writes_a_loadable_database(tmp_path):
+    checkpoint = str(tmp_path / 'temp')
+    live = ingest(checkpoint)
+
+    destination = str(tmp_path / 'db')
+    new_index().compact_checkpoint(checkpoint, destination, remove=True)
+    assert not Checkpoint(checkpoint, DIMENSION).exists()
+
+    loaded = new_index()
+    loaded.load_database(destination)
+    assert list(loaded.utterances) == list(live.utterances)
+    np.testing.assert_array_equal(loaded.all_vectors(), live.all_vectors())
@@ -0,0 +1,73 @@
+import pytest
+
+from chunking import Chunker
+from conftest import make_episode, new_index, sentence
+from embedding import count_tokens
+
+
+def transcript(lengths):
+    """Utterances of the given numbers of words, one second apart"""
+    return [{'text': sentence(i, words), 'start': f'00:00:{i:02d}', 'end': f'00:00:{i:02d}'}
+            for i, words in enumerate(lengths)]
+
+
+def covered(window):
+    """The (start, text) of the utterances a window was built from, recovered from its parts"""
+    parts = window['parts']
+    texts = []
+    for part, following in zip(parts, parts[1:] + [None]):
+        stop = following['offset'] - 1 if following else len(window['text'])
+        texts.append((part['start'], window['text'][part['offset']:stop]))
+    return texts
+
+
+def test_windows_are_token_capped_and_cover_every_utterance_in_order():
+    utterances = transcript([3, 5, 2, 8, 1, 4, 6, 2, 3, 7])
+    windows = Chunker(max_tokens=30)(utterances)
+
+    assert len(windows) < len(utterances)
+    for window in windows:
+        assert sum(count_tokens(text) for _, text in covered(window)) <= 30
+        assert window['start'] == window['parts'][0]['start']
+        assert window['end'] == window['parts'][-1]['end']
+    assert [text for window in windows for _, text in covered(window)] == [u['text'] for u in utterances]
+
+
+def test_an_utterance_over_the_cap_is_a_window_on_its_own():
+    utterances = transcript([2, 200, 2])
+    windows = Chunker(max_tokens=20)(utterances)
+    assert [len(window['parts']) for window in windows] == [1, 1, 1]
+    assert windows[1]['text'] == utterances[1]['text']
+
+
+def test_overlap_repeats_the_last_utterances_of_each_window():
+    utterances = transcript([4] * 12)
+    windows = Chunker(max_tokens=30, overlap=2)(utterances)
+
+    for previous, window in zip(windows, windows[1:]):
+        assert covered(window)[:2] == covered(previous)[-2:]
+    # Every utterance still appears, and the last window ends the transcript
+    starts = {start for window in windows for start, _ in covered(window)}
+    assert starts == {u['start'] for u in utterances}
+    assert windows[-1]['end'] == utterances[-1]['end']
+
+
+def test_overlap_always_moves_forward():
+    # Windows of one utterance each cannot step back by the overlap
+    windows = Chunker(max_tokens=1, overlap=3)(transcript([5, 5, 5, 5]))
+    assert len(windows) == 4
+
+
+def test_negative_overlap_is_rejected():
+    with pytest.raises(ValueError):
+        Chunker(overlap=-1)
+
+
+def test_index_stores_windows_with_their_parts():
+    index = new_index(chunker=Chunker(max_tokens=40))
+    texts = [sentence(i, 4) for i in range(10)]
+    index.add_episode(make_episode('Episode', 'Series', texts), checkpoint=None)
+
+    assert len(index.utterances) == index.index.ntotal < len(texts)
+    assert all('parts' in utterance for utterance in index.utterances)
+    assert ' '.join(utterance['text'] for utterance in index.utterances) == ' '.join(texts)
@@ -0,0 +1,95 @@
+import os
+
+import numpy as np
+import pytest
+
+import ann
+from conftest import make_episode, new_index, sentence
+from embedding_store import EmbeddingStore
+from stub_services import stub_embedding
+
+
+TEXTS = [sentence(i) for i in range(60)]
+QUERIES = [sentence(i) for i in (3, 31, 57)] + ['the serpent in the garden', 'a river from the mountain']
+
+
+def ingest(**index_args):
+    index = new_index(**index_args)
+    for e in range(3):
+        index.add_episode(make_episode(f'Episode {e}', 'Series', TEXTS[e * 20:(e + 1) * 20]), checkpoint=None)
+    return index
+
+
+def top(index, query, k=5):
+    return [result['text'] for result in index.search(query, k=k, collapse=False)]
+
+
+@pytest.mark.parametrize('index_type', ['sq8', 'sq_fp16'])
+def test_reranked_compressed_search_matches_flat(index_type):
+    flat = ingest()
+    compressed = ingest()
+    compressed.build_ann_index(index_type)
+
+    np.testing.assert_array_equal(compressed.all_vectors(), flat.all_vectors())
+    for query in QUERIES:
+        assert top(compressed, query) == top(flat, query)
+
+
+def test_full_vectors_survive_save_and_mmap_load(tmp_path):
+    index = ingest()
+    index.build_ann_index('sq8')
+    filename = str(tmp_path / 'db')
+    index.save_database(filename)
+    assert os.path.exists(f'{filename}.vectors')
+
+    loaded = new_index()
+    loaded.load_database(filename, mmap=True)
+    assert loaded.index_type == 'sq8'
+    np.testing.assert_array_equal(loaded.all_vectors(), index.all_vectors())
+    np.testing.assert_array_equal(ann.database_vectors(filename), index.all_vectors())
+    for query in QUERIES:
+        assert top(loaded, query) == top(index, query)
+
+
+def test_embedding_store_gets_full_precision_vectors(tmp_path):
+    index = ingest()
+    index.build_ann_index('sq8')
+    filename = str(tmp_path / 'db')
+    index.save_database(filename)
+    loaded = new_index()
+    loaded.load_database(filename)
+
+    store = EmbeddingStore(str(tmp_path / 'embeddings'), dimension=index.dimension)
+    assert store.add_index(loaded) == len(TEXTS)
+    embeddings, missing = store.get(TEXTS)
+    assert missing == []
+    np.testing.assert_array_equal(embeddings, index.all_vectors())
+
+
+def test_compressed_database_without_vectors_is_refused(tmp_path):
+    index = ingest()
+    index.build_ann_index('sq8')
+    filename = str(tmp_path / 'db')
+    index.save_database(filename)
+    os.remove(f'{filename}.vectors')
+
+    with pytest.raises(ValueError):
+        ann.database_vectors(filename)
+    loaded = new_index()
+    loaded.load_database(filename)
+    with pytest.raises(ValueError):
+        EmbeddingStore(str(tmp_path / 'embeddings'), dimension=index.dimension).add_index(loaded)
+
+
+def test_reduced_dimension_matches_shortened_embeddings():
+    index = ingest()
+    index.build_ann_index('sq_fp16')
+    index.reduce_dimension(32)
+
+    assert index.dimension == index.index.d == 32
+    expected = np.array([stub_embedding(text, 32) for text in TEXTS])
+    np.testing.assert_allclose(index.all_vectors(), expected, atol=1e-6)
+    # Queries are now embedded at 32 dimensions too
+    assert top(index, TEXTS[42], k=1) == [TEXTS[42]]
+    with pytest.raises(ValueError):
+        index.reduce_dimension(64)
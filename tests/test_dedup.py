@@ -0,0 +1,76 @@
+import numpy as np
+
+from conftest import make_episode, new_index, sentence
+from dedup import DuplicateDetector, collapse_results, location
+
+
+TEXTS = [sentence(i) for i in range(6)]
+
+
+def test_a_repeated_episode_is_stored_once():
+    index = new_index(deduplicator=DuplicateDetector())
+    index.add_episode(make_episode('Episode 1', 'Series', TEXTS), checkpoint=None)
+    index.add_episode(make_episode('Rerun of episode 1', 'Series', TEXTS), checkpoint=None)
+
+    assert len(index.utterances) == index.index.ntotal == len(TEXTS)
+    assert sorted(index.duplicates) == list(range(len(TEXTS)))
+    assert all(locations[0]['episode'] == 'Rerun of episode 1' for locations in index.duplicates.values())
+
+    results = index.search(TEXTS[2], k=1)
+    assert results[0]['text'] == TEXTS[2]
+    assert [place['episode'] for place in results[0]['locations']] == ['Episode 1', 'Rerun of episode 1']
+
+
+def test_short_utterances_are_never_duplicates():
+    index = new_index(deduplicator=DuplicateDetector())
+    index.add_episode(make_episode('Episode 1', 'Series', ['Yeah.', TEXTS[0]]), checkpoint=None)
+    index.add_episode(make_episode('Episode 2', 'Series', ['Yeah.', 'Yeah.']), checkpoint=None)
+
+    assert [u['text'] for u in index.utterances] == ['Yeah.', TEXTS[0], 'Yeah.', 'Yeah.']
+    assert index.duplicates == {}
+
+
+def test_near_duplicate_keeps_its_own_wording():
+    # Stub embeddings of different texts are far apart, so accept any embedding distance here
+    index = new_index(deduplicator=DuplicateDetector(threshold=0.5, max_distance=4.0))
+    index.add_episode(make_episode('Episode 1', 'Series', [TEXTS[0]]), checkpoint=None)
+    near = TEXTS[0][:-1] + ' again.'
+    index.add_episode(make_episode('Episode 2', 'Series', [near]), checkpoint=None)
+
+    assert len(index.utterances) == 1
+    assert index.duplicates[0][0]['text'] == near
+
+
+def test_near_duplicates_need_close_embeddings():
+    detector = DuplicateDetector(threshold=0.5)
+    detector.add(7, TEXTS[0])
+    assert detector.candidates(TEXTS[0][:-1] + ' again.') == [7]
+    assert detector.candidates(TEXTS[3]) == []
+
+    stored = np.eye(4, dtype='float32')[:2]
+    assert detector.confirm(np.array([0, 1, 0.1, 0], dtype='float32'), stored) == 1
+    assert detector.confirm(np.array([0, 0, 1, 0], dtype='float32'), stored) is None
+
+    detector.remove(7, TEXTS[0])
+    assert detector.exact_match(TEXTS[0]) is None
+    assert detector.candidates(TEXTS[0]) == []
+
+
+def test_collapse_results_merges_repeated_passages_only():
+    results = [{'text': TEXTS[0], 'series': 'Series', 'episode': 'Episode 1', 'similarity score': 0.9},
+               {'text': 'Yeah.', 'series': 'Series', 'episode': 'Episode 1', 'similarity score': 0.8},
+               {'text': TEXTS[0].upper(), 'series': 'Series', 'episode': 'Episode 2', 'similarity score': 0.7},
+               {'text': 'Yeah.', 'series': 'Series', 'episode': 'Episode 2', 'similarity score': 0.6}]
+    collapsed = collapse_results(results)
+
+    assert [result['text'] for result in collapsed] == [TEXTS[0], 'Yeah.', 'Yeah.']
+    assert collapsed[0]['locations'] == [{'series': 'Series', 'episode': 'Episode 1'},
+                                         {'series': 'Series', 'episode': 'Episode 2'}]
+
+
+def test_location_keeps_the_chunker_parts():
+    parts = [{'start': '00:00:00', 'end': '00:00:09', 'offset': 0}]
+    utterance = {'text': TEXTS[0], 'series': 'Series', 'episode': 'Episode 1', 'start': '00:00:00',
+                 'end': '00:00:09', 'parts': parts, 'similarity score': 0.5}
+    assert location(utterance) == {'series': 'Series', 'episode': 'Episode 1', 'start': '00:00:00',
+                                   'end': '00:00:09', 'parts': parts}
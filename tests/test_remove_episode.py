@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+from chunking import Chunker
+from conftest import make_episode, new_index, sentence
+from dedup import DuplicateDetector
+
+
+def ingest(index, checkpoint=None, episodes=3, utterances=4):
+    for e in range(episodes):
+        texts = [sentence(e * utterances + i) for i in range(utterances)]
+        index.add_episode(make_episode(f'Episode {e}', 'Series', texts), checkpoint=checkpoint)
+    return index
+
+
+def episodes_found(index, query, k=12):
+    return {result['episode'] for result in index.search(query, k=k)}
+
+
+def test_removed_episode_is_not_searched():
+    index = ingest(new_index())
+    assert 'Episode 1' in episodes_found(index, sentence(5))
+
+    assert index.remove_episode('Series', 'Episode 1', checkpoint=None) == 4
+    assert episodes_found(index, sentence(5)) == {'Episode 0', 'Episode 2'}
+    assert index.search(sentence(5), k=5, mode='lexical')[0]['episode'] != 'Episode 1'
+    assert index.search(sentence(5), k=5, episode='Episode 1') == []
+    with pytest.raises(ValueError):
+        index.remove_episode('Series', 'Episode 1', checkpoint=None)
+
+
+def test_removal_keeps_ids_stable_across_save_and_load(tmp_path):
+    index = ingest(new_index())
+    before = list(index.utterances)
+    index.remove_episode('Series', 'Episode 1', checkpoint=None)
+    assert list(index.utterances) == before
+    assert [index.is_removed(idx) for idx in range(len(before))] == [False] * 4 + [True] * 4 + [False] * 4
+
+    filename = str(tmp_path / 'db')
+    index.save_database(filename)
+    loaded = new_index()
+    loaded.load_database(filename)
+    assert list(loaded.utterances) == before
+    assert loaded.removed == index.removed
+    assert episodes_found(loaded, sentence(5)) == {'Episode 0', 'Episode 2'}
+
+
+def test_replayed_removal_matches_live_index(tmp_path):
+    checkpoint = str(tmp_path / 'temp')
+    live = ingest(new_index(), checkpoint)
+    live.remove_episode('Series', 'Episode 1', checkpoint=checkpoint)
+    live.add_episode(make_episode('Episode 3', 'Series', [sentence(50)]), checkpoint=checkpoint)
+
+    replayed = new_index()
+    replayed.load_checkpoint(checkpoint)
+    assert list(replayed.utterances) == list(live.utterances)
+    assert replayed.removed == live.removed
+    np.testing.assert_array_equal(replayed.all_vectors(), live.all_vectors())
+
+
+def test_shared_passage_is_promoted_with_its_parts(tmp_path):
+    checkpoint = str(tmp_path / 'temp')
+    index = new_index(chunker=Chunker(max_tokens=40), deduplicator=DuplicateDetector())
+    texts = [sentence(i) for i in range(4)]
+    index.add_episode(make_episode('Episode 1', 'Series', texts), checkpoint=checkpoint)
+    index.add_episode(make_episode('Rerun', 'Series', texts), checkpoint=checkpoint)
+    stored = len(index.utterances)
+
+    index.remove_episode('Series', 'Episode 1', checkpoint=checkpoint)
+
+    promoted = index.utterances[stored:]
+    assert len(promoted) == stored
+    assert [u['text'] for u in promoted] == [u['text'] for u in index.utterances[:stored]]
+    assert all(u['episode'] == 'Rerun' and u['parts'] for u in promoted)
+    assert index.duplicates == {}
+    assert episodes_found(index, texts[0]) == {'Rerun'}
+
+    replayed = new_index(chunker=Chunker(max_tokens=40), deduplicator=DuplicateDetector())
+    replayed.load_checkpoint(checkpoint)
+    assert list(replayed.utterances) == list(index.utterances)
+
+
+def test_replace_episode_swaps_in_the_new_transcript():
+    index = ingest(new_index())
+    corrected = [sentence(100), sentence(101)]
+    index.replace_episode(make_episode('Episode 1', 'Series', corrected), checkpoint=None)
+
+    live = [index.utterances[idx] for start, stop in index.live_ranges() for idx in range(start, stop)]
+    assert [u['text'] for u in live if u['episode'] == 'Episode 1'] == corrected
+    assert len(live) == 10
+
+
+def test_compact_drops_removed_utterances():
+    index = ingest(new_index())
+    vectors = index.all_vectors()
+    index.remove_episode('Series', 'Episode 0', checkpoint=None)
+    index.compact()
+
+    assert index.removed == []
+    assert [u['episode'] for u in index.utterances] == ['Episode 1'] * 4 + ['Episode 2'] * 4
+    np.testing.assert_array_equal(index.all_vectors(), vectors[4:])
+    assert episodes_found(index, sentence(0)) == {'Episode 1', 'Episode 2'}
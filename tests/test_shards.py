@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+from conftest import DIMENSION, make_episode, new_index, sentence
+from shards import ShardedIndex
+
+
+SERIES = {'Torah': 0, 'Prophets': 10}
+
+
+def series_index(series, first):
+    index = new_index()
+    for e in range(2):
+        texts = [sentence(first + e * 5 + i) for i in range(5)]
+        index.add_episode(make_episode(f'{series} {e}', series, texts), checkpoint=None)
+    return index
+
+
+def build(directory):
+    sharded = ShardedIndex(str(directory), max_workers=2, index_args={'dimension': DIMENSION})
+    for series, first in SERIES.items():
+        sharded.add_shard(series.lower(), series_index(series, first))
+    return sharded
+
+
+def test_sharded_search_matches_a_single_index(tmp_path):
+    sharded = build(tmp_path)
+    single = new_index()
+    for series, first in SERIES.items():
+        for e in range(2):
+            texts = [sentence(first + e * 5 + i) for i in range(5)]
+            single.add_episode(make_episode(f'{series} {e}', series, texts), checkpoint=None)
+
+    for query in (sentence(3), sentence(17), 'temple in the desert'):
+        expected = single.search(query, k=6)
+        found = sharded.search(query, k=6)
+        assert [(r['episode'], r['text']) for r in found] == [(r['episode'], r['text']) for r in expected]
+        assert [r['similarity score'] for r in found] == pytest.approx([r['similarity score'] for r in expected])
+
+
+def test_series_filter_only_searches_its_shard(tmp_path):
+    sharded = build(tmp_path)
+    assert sharded.names('Prophets') == ['prophets']
+
+    results = sharded.search(sentence(3), k=5, series='Prophets')
+    assert {result['series'] for result in results} == {'Prophets'}
+    assert 'torah' not in sharded.shards
+
+
+def test_manifest_survives_a_failed_write(tmp_path, monkeypatch):
+    sharded = build(tmp_path)
+    with open(tmp_path / 'shards.json') as f:
+        manifest = json.load(f)
+
+    def interrupted(*args, **kwargs):
+        raise OSError('disk full')
+    monkeypatch.setattr(json, 'dump', interrupted)
+    with pytest.raises(OSError):
+        sharded.remove_shard('torah')
+    monkeypatch.undo()
+
+    with open(tmp_path / 'shards.json') as f:
+        assert json.load(f) == manifest
+
+
+def test_removed_shard_stays_removed(tmp_path):
+    build(tmp_path).remove_shard('torah')
+
+    reopened = ShardedIndex(str(tmp_path), index_args={'dimension': DIMENSION})
+    assert reopened.names() == ['prophets']
+    assert {result['series'] for result in reopened.search(sentence(3), k=5)} == {'Prophets'}
+    with pytest.raises(KeyError):
+        reopened.load_shard('torah')